@@ -0,0 +1,280 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Run the fgcloud checks against the local fake OpenStack API
+
+The fake (see fake_openstack.py) is started in this process, with a
+tempest.conf / accounts.yaml pair per user written to a temporary directory.
+Each check is then run as check_openstack.sh runs it (python -m subunit.run
+piped into monitoring.subunit_filter), --runs times, and reported with its
+wall time, the CPU time of its processes (tests and filter), the requests it
+made to the fake (per service and per call) and its Nagios status :
+
+ * values : test_basic_values (no API call but the token : the cost of
+   tempest itself; two of its tests fail on purpose, CRITICAL is expected)
+ * isolation : test_user_isolation_setup (user a, output dropped) and
+   test_user_isolation_run (user b), side by side as in check_isolation.sh
+ * scenario : test_basic_scenario, up to its connectivity check (ping and
+   SSH to the floating IP), which fails as the servers of the fake do not
+   exist (CRITICAL is expected)
+
+    python benchmarks/bench_checks.py --runs 3 --latency compute=lognormal:-3,0.5 --build-time const:2
+    python benchmarks/bench_checks.py --checks isolation --error 500:0.02:GET:volume --json
+
+Must be run from the top directory, inside the tempest virtual environment.
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_openstack
+
+DIRNAME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRNAME)
+
+from monitoring import check_sites  # noqa
+from monitoring import subunit_filter  # noqa
+
+PREFIX = 'tempest.api.fgcloud.'
+# Tests of each check : (test id, user, output filtered)
+CHECKS = {
+    'values': [('test_basic_values', 'a', True)],
+    'isolation': [('test_user_isolation_setup', 'a', False),
+                  ('test_user_isolation_run', 'b', True)],
+    'scenario': [('test_basic_scenario', 'a', True)],
+}
+TENANT = 'bench'
+ACCOUNT = """- username: 'bench_user_%(user)s'
+  tenant_name: '%(tenant)s'
+  password: 'secret'
+  resources:
+    network: '%(network)s'
+"""
+CONFIG = """[DEFAULT]
+use_stderr = false
+
+[auth]
+use_dynamic_credentials = false
+test_accounts_file = %(accounts)s
+
+[identity]
+uri = %(url)s/identity/v2.0
+auth_version = v2
+region = %(region)s
+
+[identity-feature-enabled]
+api_v3 = false
+
+[compute]
+image_ref = %(image)s
+image_ref_alt = %(image_alt)s
+flavor_ref = 1
+flavor_ref_alt = 2
+fixed_network_name = %(network)s
+build_interval = 1
+build_timeout = %(build_timeout)d
+ready_wait = 0
+
+[compute-feature-enabled]
+snapshot = true
+
+[volume]
+build_interval = 1
+build_timeout = %(build_timeout)d
+
+[volume-feature-enabled]
+api_v1 = false
+snapshot = true
+
+[network]
+floating_network_name = %(pool)s
+public_network_id = %(pool_id)s
+
+[service_available]
+nova = true
+cinder = true
+glance = true
+neutron = true
+swift = false
+
+[validation]
+run_validation = false
+connect_timeout = 1
+ssh_timeout = 1
+ping_timeout = 1
+
+[oslo_concurrency]
+lock_path = %(tmp)s
+
+[fgcloud]
+site_id = bench
+handoff_dir = %(tmp)s
+handoff_timeout = %(build_timeout)d
+token_cache_dir = %(tmp)s/tokens-%(user)s
+"""
+
+
+def write_configs(tmp, url, build_timeout):
+    """tempest-<user>.conf of each user, in tmp"""
+    for user in ('a', 'b'):
+        values = {'tmp': tmp, 'url': url, 'user': user, 'tenant': TENANT,
+                  'region': fake_openstack.REGION,
+                  'accounts': os.path.join(tmp, 'accounts-%s.yaml' % user),
+                  'image': fake_openstack.IMAGES[0][1],
+                  'image_alt': fake_openstack.IMAGES[1][1],
+                  'network': fake_openstack.NETWORK[0],
+                  'pool': fake_openstack.FIP_POOL[0],
+                  'pool_id': fake_openstack.FIP_POOL[1],
+                  'build_timeout': build_timeout}
+        with open(values['accounts'], 'w') as accounts:
+            accounts.write(ACCOUNT % values)
+        with open(os.path.join(tmp, 'tempest-%s.conf' % user), 'w') as conf:
+            conf.write(CONFIG % values)
+
+
+def run_check(name, args, tmp):
+    """Run the tests of a check at once, as check_openstack.sh would"""
+    processes = []
+    filtered = None
+    for test, user, report in CHECKS[name]:
+        env = dict(os.environ, TEMPEST_CONFIG_DIR=tmp,
+                   TEMPEST_CONFIG='tempest-%s.conf' % user)
+        if not report:
+            processes.append(subprocess.Popen(
+                [sys.executable, '-m', 'subunit.run', PREFIX + test],
+                cwd=args.tempest_dir, env=env,
+                stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT))
+            continue
+        test_process = subprocess.Popen(
+            [sys.executable, '-m', 'subunit.run', PREFIX + test],
+            cwd=args.tempest_dir, env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT)
+        filtered = subprocess.Popen(
+            [sys.executable, '-m', 'monitoring.subunit_filter',
+             '-t', str(args.max_time)],
+            cwd=DIRNAME, env=dict(env, PYTHONPATH=DIRNAME),
+            stdin=test_process.stdout, stdout=subprocess.PIPE)
+        test_process.stdout.close()
+        processes.append(test_process)
+    output = filtered.communicate()[0].decode('utf-8', 'replace')
+    for process in processes:
+        process.wait()
+    return filtered.returncode, output
+
+
+def measure(name, args, cloud, tmp):
+    cloud.reset()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    returncode, output = run_check(name, args, tmp)
+    wall_time = time.time() - start
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    own_after = resource.getrusage(resource.RUSAGE_SELF)
+    site = check_sites.Site(name)
+    site.parse(returncode, output)
+    stats = cloud.stats()
+    return {'check': name,
+            'status': subunit_filter.STATUS_ALL[site.status],
+            'wall_time': round(wall_time, 3),
+            'cpu_user': round(children_after.ru_utime -
+                              children.ru_utime, 3),
+            'cpu_system': round(children_after.ru_stime -
+                                children.ru_stime, 3),
+            'fake_cpu': round(own_after.ru_utime + own_after.ru_stime -
+                              own.ru_utime - own.ru_stime, 3),
+            'requests': stats['requests'],
+            'by_service': stats['by_service'],
+            'by_call': stats['by_call'],
+            'by_status': stats['by_status'],
+            'injected_errors': stats['injected_errors'],
+            'perfdata': site.perfdata,
+            'output': output if args.verbose else site.header}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Run the fgcloud checks against a local fake OpenStack '
+                    'API')
+    parser.add_argument('--checks', nargs='+', choices=sorted(CHECKS),
+                        default=['values', 'isolation'],
+                        help='Checks to run')
+    parser.add_argument('--runs', type=int, default=1,
+                        help='Runs of each check')
+    parser.add_argument('-t', '--timeout', dest='max_time', type=int,
+                        default=180,
+                        help='Timeout of the checks (subunit_filter -t)')
+    parser.add_argument('--build-timeout', type=int, default=60,
+                        help='[compute]build_timeout of the tests')
+    parser.add_argument('--tempest-dir',
+                        default=os.path.join(DIRNAME, 'tempest'),
+                        help='Tempest directory the tests are run from')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the results as JSON')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Keep the whole output of the checks')
+    fake_openstack.add_arguments(parser)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    try:
+        cloud = fake_openstack.from_arguments(args)
+    except ValueError as exc:
+        sys.stderr.write('%s\n' % exc)
+        return 2
+    server = fake_openstack.start(cloud)
+    tmp = tempfile.mkdtemp(prefix='bench_checks.')
+    try:
+        write_configs(tmp, cloud.url, args.build_timeout)
+        results = []
+        for name in args.checks:
+            for run in range(args.runs):
+                result = measure(name, args, cloud, tmp)
+                result['run'] = run + 1
+                results.append(result)
+    finally:
+        server.shutdown()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return 0
+    print('%-10s %4s %-9s %10s %9s %9s %9s %9s' % (
+        'check', 'run', 'status', 'wall time', 'cpu user', 'cpu sys',
+        'fake cpu', 'requests'))
+    for result in results:
+        print('%(check)-10s %(run)4d %(status)-9s %(wall_time)9.2fs '
+              '%(cpu_user)8.2fs %(cpu_system)8.2fs %(fake_cpu)8.2fs '
+              '%(requests)9d' % result)
+    for result in results:
+        print('\n[%s #%d] %s' % (result['check'], result['run'],
+                                 result['output']))
+        for call, count in sorted(result['by_call'].items(),
+                                  key=lambda item: -item[1]):
+            print('  %5d %s' % (count, call))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compare per-resource polling with the BatchPoller of fgcloud/polling.py
+
+The local fake OpenStack API (see fake_openstack.py) builds N servers and N
+volumes, each of them getting ACTIVE / available after a random build time. 2N
+threads wait for them with the tempest rest clients, first with a GET per
+resource and per poll, then through the shared BatchPoller. The requests
+served by the fake endpoint and the wall time are reported for each N :
+
+    PYTHONPATH=. python ../benchmarks/bench_status_poller.py --concurrency 1 4 16
+
+Must be run from the tempest directory (the fgcloud modules are imported as
+tempest.api.fgcloud), inside the tempest virtual environment.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+
+from six.moves.urllib import parse as urlparse
+
+from tempest.api.fgcloud import executor
+from tempest.api.fgcloud import options
+from tempest.api.fgcloud import polling
+from tempest.lib import auth
+from tempest.lib.common import rest_client
+
+import fake_openstack
+
+TENANT = 'bench'
+
+
+class ServersClient(rest_client.RestClient):
+    """Calls of the tempest servers client, without schema validation"""
+
+    def list_servers(self, detail=False, **params):
+        url = 'servers/detail' if detail else 'servers'
+        if params:
+            url += '?%s' % urlparse.urlencode(params)
+        resp, body = self.get(url)
+        return rest_client.ResponseBody(resp, json.loads(body))
+
+    def show_server(self, server_id):
+        resp, body = self.get('servers/%s' % server_id)
+        return rest_client.ResponseBody(resp, json.loads(body))
+
+    def create_server(self, **server):
+        resp, body = self.post('servers', json.dumps({'server': server}))
+        return rest_client.ResponseBody(resp, json.loads(body))
+
+
+class VolumesClient(rest_client.RestClient):
+    """Calls of the tempest volumes client, without schema validation"""
+
+    def list_volumes(self, detail=False, params=None):
+        url = 'volumes/detail' if detail else 'volumes'
+        if params:
+            url += '?%s' % urlparse.urlencode(params)
+        resp, body = self.get(url)
+        return rest_client.ResponseBody(resp, json.loads(body))
+
+    def show_volume(self, volume_id):
+        resp, body = self.get('volumes/%s' % volume_id)
+        return rest_client.ResponseBody(resp, json.loads(body))
+
+    def create_volume(self, **volume):
+        resp, body = self.post('volumes', json.dumps({'volume': volume}))
+        return rest_client.ResponseBody(resp, json.loads(body))
+
+
+def run(cloud, servers_client, volumes_client, concurrency, batch):
+    options.CONF.set_override('poll_batch', batch, 'fgcloud')
+    polling._pollers.clear()
+    polling.reset()
+    waits = []
+    for _ in range(concurrency):
+        server = servers_client.create_server(
+            name='bench', imageRef=fake_openstack.IMAGES[0][1],
+            flavorRef=fake_openstack.FLAVORS[0][0])['server']
+        waits.append((polling.wait_for_server_status, servers_client,
+                      server['id'], 'ACTIVE', {'ready_wait': False}))
+        volume = volumes_client.create_volume(size=1)['volume']
+        waits.append((polling.wait_for_volume_status, volumes_client,
+                      volume['id'], 'available', {}))
+    errors = []
+
+    def waiter(func, client, resource_id, status, kwargs):
+        try:
+            # Each thread has its own connection, as in the fgcloud tests
+            func(executor.clone(client), resource_id, status, **kwargs)
+        except Exception as exc:
+            errors.append(exc)
+
+    cloud.reset()
+    start = time.time()
+    threads = [threading.Thread(target=waiter, args=w) for w in waits]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.time() - start
+    if errors:
+        raise errors[0]
+    return {'mode': 'batch' if batch else 'per-resource',
+            'concurrency': concurrency,
+            'requests': cloud.stats()['requests'],
+            'polls': sum(s['polls'] for s in polling.stats().values()),
+            'wall_time': round(wall_time, 3)}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Compare per-resource and batched status polling')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 4, 16, 64],
+                        help='Numbers of servers (and of volumes) waited for')
+    parser.add_argument('--build-time', type=float, default=4,
+                        help='Longest build time of a resource (seconds)')
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='Latency of each API call (seconds)')
+    parser.add_argument('--json', action='store_true',
+                        help='Print the results as JSON')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    options.CONF([], project='tempest', default_config_files=[])
+    options.CONF.set_override('poll_max_interval', {'default': '2'},
+                              'fgcloud')
+
+    build_time = 'uniform:%s,%s' % (args.build_time / 2, args.build_time)
+    cloud = fake_openstack.FakeOpenStack(
+        latency=fake_openstack.distributions(
+            None, 'const:%s' % args.latency),
+        build_time=fake_openstack.distributions(
+            ['server=' + build_time, 'volume=' + build_time], 'const:0'))
+    server = fake_openstack.start(cloud)
+
+    provider = auth.KeystoneV2AuthProvider(
+        auth.KeystoneV2Credentials(username=TENANT, password=TENANT,
+                                   tenant_name=TENANT),
+        cloud.url + '/identity/v2.0')
+    servers_client = ServersClient(provider, 'compute',
+                                   fake_openstack.REGION,
+                                   build_timeout=10 * args.build_time)
+    volumes_client = VolumesClient(provider, 'volumev2',
+                                   fake_openstack.REGION,
+                                   build_timeout=10 * args.build_time)
+    provider.set_auth()
+
+    results = []
+    for concurrency in args.concurrency:
+        for batch in (False, True):
+            results.append(run(cloud, servers_client, volumes_client,
+                               concurrency, batch))
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print('%-14s %12s %10s %8s %10s' % ('mode', 'concurrency', 'requests',
+                                        'polls', 'wall time'))
+    for result in results:
+        print('%(mode)-14s %(concurrency)12d %(requests)10d %(polls)8d '
+              '%(wall_time)9.2fs' % result)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compare the subunit-trace | awk pipeline with monitoring.subunit_filter.
+
+Either replay a recorded stream (raw output of `python -m subunit.run` or
+`ostestr --subunit`, stderr included) or generate a synthetic one :
+
+    python benchmarks/bench_subunit_filter.py --stream recorded.subunit
+    python benchmarks/bench_subunit_filter.py --tests 500 --log-lines 200
+
+Must be run from the top directory, inside the tempest virtual environment.
+"""
+
+import argparse
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import subunit
+
+DIRNAME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEGACY = os.path.join(DIRNAME, 'benchmarks', 'legacy_getperfdata.sh')
+
+TEST_ID = 'tempest.api.fgcloud.test_bench.TestBench.test_%05d'
+LOG = ('%s 4242 INFO tempest.lib.common.rest_client [req-%05d] Request '
+       '(TestBench:test_%05d): 200 GET http://controller:8774/v2.1/servers '
+       '0.%03ds\n')
+
+
+def generate_stream(output, tests, log_lines, failures, skips):
+    """Write a synthetic subunit v2 stream mixed with stderr log lines."""
+    writer = subunit.StreamResultToBytes(output)
+    now = datetime.datetime(2016, 1, 1, tzinfo=subunit.iso8601.UTC)
+    step = datetime.timedelta(milliseconds=150)
+    for i in range(tests):
+        test_id = TEST_ID % i
+        writer.status(test_id=test_id, test_status='inprogress',
+                      timestamp=now)
+        for j in range(log_lines):
+            output.write((LOG % (now.strftime('%Y-%m-%d %H:%M:%S.%f'),
+                                 i, i, j % 1000)).encode('utf-8'))
+        now += step
+        if i < failures:
+            trace = ('Traceback (most recent call last):\n'
+                     '  File "test_bench.py", line %d, in test_%05d\n'
+                     '    self.assertEqual(4, 5)\n'
+                     'MismatchError: 4 != 5\n' % (i, i)).encode('utf-8')
+            writer.status(test_id=test_id, file_name='traceback',
+                          file_bytes=trace, eof=True,
+                          mime_type='text/x-traceback; charset=utf8')
+            writer.status(test_id=test_id, test_status='fail',
+                          timestamp=now)
+        elif i < failures + skips:
+            writer.status(test_id=test_id, file_name='reason',
+                          file_bytes=b'Skipped Test', eof=True,
+                          mime_type='text/plain; charset=utf8')
+            writer.status(test_id=test_id, test_status='skip',
+                          timestamp=now)
+        else:
+            writer.status(test_id=test_id, test_status='success',
+                          timestamp=now)
+
+
+def run(cmd, stream_path, env=None):
+    with open(stream_path, 'rb') as stream:
+        start = time.time()
+        proc = subprocess.Popen(cmd, stdin=stream, stdout=subprocess.PIPE,
+                                env=env, cwd=DIRNAME)
+        out = proc.communicate()[0]
+        return time.time() - start, proc.returncode, out
+
+
+def run_legacy(stream_path, subunit_trace, max_time):
+    trace_time, trace_status, trace_out = run([subunit_trace], stream_path)
+    with tempfile.NamedTemporaryFile(suffix='.trace') as trace:
+        trace.write(trace_out)
+        trace.flush()
+        env = dict(os.environ, MAXTIME=str(max_time),
+                   TRACE_STATUS=str(trace_status))
+        awk_time, status, out = run(['bash', LEGACY], trace.name, env=env)
+    return trace_time, awk_time, status, out
+
+
+def run_filter(stream_path, max_time):
+    env = dict(os.environ, PYTHONPATH=DIRNAME)
+    return run([sys.executable, '-m', 'monitoring.subunit_filter',
+                '-t', str(max_time)], stream_path, env=env)
+
+
+def status_line(out):
+    """Last line without exec_time, which is wall clock dependant."""
+    line = out.decode('utf-8', 'replace').rstrip('\n').split('\n')[-1]
+    return ' '.join(v for v in line.split(' ')
+                    if not v.startswith('exec_time='))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--stream', help='Recorded subunit v2 stream')
+    parser.add_argument('--tests', type=int, default=500)
+    parser.add_argument('--log-lines', type=int, default=100,
+                        help='stderr log lines per test')
+    parser.add_argument('--failures', type=int, default=5)
+    parser.add_argument('--skips', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-t', '--timeout', dest='max_time', type=int,
+                        default=180)
+    parser.add_argument('--subunit-trace', default=os.path.join(
+        os.path.dirname(sys.executable), 'subunit-trace'))
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    stream_path = args.stream
+    if stream_path is None:
+        fd, stream_path = tempfile.mkstemp(suffix='.subunit')
+        with os.fdopen(fd, 'wb') as output:
+            generate_stream(output, args.tests, args.log_lines,
+                            args.failures, args.skips)
+    size = os.path.getsize(stream_path)
+    print('Stream : %s (%.1f MB)' % (stream_path, size / 1048576.0))
+
+    legacy, new = [], []
+    try:
+        for i in range(args.repeat):
+            trace_time, awk_time, legacy_status, legacy_out = run_legacy(
+                stream_path, args.subunit_trace, args.max_time)
+            legacy.append((trace_time, awk_time))
+            new_time, new_status, new_out = run_filter(stream_path,
+                                                       args.max_time)
+            new.append(new_time)
+    finally:
+        if args.stream is None:
+            os.remove(stream_path)
+
+    trace_time = min(t for t, a in legacy)
+    awk_time = min(a for t, a in legacy)
+    print('subunit-trace           : %8.3fs' % trace_time)
+    print('awk getPerfData         : %8.3fs' % awk_time)
+    print('legacy total            : %8.3fs' % (trace_time + awk_time))
+    print('monitoring.subunit_filter: %7.3fs' % min(new))
+    print('speedup                 : %8.1fx' %
+          ((trace_time + awk_time) / max(min(new), 1e-6)))
+
+    same = (legacy_status == new_status and
+            status_line(legacy_out) == status_line(new_out))
+    print('same status/perfdata    : %s' % same)
+    if not same:
+        print('  legacy : exit %d %s' % (legacy_status,
+                                          status_line(legacy_out)))
+        print('  filter : exit %d %s' % (new_status, status_line(new_out)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
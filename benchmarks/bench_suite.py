@@ -0,0 +1,442 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Offline benchmarks of what a check costs on our side
+
+Each part of the overhead of a check is measured on its own, --repeat times
+(the median is kept), without any cloud :
+
+ * startup : the interpreter alone, then the imports of tempest and of the
+   fgcloud tests (with a tempest.conf to parse)
+ * discovery : the test discovery run by ostestr / testr before the tests
+   of a --regex (python -m subunit.run discover --list), and the number of
+   tests matching the regex
+ * filter : monitoring.subunit_filter on synthetic streams of --sizes bytes
+   and on the recorded --stream files
+ * handoff : the isolation rendezvous of fgcloud/handoff.py (listen and
+   connect, fixture publish -> receive, done -> wait_done)
+ * client : each tempest client call against the fake OpenStack API (see
+   fake_openstack.py) run in another process without latency, so that the
+   wall and CPU time are those of the client : token, show / list servers,
+   show volume, and a bare HTTP GET for reference
+
+The results are written as JSON (--output), with the git version of the tree.
+Given the results of another version (--baseline), the timings more than
+--tolerance (and --min-delta seconds) slower are listed, and the exit status
+is 1 :
+
+    python benchmarks/bench_suite.py --output bench-$(git describe --always).json
+    python benchmarks/bench_suite.py --only filter client --baseline bench-1a2b3c.json
+
+Must be run from the top directory, inside the tempest virtual environment.
+"""
+
+import argparse
+import datetime
+import io
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import bench_checks
+import bench_subunit_filter
+import fake_openstack
+
+DIRNAME = bench_checks.DIRNAME
+PARTS = ('startup', 'discovery', 'filter', 'handoff', 'client')
+SIZES = ('1K', '100K', '1M', '10M', '50M')
+UNITS = {'K': 1024, 'M': 1048576}
+REGEX = r'^tempest\.api\.fgcloud\.'
+IMPORTS = ('tempest.test', 'tempest.api.fgcloud.test_basic_scenario',
+           'tempest.api.fgcloud.test_user_isolation_run')
+# Log lines per test of the synthetic streams
+LOG_LINES = 20
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def parse_size(size):
+    if size[-1:].upper() in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1:].upper()])
+    return int(size)
+
+
+def timed(cmd, repeat, check=True, **kwargs):
+    """Median wall time of a command, and its last output"""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, **kwargs)
+        out, err = proc.communicate()
+        times.append(time.time() - start)
+        if check and proc.returncode:
+            raise RuntimeError('%s failed (%d) : %s' % (
+                ' '.join(cmd), proc.returncode,
+                err.decode('utf-8', 'replace')[-500:]))
+    return median(times), out
+
+
+def tempest_env(args):
+    return dict(os.environ, TEMPEST_CONFIG_DIR=args.tmp,
+                TEMPEST_CONFIG='tempest-a.conf')
+
+
+def bench_startup(args):
+    env = tempest_env(args)
+    interpreter, _ = timed([sys.executable, '-c', 'pass'], args.repeat)
+    imports, _ = timed([sys.executable, '-c', 'import %s' %
+                        ', '.join(IMPORTS)], args.repeat,
+                       cwd=args.tempest_dir, env=env)
+    return {'interpreter_s': round(interpreter, 4),
+            'tempest_import_s': round(imports - interpreter, 4),
+            'total_s': round(imports, 4)}
+
+
+class _Ids(object):
+    """StreamResult collecting the test ids of a --list stream"""
+
+    def __init__(self):
+        self.ids = []
+
+    def status(self, test_id=None, test_status=None, **kwargs):
+        if test_id and test_status == 'exists':
+            self.ids.append(test_id)
+
+    def startTestRun(self):
+        pass
+
+    def stopTestRun(self):
+        pass
+
+
+def bench_discovery(args):
+    import subunit
+
+    cmd = [sys.executable, '-m', 'subunit.run', 'discover', '-t', './',
+           './tempest/test_discover', '--list']
+    # Modules which fail to import are listed too (as failing tests)
+    seconds, out = timed(cmd, args.repeat, check=False,
+                         cwd=args.tempest_dir, env=tempest_env(args))
+    ids = _Ids()
+    subunit.ByteStreamToStreamResult(io.BytesIO(out),
+                                     non_subunit_name='stdout').run(ids)
+    regex = re.compile(args.regex)
+    return {'discovery_s': round(seconds, 4),
+            'tests': len(ids.ids),
+            'matching_tests': len([i for i in ids.ids if regex.search(i)]),
+            'regex': args.regex}
+
+
+def synthetic_stream(path, size):
+    """Synthetic stream of about size bytes (see bench_subunit_filter.py)"""
+    sample = io.BytesIO()
+    bench_subunit_filter.generate_stream(sample, 1, LOG_LINES, 0, 0)
+    per_test = len(sample.getvalue())
+    tests = max(1, size // per_test)
+    log_lines = min(LOG_LINES, LOG_LINES * size // per_test)
+    with open(path, 'wb') as output:
+        bench_subunit_filter.generate_stream(output, tests, log_lines,
+                                             min(5, tests // 10),
+                                             min(5, tests // 10))
+
+
+def bench_filter(args):
+    streams = []
+    for size in args.sizes:
+        path = os.path.join(args.tmp, 'synthetic-%s.subunit' % size)
+        synthetic_stream(path, parse_size(size))
+        streams.append(('synthetic-%s' % size, path))
+    for path in args.stream:
+        streams.append((os.path.basename(path), path))
+    results = {}
+    for name, path in streams:
+        times = []
+        for _ in range(args.repeat):
+            seconds, status, out = bench_subunit_filter.run_filter(
+                path, args.max_time)
+            times.append(seconds)
+        seconds = median(times)
+        size = os.path.getsize(path)
+        results[name] = {'bytes': size, 'filter_s': round(seconds, 4),
+                         'mb_per_s': round(size / 1048576.0 / seconds, 2),
+                         'status': status}
+    return results
+
+
+def handoff_fixture():
+    """Fixture shaped as the one of UserIsolationSetup"""
+    def resource(kind, **extra):
+        body = {'id': '%08d-0000-4000-8000-000000000000' % len(kind),
+                'name': '%s_Setup' % kind, 'status': 'ACTIVE',
+                'created_at': '2015-01-01T00:00:00Z',
+                'links': [{'href': 'http://127.0.0.1/%s' % kind,
+                           'rel': 'self'}]}
+        body.update(extra)
+        return body
+
+    return {'server': resource('server', addresses={
+                fake_openstack.NETWORK[0]: [
+                    {'addr': '10.0.0.2', 'version': 4,
+                     'OS-EXT-IPS:type': 'fixed'}]},
+                metadata={}, flavor={'id': '1'}, key_name='key'),
+            'server_snapshot': resource('snapshot', minDisk=1, progress=100),
+            'keypairname': 'key',
+            'security_group': resource('security_group', rules=[]),
+            'rule': resource('rule', ip_protocol='tcp', from_port=22,
+                             to_port=22),
+            'volume1': resource('volume1', size=1, attachments=[]),
+            'metadata': {'key1': 'value1'},
+            'volume2': resource('volume2', size=1, attachments=[]),
+            'vol_snapshot': resource('vol_snapshot', size=1),
+            'attachment': resource('attachment', device='/dev/vdb')}
+
+
+def bench_handoff(args):
+    from tempest.api.fgcloud import handoff
+    from tempest import config
+
+    config.CONF.set_override('handoff_dir', args.tmp, 'fgcloud')
+    fixture = handoff_fixture()
+    timings = {'connect_s': [], 'publish_s': [], 'done_s': [], 'close_s': []}
+    for _ in range(args.repeat):
+        deadline = time.time() + 30
+        start = time.time()
+        publisher = handoff.Publisher('bench')
+        subscriber = handoff.Subscriber(deadline, 'bench')
+        publisher._wait_peer(deadline)
+        connected = time.time()
+        publisher.publish(fixture, deadline)
+        subscriber.receive(deadline)
+        received = time.time()
+        subscriber.done()
+        publisher.wait_done(deadline)
+        finished = time.time()
+        publisher.close()
+        closed = time.time()
+        timings['connect_s'].append(connected - start)
+        timings['publish_s'].append(received - connected)
+        timings['done_s'].append(finished - received)
+        timings['close_s'].append(closed - finished)
+    result = dict((key, round(median(values), 5))
+                  for key, values in timings.items())
+    result['fixture_bytes'] = len(json.dumps(fixture))
+    return result
+
+
+def _free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _per_call(func, calls):
+    """(wall, CPU) time per call of func, in ms"""
+    func()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    for _ in range(calls):
+        func()
+    wall = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (after.ru_utime + after.ru_stime -
+           usage.ru_utime - usage.ru_stime)
+    return {'wall_ms': round(1000 * wall / calls, 3),
+            'cpu_ms': round(1000 * cpu / calls, 3)}
+
+
+def bench_client(args):
+    import httplib2
+
+    from tempest.lib import auth
+    from tempest.lib.services.compute import servers_client
+    from tempest.services.volume.v2.json import volumes_client
+
+    port = _free_port()
+    fake = subprocess.Popen([sys.executable,
+                             os.path.join(DIRNAME, 'benchmarks',
+                                          'fake_openstack.py'),
+                             '--port', str(port)],
+                            stdout=subprocess.PIPE)
+    try:
+        # Serving once it has printed its URL
+        fake.stdout.readline()
+        url = 'http://127.0.0.1:%d' % port
+        credentials = auth.KeystoneV2Credentials(
+            username='bench', password='bench', tenant_name='bench')
+        provider = auth.KeystoneV2AuthProvider(credentials,
+                                               url + '/identity/v2.0')
+        servers = servers_client.ServersClient(
+            provider, 'compute', fake_openstack.REGION)
+        volumes = volumes_client.VolumesClient(
+            provider, 'volumev2', fake_openstack.REGION)
+        server = servers.create_server(
+            name='bench', imageRef=fake_openstack.IMAGES[0][1],
+            flavorRef=fake_openstack.FLAVORS[0][0])['server']
+        volume = volumes.create_volume(size=1)['volume']
+        http = httplib2.Http()
+        token = provider.get_token()
+        server_url = '%s/compute/v2.1/servers/%s' % (url, server['id'])
+
+        def get_token():
+            auth.KeystoneV2AuthProvider(
+                credentials, url + '/identity/v2.0').set_auth()
+
+        calls = [('token', get_token),
+                 ('bare_http_get', lambda: http.request(
+                     server_url, 'GET', headers={'X-Auth-Token': token,
+                                                 'Connection': 'close'})),
+                 ('show_server', lambda: servers.show_server(server['id'])),
+                 ('list_servers_detail',
+                  lambda: servers.list_servers(detail=True)),
+                 ('show_volume', lambda: volumes.show_volume(volume['id']))]
+        return dict((name, _per_call(func, args.calls))
+                    for name, func in calls)
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+def git_version():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=DIRNAME,
+            stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timings(results, prefix=''):
+    """{dotted.name: seconds} of the timings of the results"""
+    flat = {}
+    for key, value in results.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.update(timings(value, name + '.'))
+        elif not isinstance(value, (int, float)):
+            continue
+        elif key.endswith('_ms'):
+            flat[name] = value / 1000.0
+        elif key.endswith('_s'):
+            flat[name] = value
+    return flat
+
+
+def regressions(results, baseline, tolerance, min_delta):
+    """[(name, baseline, current)] of the timings slower than tolerance
+
+    Differences under min_delta seconds are noise, whatever their ratio.
+    """
+    old = timings(baseline)
+    return [(name, old[name], value)
+            for name, value in sorted(timings(results).items())
+            if old.get(name) and value > old[name] * (1 + tolerance) and
+            value - old[name] >= min_delta]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Offline benchmarks of the overhead of the checks')
+    parser.add_argument('--only', nargs='+', choices=PARTS, default=PARTS,
+                        help='Parts to run')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs of each measure (the median is kept)')
+    parser.add_argument('--tempest-dir',
+                        default=os.path.join(DIRNAME, 'tempest'),
+                        help='Tempest directory the tests are run from')
+    parser.add_argument('--regex', default=REGEX,
+                        help='Regex of the discovery')
+    parser.add_argument('--sizes', nargs='+', default=SIZES,
+                        help='Sizes of the synthetic streams (K, M units)')
+    parser.add_argument('--stream', action='append', default=[],
+                        help='Recorded subunit stream (repeat for more)')
+    parser.add_argument('-t', '--timeout', dest='max_time', type=int,
+                        default=180, help='subunit_filter -t')
+    parser.add_argument('--calls', type=int, default=200,
+                        help='Calls of each client call measured')
+    parser.add_argument('--output', help='Write the results to this file')
+    parser.add_argument('--baseline',
+                        help='Results of another version to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Ratio of slowdown reported as a regression')
+    parser.add_argument('--min-delta', type=float, default=0.0005,
+                        help='Slowdowns under it (in seconds) are noise')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    # The fgcloud modules are imported as tempest.api.fgcloud
+    sys.path.insert(0, os.path.abspath(args.tempest_dir))
+    args.tmp = tempfile.mkdtemp(prefix='bench_suite.')
+    bench_checks.write_configs(args.tmp, 'http://127.0.0.1:5000', 60)
+    os.environ.update(tempest_env(args))
+    # The log lines of tempest (one per request) would flood stderr
+    logging.getLogger('tempest').setLevel(logging.WARNING)
+
+    results = {}
+    try:
+        for part in PARTS:
+            if part in args.only:
+                sys.stderr.write('%s...\n' % part)
+                results[part] = globals()['bench_' + part](args)
+    finally:
+        subprocess.call(['rm', '-rf', args.tmp])
+    report = {'version': git_version(),
+              'date': datetime.datetime.utcnow().strftime(
+                  '%Y-%m-%dT%H:%M:%SZ'),
+              'python': platform.python_version(),
+              'host': platform.node(),
+              'repeat': args.repeat,
+              'results': results}
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(data + '\n')
+    else:
+        print(data)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            old = json.load(baseline)
+        slower = regressions(results, old['results'], args.tolerance,
+                             args.min_delta)
+        sys.stderr.write('%d regression(s) from %s (%s)\n' % (
+            len(slower), old.get('version'), args.baseline))
+        for name, before, after in slower:
+            sys.stderr.write('  %-45s %9.4fs -> %9.4fs (+%.0f%%)\n' % (
+                name, before, after, 100.0 * (after - before) / before))
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
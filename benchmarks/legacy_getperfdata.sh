@@ -0,0 +1,117 @@
+#!/bin/bash
+
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+##############################################################################
+# Former getPerfData of check_openstack.sh (subunit-trace | awk pipeline)
+# Kept for benchmarking purpose only, reads the subunit-trace output on stdin
+##############################################################################
+
+MAXTIME=${MAXTIME:-180}
+STATUS_OK=0
+STATUS_WARNING=1
+STATUS_CRITICAL=2
+STATUS_UNKNOWN=3
+STATUS_ALL=('OK' 'WARNING' 'CRITICAL' 'UNKNOWN' 'DEPENDENT')
+
+getPerfData () {
+    STREAM="$1"
+    STATUS=$2
+    OUT=""
+
+    ## Filter output to get values
+
+    # Check if there was at least a test
+    NO_TEST="The test run didn't actually run any tests"
+    if [[ $STREAM =~ $NO_TEST ]]; then 
+        runExit $STATUS_UNKNOWN "$STREAM" "exec_time=0s;;;; nb_tests=0;;;; nb_tests_ok=0;;;; nb_tests_ko=0;;;; nb_skipped=0;;;;"        
+    fi
+
+    # Get test status
+    TIME=$(echo "$STREAM" | awk '/^Ran:.*tests\ in/ {printf "%d", $5}')
+    PASSED=$(echo "$STREAM" | awk '/^\ -\ Passed:/ {print $3}')
+    SKIPPED=$(echo "$STREAM" | awk '/^\ -\ Skipped:/ {print $3}')
+    EXFAIL=$(echo "$STREAM" | awk '/^\ -\ Expected\ Fail:/ {print $4}')
+    UNEXOK=$(echo "$STREAM" | awk '/^\ -\ Unexpected\ Success:/ {print $4}')
+    FAILED=$(echo "$STREAM" | awk '/^\ -\ Failed:/ {print $3}')
+
+    # Construct PerfData for Nagios
+    let NBTESTS=SKIPPED+PASSED+EXFAIL+UNEXOK+FAILED
+    let NB_OK=PASSED+EXFAIL
+    let NB_KO=UNEXOK+FAILED
+    PERFDATA="exec_time="$TIME"s;;;; nb_tests=$NBTESTS;;;; nb_tests_ok=$NB_OK;;;; nb_tests_ko=$NB_KO;;;; nb_skipped=$SKIPPED;;;;"
+    INFODATA="exec_time="$TIME"s nb_tests=$NBTESTS nb_tests_ok=$NB_OK nb_tests_ko=$NB_KO nb_skipped=$SKIPPED"
+
+    # Get LOG output from tests (see tempest.conf/[DEFAULT]/default_log_levels)
+    PATTERN="^2[0-9][0-9][0-9]-"
+    LOGOUTPUT=$(echo "$STREAM" | awk '/^2[0-9][0-9][0-9]-/ {print}')
+    if [[ $LOGOUTPUT =~ $PATTERN ]]; then
+        OUT+="-------------- Captured logging --------------\n"
+        OUT+=$LOGOUTPUT
+    fi
+
+    # Compute output status
+    if [ $PASSED -gt 0 ] || [ $EXFAIL -gt 0 ]; then
+        STATUS=$STATUS_OK
+    fi
+
+    # Throw a Warning
+    if [ $(bc <<< "($MAXTIME - $TIME) < 0") -eq 1 ] || [ $SKIPPED -gt 0 ] || [ $UNEXOK -gt 0 ]; then
+        STATUS=$STATUS_WARNING
+    fi
+
+    # Add list of skipped tests
+    if [ $SKIPPED -gt 0 ]; then
+        OUT+="\n-------------- Skipped Tests --------------\n"
+        OUT+=$(echo "$STREAM" | grep "SKIPPED")
+    fi
+
+    # Add details about the failed tests
+    if [ $FAILED -gt 0 ]; then 
+        STATUS=$STATUS_CRITICAL
+
+        OUT+="\n-------------- Details / Trace --------------\n"
+        # exclude blank lines, OK and SKIPPED tests, LOGOUTPUT
+        OUT+=$(echo "$STREAM" | awk '/(^\s*$)|(.*\ ok$)|(.*\ SKIPPED)|(2[0-9][0-9][0-9]-)|(^~)|(^Sum\ of\ execute\ time)/ {next}; 
+              /^Captured\ pythonlogging/ {cap=1; next} /^Captured\ traceback/ {cap=0;next}; 
+              /^======$/ {skip=20;next} skip>0 {--skip;next};
+              /^.*FAILED$/ {print ""}1;')"\n\n"
+    fi
+
+    # Add a summary
+    OUT+="\n-------------- Summary --------------\n"
+    OUT+=$(echo "$STREAM" | awk 'prt-->0; /^Ran:.*tests\ in/ {prt=5;print}')
+
+    # Add a header
+    OUT="${STATUS_ALL[$STATUS]} : $INFODATA\n"$OUT
+
+    # Go to output/exit
+    runExit $STATUS "$OUT" "$PERFDATA"
+}
+
+runExit () {
+    STATUS=$1
+    OUTPUT="$2"
+    PERFDATA="$3"
+
+    echo -e "$OUTPUT\nStatus : exit $STATUS (${STATUS_ALL[$STATUS]}) | $PERFDATA"
+    exit $STATUS
+}
+
+STREAM=$(cat)
+getPerfData "$STREAM" ${TRACE_STATUS:-0}
+
+##EOF
@@ -44,9 +44,8 @@ runMain () {
     ./check_openstack.sh -c $CONF_FILE_A -- tempest.api.fgcloud.test_user_isolation_setup 2>&1 > /dev/null
     } &
 
-    # Wait some time for the VM to get ready
-    sleep 1
-
+    # No need to wait for user_1 : both sides meet on a socket named after
+    # [fgcloud]site_id and watch each other with heartbeats (fgcloud/handoff.py)
     {
     ./check_openstack.sh -c $CONF_FILE_B -- tempest.api.fgcloud.test_user_isolation_run
     } &
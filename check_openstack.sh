@@ -28,13 +28,13 @@ DIRNAME="$( cd "$(dirname "$0")" ; pwd -P )"
 BLFILE="$DIRNAME/config/tests_blacklist.txt"
 TEMPEST=$DIRNAME/tempest
 RUN_CMD="$TEMPEST/tools/with_venv.sh"
+CHECK_SOCKET=${CHECK_SOCKET:-/tmp/tempest_check_server.sock}
 STATUS_OK=0
 STATUS_WARNING=1
 STATUS_CRITICAL=2
 STATUS_UNKNOWN=3
 STATUS_DEPENDENT=4
 STATUS_ALL=('OK' 'WARNING' 'CRITICAL' 'UNKNOWN' 'DEPENDENT')
-SUBUNIT_TRACE="$TEMPEST/.venv/bin/subunit-trace"
 
 # Functions
 
@@ -45,7 +45,9 @@ usage () {
     echo ""
     echo "  -c, --config <file>             Use a custom tempest.conf file (default : tempest.conf)"
     echo "                                  Must be in $(pwd)/config/"
+    echo "  -a, --adaptive <mode>           Thresholds from the history (percentile or mad), needs --history"
     echo "  -e, --regex '^tempest\.regex'   Launch tests according to the regex (better in quotes)"
+    echo "  -H, --history <file>            Append the perfdata of the run to a history file (SQLite)"
     echo "  -h, --help                      Print this usage message"
     echo "  -t, --timeout <time_in_sec>     Raise a WARNING if the test(s) run longer (default : 180s)"
     echo "  -u, --update                    Update the virtual environment"
@@ -56,81 +58,6 @@ usage () {
     runExit $STATUS_CRITICAL "No test was run !" "exec_time=0s;;;; nb_test=0;;;; nb_tests_ok=0;;;; nb_tests_ko=0;;;; nb_skipped=0;;;;"
 }
 
-getPerfData () {
-    STREAM="$1"
-    STATUS=$2
-    OUT=""
-
-    ## Filter output to get values
-
-    # Check if there was at least a test
-    NO_TEST="The test run didn't actually run any tests"
-    if [[ $STREAM =~ $NO_TEST ]]; then 
-        runExit $STATUS_UNKNOWN "$STREAM" "exec_time=0s;;;; nb_tests=0;;;; nb_tests_ok=0;;;; nb_tests_ko=0;;;; nb_skipped=0;;;;"        
-    fi
-
-    # Get test status
-    TIME=$(echo "$STREAM" | awk '/^Ran:.*tests\ in/ {printf "%d", $5}')
-    PASSED=$(echo "$STREAM" | awk '/^\ -\ Passed:/ {print $3}')
-    SKIPPED=$(echo "$STREAM" | awk '/^\ -\ Skipped:/ {print $3}')
-    EXFAIL=$(echo "$STREAM" | awk '/^\ -\ Expected\ Fail:/ {print $4}')
-    UNEXOK=$(echo "$STREAM" | awk '/^\ -\ Unexpected\ Success:/ {print $4}')
-    FAILED=$(echo "$STREAM" | awk '/^\ -\ Failed:/ {print $3}')
-
-    # Construct PerfData for Nagios
-    let NBTESTS=SKIPPED+PASSED+EXFAIL+UNEXOK+FAILED
-    let NB_OK=PASSED+EXFAIL
-    let NB_KO=UNEXOK+FAILED
-    PERFDATA="exec_time="$TIME"s;;;; nb_tests=$NBTESTS;;;; nb_tests_ok=$NB_OK;;;; nb_tests_ko=$NB_KO;;;; nb_skipped=$SKIPPED;;;;"
-    INFODATA="exec_time="$TIME"s nb_tests=$NBTESTS nb_tests_ok=$NB_OK nb_tests_ko=$NB_KO nb_skipped=$SKIPPED"
-
-    # Get LOG output from tests (see tempest.conf/[DEFAULT]/default_log_levels)
-    PATTERN="^2[0-9][0-9][0-9]-"
-    LOGOUTPUT=$(echo "$STREAM" | awk '/^2[0-9][0-9][0-9]-/ {print}')
-    if [[ $LOGOUTPUT =~ $PATTERN ]]; then
-        OUT+="-------------- Captured logging --------------\n"
-        OUT+=$LOGOUTPUT
-    fi
-
-    # Compute output status
-    if [ $PASSED -gt 0 ] || [ $EXFAIL -gt 0 ]; then
-        STATUS=$STATUS_OK
-    fi
-
-    # Throw a Warning
-    if [ $(bc <<< "($MAXTIME - $TIME) < 0") -eq 1 ] || [ $SKIPPED -gt 0 ] || [ $UNEXOK -gt 0 ]; then
-        STATUS=$STATUS_WARNING
-    fi
-
-    # Add list of skipped tests
-    if [ $SKIPPED -gt 0 ]; then
-        OUT+="\n-------------- Skipped Tests --------------\n"
-        OUT+=$(echo "$STREAM" | grep "SKIPPED")
-    fi
-
-    # Add details about the failed tests
-    if [ $FAILED -gt 0 ]; then 
-        STATUS=$STATUS_CRITICAL
-
-        OUT+="\n-------------- Details / Trace --------------\n"
-        # exclude blank lines, OK and SKIPPED tests, LOGOUTPUT
-        OUT+=$(echo "$STREAM" | awk '/(^\s*$)|(.*\ ok$)|(.*\ SKIPPED)|(2[0-9][0-9][0-9]-)|(^~)|(^Sum\ of\ execute\ time)/ {next}; 
-              /^Captured\ pythonlogging/ {cap=1; next} /^Captured\ traceback/ {cap=0;next}; 
-              /^======$/ {skip=20;next} skip>0 {--skip;next};
-              /^.*FAILED$/ {print ""}1;')"\n\n"
-    fi
-
-    # Add a summary
-    OUT+="\n-------------- Summary --------------\n"
-    OUT+=$(echo "$STREAM" | awk 'prt-->0; /^Ran:.*tests\ in/ {prt=5;print}')
-
-    # Add a header
-    OUT="${STATUS_ALL[$STATUS]} : $INFODATA\n"$OUT
-
-    # Go to output/exit
-    runExit $STATUS "$OUT" "$PERFDATA"
-}
-
 runExit () {
     STATUS=$1
     OUTPUT="$2"
@@ -141,22 +68,45 @@ runExit () {
     exit $STATUS
 }
 
+filterExit () {
+    # Exit with the status computed by the stream filter
+    STATUS=$1
+    cd $OLDPWD
+    exit $STATUS
+}
+
+historyArgs () {
+    # Perfdata history of the check (see monitoring/history.py)
+    if [ -n "$HISTORY" ]; then
+        HISTORY_ARGS="--history $HISTORY --check $CONF_NAME:$1"
+        if [ -n "$ADAPTIVE" ]; then
+            HISTORY_ARGS="$HISTORY_ARGS --adaptive $ADAPTIVE"
+        fi
+    fi
+}
+
 runOneTest () {
     TEST_ID=$1
+    historyArgs $TEST_ID
 
-    # Running a single test using subunit.run
-    # Redirecting output and error to subunit-trace then $STREAM
-    STREAM=`$RUN_CMD python -m subunit.run $TEST_ID 2>&1 | $SUBUNIT_TRACE`
-    STATUS=$?
+    if [ -n "$CHECK_SERVER" ]; then
+        # Tempest is already loaded by the check server (see check_server.sh)
+        env PYTHONPATH=$DIRNAME python -m monitoring.check_client -s $CHECK_SOCKET -c $CONF_NAME -t $MAXTIME $HISTORY_ARGS --test $TEST_ID
+        filterExit $?
+    fi
 
-    getPerfData "$STREAM" $STATUS
+    # Running a single test using subunit.run
+    # Redirecting output and error to the stream filter (single pass)
+    $RUN_CMD python -m subunit.run $TEST_ID 2>&1 | $FILTER_CMD $HISTORY_ARGS
+    filterExit ${PIPESTATUS[1]}
 }
 
 runRegexTests () {
     REGEX=$1
+    historyArgs $REGEX
 
     # Running many tests using ostestr with a regex
-    # Redirecting output and error to subunit-trace then $STREAM
+    # Redirecting output and error to the stream filter (single pass)
 
     # As of https://bugs.launchpad.net/os-testr/+bug/1506215, we cannot use blacklist for now
     # XXX Skipping tests manually :
@@ -164,16 +114,20 @@ runRegexTests () {
     # tempest.api.fgcloud.test_user_isolation_* # use ./check_isolation.sh instead
     REGFULL='((?!^tempest.api.compute.test_authorization)(?!^tempest.api.fgcloud.test_user_isolation_)('$REGEX'))'
 
-    STREAM=`$RUN_CMD ostestr --serial --no-slowest --no-pretty --subunit --regex $REGFULL 2>&1 | $SUBUNIT_TRACE`
-    STATUS=$?
-
-    # Have to filter the output because of ostestr auto discovery when using regex
-    STREAM=$(sed '/^running/,+4d' <<< "$STREAM")
+    if [ -n "$CHECK_SERVER" ]; then
+        # Tests are already discovered by the check server (see check_server.sh)
+        env PYTHONPATH=$DIRNAME python -m monitoring.check_client -s $CHECK_SOCKET -c $CONF_NAME -t $MAXTIME $HISTORY_ARGS --regex $REGFULL
+        filterExit $?
+    fi
 
-    getPerfData "$STREAM" $STATUS
+    # The ostestr auto discovery output is dropped by the filter
+    $RUN_CMD ostestr --serial --no-slowest --no-pretty --subunit --regex $REGFULL 2>&1 | $FILTER_CMD $HISTORY_ARGS
+    filterExit ${PIPESTATUS[1]}
 }
 
 initEnv () {
+    CONF_NAME=$CONF_FILE
+
     # Load custom tempest.conf file
     if [ -f `readlink -f "$DIRNAME/config/$CONF_FILE"` ]; then
         CONF_FILE=`readlink -f "$DIRNAME/config/$CONF_FILE"`
@@ -189,6 +143,14 @@ initEnv () {
     # All commands have to be run from $TEMPEST/ directory
     cd $TEMPEST
 
+    # A running check server keeps its venv, bytecode and tests loaded
+    # (the socket of a dead one is left over, the checks then run here)
+    if [ -S $CHECK_SOCKET ] && [ ! $UPDATEVENV ] && \
+            env PYTHONPATH=$DIRNAME python -m monitoring.check_client -s $CHECK_SOCKET --probe; then
+        CHECK_SERVER=1
+        return
+    fi
+
     if [ ! -d $TEMPEST/.venv ] || [ $UPDATEVENV ]; then
         python $TEMPEST/tools/install_venv.py
     fi
@@ -198,6 +160,9 @@ initEnv () {
     fi
 
     ${RUN_CMD} find $TEMPEST -type f -name "*.pyc" -delete
+
+    # Single pass filter of the subunit v2 stream (see monitoring/subunit_filter.py)
+    FILTER_CMD="$RUN_CMD env PYTHONPATH=$DIRNAME python -m monitoring.subunit_filter -t $MAXTIME"
 }
 
 runMain () {
@@ -212,7 +177,7 @@ runMain () {
     fi
 }
 
-if ! OPTIONS=$(getopt -o c:e:ht:u -l config:,regex:,help,timeout:,update -- "$@") ; then
+if ! OPTIONS=$(getopt -o a:c:e:hH:t:u -l adaptive:,config:,regex:,help,history:,timeout:,update -- "$@") ; then
     usage
 fi
 if [ $# -eq 0 ] ; then
@@ -224,6 +189,11 @@ FIRST_UU=yes
 
 while [ $# -gt 0 ]; do
     case "$1" in
+        -a|--adaptive)
+            ADAPTIVE=$2
+            shift 2
+            ;;
+
         -c|--config)
             CONF_FILE=$2
             shift 2
@@ -238,6 +208,12 @@ while [ $# -gt 0 ]; do
             usage
             ;;
 
+        -H|--history)
+            # Commands are run from $TEMPEST/
+            HISTORY=`readlink -f "$2"`
+            shift 2
+            ;;
+
         -t|--timeout)
             MAXTIME=$2
             shift 2
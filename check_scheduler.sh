@@ -0,0 +1,30 @@
+#!/bin/bash
+
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+##############################################################################
+# Run the checks in the background, serve their last result at once
+##############################################################################
+
+# Other variables
+DIRNAME="$( cd "$(dirname "$0")" ; pwd -P )"
+
+# Only the standard library is needed : no virtual environment, the checks
+# are run by check_openstack.sh, check_isolation.sh...
+cd $DIRNAME
+exec env PYTHONPATH=$DIRNAME python -m monitoring.scheduler "$@"
+
+# EOF
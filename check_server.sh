@@ -0,0 +1,62 @@
+#!/bin/bash
+
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+##############################################################################
+# Keep tempest loaded for check_openstack.sh
+##############################################################################
+
+# Other variables
+DIRNAME="$( cd "$(dirname "$0")" ; pwd -P )"
+TEMPEST=$DIRNAME/tempest
+RUN_CMD="$TEMPEST/tools/with_venv.sh"
+CHECK_SOCKET=${CHECK_SOCKET:-/tmp/tempest_check_server.sock}
+
+# Functions
+
+usage () {
+    echo "Usage: $0 [OPTION] ..."
+    echo "Run the check server (see monitoring/check_server.py)"
+    echo "While it runs, check_openstack.sh hands its checks over to it"
+    echo "Stop it with SIGTERM"
+    echo ""
+    echo "  -h            Print this help message"
+    echo ""
+    echo "Exemple : $0 &"
+    exit 1
+}
+
+runMain () {
+    # The server runs from the $TEMPEST/ directory, like the tests
+    cd $TEMPEST
+
+    if [ ! -d $TEMPEST/.venv ]; then
+        python $TEMPEST/tools/install_venv.py
+    fi
+
+    # Compiled once, then kept for all the checks
+    ${RUN_CMD} find $TEMPEST -type f -name "*.pyc" -delete
+
+    exec $RUN_CMD env PYTHONPATH=$DIRNAME python -m monitoring.check_server -s $CHECK_SOCKET --config-dir $DIRNAME/config
+}
+
+if [ $# -gt 0 ] ; then
+    usage
+fi
+
+runMain
+
+# EOF
@@ -0,0 +1,150 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Keystone token and service catalog shared by the check runs
+
+Each check run used to authenticate from scratch. With [fgcloud]token_cache
+set, the token and the catalog returned by Keystone are kept in a file of
+[fgcloud]token_cache_dir, named after a hash of the auth URL and of the
+credentials, and reused by the next runs until [fgcloud]token_expiry_margin
+seconds before the token expires. A request rejected with a 401 while using
+a cached token drops the file, authenticates again and is sent once more.
+
+install() is called by the setup_credentials of the fgcloud test classes,
+before their client managers authenticate. It also measures the time spent
+authenticating, exported by the tests as the auth_time perfdata series.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2.7, oslo.utils depends on it
+    from monotonic import monotonic
+
+from oslo_log import log as logging
+
+from tempest.api.fgcloud import options
+from tempest.lib import auth
+from tempest.lib.common import rest_client
+from tempest.lib import exceptions as lib_exc
+
+LOG = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_auth_time = [0.0]
+_originals = {}
+
+
+def auth_time():
+    """Seconds spent getting tokens (from Keystone or from the cache)"""
+    return _auth_time[0]
+
+
+def get_path(provider):
+    """Cache file of the credentials and auth URL of provider"""
+    credentials = provider.credentials
+    key = dict((attr, getattr(credentials, attr, None))
+               for attr in credentials.get_init_attributes())
+    key['auth_url'] = provider.auth_client.auth_url
+    digest = hashlib.sha256(
+        json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(options.CONF.fgcloud.token_cache_dir,
+                        'tempest_token_%s.json' % digest[:32])
+
+
+def load(provider):
+    """The cached (token, auth_data) of provider, None if missing/expired"""
+    try:
+        with open(get_path(provider)) as cache:
+            cached = json.load(cache)
+        auth_data = (cached['token'], cached['auth_data'])
+        if provider.is_expired(auth_data):
+            return None
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+    return auth_data
+
+
+def store(provider, auth_data):
+    path = get_path(provider)
+    tmp_path = '%s.%d' % (path, os.getpid())
+    # Tokens are secrets : readable by the owner only
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as cache:
+        json.dump({'token': auth_data[0], 'auth_data': auth_data[1]}, cache)
+    os.rename(tmp_path, path)
+
+
+def invalidate(provider):
+    try:
+        os.remove(get_path(provider))
+    except OSError:
+        pass
+
+
+def _get_auth(self):
+    start = monotonic()
+    try:
+        if options.CONF.fgcloud.token_cache:
+            self.token_expiry_threshold = datetime.timedelta(
+                seconds=options.CONF.fgcloud.token_expiry_margin)
+            auth_data = load(self)
+            if auth_data is not None:
+                LOG.debug("Token of %s read from the cache", self.credentials)
+                self._fgcloud_cached = True
+                return auth_data
+        auth_data = _originals['_get_auth'](self)
+        self._fgcloud_cached = False
+        if options.CONF.fgcloud.token_cache:
+            try:
+                store(self, auth_data)
+            except (IOError, OSError) as exc:
+                LOG.warning("Cannot cache the token (%s)", exc)
+        return auth_data
+    finally:
+        with _lock:
+            _auth_time[0] += monotonic() - start
+
+
+def _request(self, *args, **kwargs):
+    try:
+        return _originals['request'](self, *args, **kwargs)
+    except lib_exc.Unauthorized:
+        provider = self.auth_provider
+        if not getattr(provider, '_fgcloud_cached', False):
+            raise
+        # The cached token was revoked before its expiry
+        LOG.warning("Cached token of %s rejected, authenticating again",
+                    provider.credentials)
+        invalidate(provider)
+        provider.set_auth()
+        return _originals['request'](self, *args, **kwargs)
+
+
+def install():
+    """Hook the cache into the Keystone auth providers, once per process"""
+    with _lock:
+        if _originals:
+            return
+        _originals['_get_auth'] = auth.KeystoneAuthProvider._get_auth
+        _originals['request'] = rest_client.RestClient.request
+        auth.KeystoneAuthProvider._get_auth = _get_auth
+        rest_client.RestClient.request = _request
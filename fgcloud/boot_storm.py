@@ -0,0 +1,344 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Boot storm : how the scenario degrades as more of it runs at once
+
+For each level of --levels (1 2 4 8 by default), as many copies of
+test_basic_scenario (--test) start at the same time, each one in a process
+of its own with an account of accounts.yaml (the levels above the number of
+accounts are skipped). Once they are all over, the next level starts, after
+--pause seconds.
+
+The perfdata series of the runs (boot_time, attach_time, ssh_ready_time...,
+see perfdata.py) give, per level, the distribution of each phase (min, p50,
+p95, max), along with the failure rate and the errors : the level where the
+p50 of a phase takes off is the knee of the cloud. The report is printed,
+and written as JSON with --output.
+
+A run which is still going after --timeout seconds is killed, and so are
+all of them on Ctrl-C. The scenario then cannot delete what it created : a
+level with a failed or killed run is followed by a sweep of the leftovers
+of every account of accounts.yaml (see sweeper.py), unless --no-sweep. The
+sweep may delete the resources of a check running meanwhile on the same
+accounts, pause the checks of the site during the storm.
+
+Run it from the tempest directory, with the TEMPEST_CONFIG variables of the
+site (see tools/boot_storm.sh) :
+
+    python -m tempest.api.fgcloud.boot_storm --levels 1 2 4 8 16
+    python -m tempest.api.fgcloud.boot_storm --output storm.json --json
+"""
+
+import argparse
+import collections
+import io
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2.7, oslo.utils depends on it
+    from monotonic import monotonic
+
+from oslo_log import log as logging
+import subunit
+import testtools
+
+from tempest.api.fgcloud import auth_cache
+from tempest.api.fgcloud import executor
+from tempest.api.fgcloud import options
+from tempest.api.fgcloud import perfdata
+from tempest.api.fgcloud import pool
+from tempest.api.fgcloud import sweeper
+from tempest import config
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+TEST_ID = ('tempest.api.fgcloud.test_basic_scenario.TestBasicScenario.'
+           'test_basic_scenario')
+LEVELS = (1, 2, 4, 8)
+PERCENTILES = (50, 95)
+# Phases of the printed report, the JSON one has every series
+PHASES = ('boot_time', 'volume_create_time', 'attach_time', 'fip_time',
+          'secgroup_time', 'ssh_ready_time', 'reboot_time',
+          'timestamp_rw_time', 'wall_time')
+
+
+def _error(details):
+    """Last line of the traceback of a failed test"""
+    for name in ('traceback', 'reason'):
+        if name in details:
+            lines = details[name].as_text().strip().splitlines()
+            if lines:
+                return lines[-1]
+    return 'no traceback'
+
+
+def parse_run(data):
+    """{'status', 'series', 'error'} of the subunit stream of a run"""
+    tests = []
+    result = testtools.StreamToDict(tests.append)
+    result.startTestRun()
+    try:
+        subunit.ByteStreamToStreamResult(
+            io.BytesIO(data), non_subunit_name='stdout').run(result)
+    finally:
+        result.stopTestRun()
+    run = {'status': 'error', 'series': {}, 'error': 'no test result'}
+    for test in tests:
+        if test['id'] == 'process-returncode':
+            continue
+        run['status'] = test['status']
+        run['error'] = (_error(test['details'])
+                        if test['status'] != 'success' else None)
+        if perfdata.DETAIL_NAME in test['details']:
+            series = json.loads(
+                test['details'][perfdata.DETAIL_NAME].as_text())
+            run['series'] = dict((serie['label'], serie['value'])
+                                 for serie in series
+                                 if serie['unit'] == 's')
+    return run
+
+
+def distribution(values):
+    values = sorted(values)
+    summary = collections.OrderedDict([('count', len(values)),
+                                       ('min', round(values[0], 3))])
+    for rank in PERCENTILES:
+        summary['p%d' % rank] = round(perfdata.percentile(values, rank), 3)
+    summary['max'] = round(values[-1], 3)
+    summary['mean'] = round(sum(values) / len(values), 3)
+    return summary
+
+
+class BootStorm(object):
+    """Levels of concurrent runs of a test"""
+
+    def __init__(self, test_id, timeout, sweep=True):
+        self.test_id = test_id
+        self.timeout = timeout
+        self.sweep_leftovers = sweep
+        self.accounts = sweeper.read_accounts()
+        self.levels = []
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def _kill(self, process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            # Over meanwhile
+            pass
+
+    def _run(self, name):
+        """One run of the test, in a session of its own"""
+        start = monotonic()
+        with open(os.devnull, 'w') as devnull:
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'subunit.run', self.test_id],
+                stdout=subprocess.PIPE, stderr=devnull,
+                preexec_fn=os.setsid)
+        with self._lock:
+            self._processes.add(process)
+        timer = threading.Timer(self.timeout, self._kill, (process,))
+        timer.start()
+        try:
+            data = process.communicate()[0]
+        finally:
+            timer.cancel()
+            with self._lock:
+                self._processes.discard(process)
+        run = parse_run(data)
+        run['wall_time'] = monotonic() - start
+        if process.returncode < 0:
+            run['status'] = 'killed'
+            run['error'] = 'killed after %.0fs' % run['wall_time']
+        LOG.info('%s : %s in %.0fs', name, run['status'], run['wall_time'])
+        return run
+
+    def run_level(self, level):
+        """level runs at once, then their summary"""
+        LOG.info('Level %d : starting %d runs', level, level)
+        graph = executor.TaskGraph('storm %d' % level, max_workers=level)
+        for index in range(level):
+            name = 'level %d run %d' % (level, index)
+            graph.add(name, lambda n=name: self._run(n))
+        start = monotonic()
+        runs = graph.run(raise_errors=False)
+        elapsed = monotonic() - start
+        for failure in graph.report():
+            runs[failure['task']] = {'status': 'error', 'series': {},
+                                     'error': failure['error'],
+                                     'wall_time': elapsed}
+        runs = list(runs.values())
+        failed = [run for run in runs if run['status'] != 'success']
+        series = collections.defaultdict(list)
+        for run in runs:
+            if run['status'] == 'success':
+                for label, value in run['series'].items():
+                    series[label].append(value)
+                series['wall_time'].append(run['wall_time'])
+        summary = {'level': level,
+                   'runs': len(runs),
+                   'failed': len(failed),
+                   'failure_rate': round(100.0 * len(failed) / len(runs), 1),
+                   'elapsed': round(elapsed, 3),
+                   'errors': sorted(collections.Counter(
+                       '%s : %s' % (run['status'], run['error'])
+                       for run in failed).items()),
+                   'phases': collections.OrderedDict(
+                       (label, distribution(values))
+                       for label, values in sorted(series.items()))}
+        self.levels.append(summary)
+        return summary
+
+    def stop(self):
+        """Kill the runs in flight"""
+        with self._lock:
+            for process in list(self._processes):
+                self._kill(process)
+
+    def sweep(self):
+        """Delete the leftovers of every account"""
+        prefix = CONF.resources_prefix
+        if not prefix:
+            LOG.warning('No [DEFAULT]resources_prefix, nothing is swept')
+            return False
+        auth_cache.install()
+        clean = True
+        for account in self.accounts:
+            account_sweeper = sweeper.Sweeper(
+                account, prefix, options.CONF.fgcloud.max_workers)
+            try:
+                account_sweeper.sweep(
+                    time.time() + options.CONF.fgcloud.cleanup_timeout)
+            except Exception:
+                LOG.exception('%s: sweep failed', account_sweeper.username)
+                clean = False
+                continue
+            deleted = sum(len(ids) for ids in account_sweeper.deleted.values())
+            if deleted:
+                LOG.info('%s: %d leftover(s) deleted',
+                         account_sweeper.username, deleted)
+            clean = clean and not any(account_sweeper.errors.values())
+        return clean
+
+    def storm(self, levels, pause=0):
+        for number, level in enumerate(levels):
+            if level > len(self.accounts):
+                LOG.warning('Level %d skipped : only %d account(s) in %s',
+                            level, len(self.accounts),
+                            CONF.auth.test_accounts_file)
+                continue
+            if number and pause:
+                time.sleep(pause)
+            try:
+                summary = self.run_level(level)
+            except BaseException:
+                self.stop()
+                if self.sweep_leftovers:
+                    self.sweep()
+                raise
+            if summary['failed'] and self.sweep_leftovers:
+                summary['swept'] = self.sweep()
+
+    def report(self):
+        return {'test': self.test_id,
+                'accounts': len(self.accounts),
+                'levels': self.levels}
+
+
+def print_report(report):
+    print('%s, %d account(s)' % (report['test'], report['accounts']))
+    print('%5s %5s %7s %9s' % ('level', 'runs', 'failed', 'elapsed'))
+    for level in report['levels']:
+        print('%5d %5d %6.1f%% %8.0fs' % (
+            level['level'], level['runs'], level['failure_rate'],
+            level['elapsed']))
+    for phase in PHASES:
+        if not any(phase in level['phases'] for level in report['levels']):
+            continue
+        print('')
+        print('%-18s %5s %8s %8s %8s %8s %7s' % (
+            phase, 'level', 'min', 'p50', 'p95', 'max', 'p50 x'))
+        base = None
+        for level in report['levels']:
+            values = level['phases'].get(phase)
+            if values is None:
+                continue
+            base = base or values['p50']
+            print('%-18s %5d %7.1fs %7.1fs %7.1fs %7.1fs %7.2f' % (
+                '', level['level'], values['min'], values['p50'],
+                values['p95'], values['max'],
+                values['p50'] / base if base else 0))
+    for level in report['levels']:
+        for error, count in level['errors']:
+            print('level %d, %d run(s) : %s' % (level['level'], count, error))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Run more and more copies of the basic scenario at once")
+    parser.add_argument('-l', '--levels', type=int, nargs='+',
+                        default=list(LEVELS),
+                        help="Runs at once of each level (default : %s)" %
+                             ' '.join(str(level) for level in LEVELS))
+    parser.add_argument('--test', default=TEST_ID,
+                        help="Test id to run")
+    parser.add_argument('-t', '--timeout', type=int, default=900,
+                        help="A run is killed after this time, in seconds")
+    parser.add_argument('--pause', type=int, default=30,
+                        help="Seconds between two levels")
+    parser.add_argument('--no-sweep', action='store_true',
+                        help="Do not sweep the leftovers of the failed runs")
+    parser.add_argument('-o', '--output',
+                        help="Write the report as JSON to this file")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the report as JSON")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    pool.load_config()
+    try:
+        storm = BootStorm(args.test, args.timeout, sweep=not args.no_sweep)
+    except ValueError as exc:
+        sys.stderr.write("%s\n" % exc)
+        return 2
+    try:
+        storm.storm(args.levels, args.pause)
+    except KeyboardInterrupt:
+        sys.stderr.write("Interrupted, the report is partial\n")
+    report = storm.report()
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 1 if any(level['failed'] for level in storm.levels) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
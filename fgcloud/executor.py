@@ -0,0 +1,212 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Run dependent API calls concurrently
+
+A TaskGraph runs each task in its own thread as soon as the tasks it requires
+are done, so that the wall time is the critical path of the graph instead of
+the sum of all the waits. The latency of each task is recorded.
+
+Tempest rest clients share one httplib2 object per client, which is not
+thread safe : thread_safe() serializes the HTTP requests of a client (the
+waits between two polls are not serialized), clone() gives a thread a copy of
+a client with its own httplib2 object.
+"""
+
+import collections
+import copy
+import sys
+import threading
+import time
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2.7, oslo.utils depends on it
+    from monotonic import monotonic
+
+from oslo_log import log as logging
+import six
+from six.moves import queue
+
+from tempest.api.fgcloud import options
+from tempest.lib.common import http
+
+LOG = logging.getLogger(__name__)
+
+
+def _lock_requests(http):
+    lock = threading.Lock()
+    unlocked = http.request
+
+    def request(*args, **kwargs):
+        with lock:
+            return unlocked(*args, **kwargs)
+    http.request = request
+    http._fgcloud_lock = lock
+
+
+def thread_safe(*clients):
+    """Serialize the HTTP requests of each of the given rest clients"""
+    for client in clients:
+        if getattr(client.http_obj, '_fgcloud_lock', None) is None:
+            _lock_requests(client.http_obj)
+
+
+def clone(client):
+    """Copy of a rest client with an HTTP connection of its own
+
+    The copy shares the auth provider, and so the token, of client.
+    """
+    http_obj = client.http_obj
+    copied = copy.copy(client)
+    copied.http_obj = http.ClosingHttp(
+        disable_ssl_certificate_validation=(
+            http_obj.disable_ssl_certificate_validation),
+        ca_certs=http_obj.ca_certs)
+    return copied
+
+
+class Task(object):
+
+    def __init__(self, name, func, requires):
+        self.name = name
+        self.func = func
+        self.requires = set(requires)
+        self.state = 'pending'
+        self.result = None
+        self.exc_info = None
+        self.start = None
+        self.elapsed = None
+
+
+class TaskGraph(object):
+    """Dependency graph of tasks run on a bounded number of threads
+
+    A task whose requirement failed or was skipped is skipped. run() waits
+    for every started task, then raises the first error if any.
+
+    With a deadline (time.time() based), tasks still running when it expires
+    are left behind in their daemon threads and reported as 'timeout', the
+    pending ones are skipped.
+    """
+
+    def __init__(self, name, max_workers=None):
+        self.name = name
+        if max_workers is None:
+            max_workers = options.CONF.fgcloud.max_workers
+        self.max_workers = max_workers
+        self.tasks = collections.OrderedDict()
+        self.elapsed = None
+
+    def add(self, name, func, requires=()):
+        """Add a task, func is called without argument"""
+        for required in requires:
+            if required not in self.tasks:
+                raise ValueError("%s requires unknown task %s" %
+                                 (name, required))
+        self.tasks[name] = Task(name, func, requires)
+
+    def _run_task(self, task, done):
+        try:
+            task.result = task.func()
+        except Exception:
+            task.exc_info = sys.exc_info()
+        task.elapsed = monotonic() - task.start
+        done.put(task)
+
+    def _ready(self):
+        for task in self.tasks.values():
+            if task.state != 'pending':
+                continue
+            states = set(self.tasks[r].state for r in task.requires)
+            if states & set(['failed', 'skipped']):
+                task.state = 'skipped'
+                LOG.warning("%s: %s skipped, a requirement failed",
+                            self.name, task.name)
+            elif states <= set(['done']):
+                yield task
+
+    def run(self, deadline=None, raise_errors=True):
+        """Run all the tasks, return {name: result}"""
+        done = queue.Queue()
+        running = 0
+        start = monotonic()
+        while True:
+            if deadline is not None and time.time() > deadline:
+                self._expire()
+                break
+            for task in self._ready():
+                if running >= self.max_workers:
+                    break
+                task.state = 'running'
+                task.start = monotonic()
+                thread = threading.Thread(target=self._run_task,
+                                          args=(task, done))
+                thread.daemon = True
+                thread.start()
+                running += 1
+            if not running:
+                break
+            try:
+                task = done.get(timeout=None if deadline is None else
+                                max(0, deadline - time.time()))
+            except queue.Empty:
+                continue
+            running -= 1
+            if task.exc_info is None:
+                task.state = 'done'
+                LOG.info("%s: %s done in %.1fs", self.name, task.name,
+                         task.elapsed)
+            else:
+                task.state = 'failed'
+                LOG.warning("%s: %s failed after %.1fs (%s)", self.name,
+                            task.name, task.elapsed, task.exc_info[1])
+        self.elapsed = monotonic() - start
+        LOG.info("%s: %.1fs for %.1fs of tasks", self.name, self.elapsed,
+                 sum(t.elapsed or 0 for t in self.tasks.values()))
+
+        if raise_errors:
+            for task in self.tasks.values():
+                if task.state == 'failed':
+                    six.reraise(*task.exc_info)
+        return dict((t.name, t.result) for t in self.tasks.values())
+
+    def _expire(self):
+        for task in self.tasks.values():
+            if task.state == 'running':
+                task.state = 'timeout'
+                task.elapsed = monotonic() - task.start
+                LOG.warning("%s: %s still running at the deadline",
+                            self.name, task.name)
+            elif task.state == 'pending':
+                task.state = 'skipped'
+
+    def report(self):
+        """Structured outcome of the tasks which did not succeed"""
+        return [{'task': t.name,
+                 'state': t.state,
+                 'elapsed': t.elapsed,
+                 'error': (None if t.exc_info is None else
+                           '%s: %s' % (t.exc_info[0].__name__,
+                                       t.exc_info[1]))}
+                for t in self.tasks.values() if t.state != 'done']
+
+    @property
+    def timings(self):
+        """{name: latency} of the tasks which have run"""
+        return collections.OrderedDict(
+            (t.name, t.elapsed) for t in self.tasks.values()
+            if t.elapsed is not None)
@@ -0,0 +1,193 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Long-lived fixture of the isolation checks
+
+With [fgcloud]isolation_persistent set, UserIsolationSetup keeps its
+resources at the end of a run. What it hands over to UserIsolationRun is
+recorded in a state file next to the handoff socket
+(tempest_fixture_<site_id>_<username>.json), along with VERSION : a file
+written by another version is ignored, its resources are left to the
+sweeper.
+
+The next run checks the recorded resources with validate(), a single list
+call per resource type (servers, images, keypairs, security groups, volumes
+and volume snapshots), made concurrently. A part which is missing, or not in
+the status the isolation cases expect, is stale, and so are the parts which
+depend on it :
+
+    server          -> attachment
+    security_group  -> rule
+    volume1         -> vol_snapshot
+    volume2         -> attachment
+
+UserIsolationSetup deletes the stale parts which still exist, creates them
+again and hands the other ones over as they are. The whole fixture is stale
+once older than [fgcloud]isolation_fixture_max_age, so that its creation
+keeps being measured.
+"""
+
+import collections
+import json
+import os
+import time
+
+from oslo_log import log as logging
+
+from tempest.api.fgcloud import executor
+from tempest.api.fgcloud import handoff
+from tempest.api.fgcloud import options
+
+LOG = logging.getLogger(__name__)
+
+VERSION = 1
+# Parts of the fixture (the tasks of UserIsolationSetup.resource_setup)
+PARTS = ('server', 'server_snapshot', 'keypair', 'security_group', 'rule',
+         'volume1', 'volume2', 'vol_snapshot', 'attachment')
+# Parts created again along with the one they depend on
+DEPENDENTS = collections.OrderedDict([('server', ('attachment',)),
+                                      ('security_group', ('rule',)),
+                                      ('volume1', ('vol_snapshot',)),
+                                      ('volume2', ('attachment',))])
+
+
+def get_state_path(username, key=None):
+    return os.path.join(options.CONF.fgcloud.handoff_dir,
+                        'tempest_fixture_%s_%s.json' %
+                        (key or handoff.get_key(), username))
+
+
+def load(username, key=None):
+    """{'created', 'fixture'} recorded by the previous run, None if none"""
+    path = get_state_path(username, key)
+    try:
+        with open(path) as state:
+            state = json.load(state)
+    except (IOError, OSError):
+        return None
+    except ValueError as exc:
+        LOG.warning("%s is not valid JSON, ignored (%s)", path, exc)
+        return None
+    if state.get('version') != VERSION:
+        LOG.warning("%s has version %s instead of %d, ignored", path,
+                    state.get('version'), VERSION)
+        return None
+    return state
+
+
+def store(username, fixture, created, key=None):
+    path = get_state_path(username, key)
+    with open(path + '.tmp', 'w') as state:
+        json.dump({'version': VERSION, 'created': created,
+                   'updated': time.time(), 'fixture': fixture}, state)
+    os.rename(path + '.tmp', path)
+
+
+def expired(state):
+    max_age = options.CONF.fgcloud.isolation_fixture_max_age
+    return bool(max_age) and time.time() - state['created'] > max_age
+
+
+def _status(resources, resource, expected):
+    """Why resource is stale, None if it is in one of the expected statuses"""
+    found = resources.get(resource['id'])
+    if found is None:
+        return 'missing'
+    if found['status'] not in expected:
+        return found['status']
+    return None
+
+
+def _list(cls, fixture):
+    """{type: {id: resource}} of the account, one list call per type"""
+    calls = {
+        'servers': lambda: cls.client.list_servers(detail=True)['servers'],
+        'keypairs': lambda: [k['keypair'] for k in
+                             cls.keypairs_client.list_keypairs()['keypairs']],
+        'security_groups': lambda: cls.security_client.list_security_groups(
+            )['security_groups'],
+        'volumes': lambda: cls.volumes_client.list_volumes(
+            detail=True)['volumes'],
+    }
+    if 'server_snapshot' in fixture:
+        calls['images'] = lambda: cls.compute_images_client.list_images(
+            detail=True)['images']
+    if 'vol_snapshot' in fixture:
+        calls['snapshots'] = lambda: cls.snapshots_client.list_snapshots(
+            detail=True)['snapshots']
+    graph = executor.TaskGraph('fixture validation')
+    for kind, call in calls.items():
+        graph.add(kind, call)
+    listed = graph.run()
+    # Keypairs have no id
+    return dict((kind, dict((r.get('id', r.get('name')), r)
+                            for r in resources))
+                for kind, resources in listed.items())
+
+
+def validate(cls, fixture):
+    """{part: reason} of the stale parts of fixture
+
+    cls is UserIsolationSetup, whose clients make the list calls.
+    """
+    listed = _list(cls, fixture)
+    stale = collections.OrderedDict()
+    # A part absent from fixture was never created, nothing to check
+    if 'server' in fixture:
+        stale['server'] = _status(listed['servers'], fixture['server'],
+                                  ('ACTIVE',))
+    if 'server_snapshot' in fixture:
+        stale['server_snapshot'] = _status(
+            listed['images'], fixture['server_snapshot'], ('ACTIVE',))
+    if ('keypairname' in fixture and
+            fixture['keypairname'] not in listed['keypairs']):
+        stale['keypair'] = 'missing'
+    group = None
+    if 'security_group' in fixture:
+        group = listed['security_groups'].get(fixture['security_group']['id'])
+        if group is None:
+            stale['security_group'] = 'missing'
+    if 'rule' in fixture and fixture['rule']['id'] not in [
+            r['id'] for r in (group or {}).get('rules', [])]:
+        stale['rule'] = 'missing'
+
+    if 'volume1' in fixture:
+        stale['volume1'] = _status(listed['volumes'], fixture['volume1'],
+                                   ('available',))
+        volume1 = listed['volumes'].get(fixture['volume1']['id'], {})
+        metadata = volume1.get('metadata', {})
+        if not stale['volume1'] and any(
+                metadata.get(k) != v for k, v in fixture['metadata'].items()):
+            stale['volume1'] = 'metadata changed'
+    if 'vol_snapshot' in fixture:
+        stale['vol_snapshot'] = _status(
+            listed['snapshots'], fixture['vol_snapshot'], ('available',))
+    if 'volume2' in fixture:
+        stale['volume2'] = _status(listed['volumes'], fixture['volume2'],
+                                   ('available', 'in-use'))
+        volume2 = listed['volumes'].get(fixture['volume2']['id'], {})
+        attached = [a['server_id'] for a in volume2.get('attachments', [])]
+        server_id = fixture.get('server', {}).get('id')
+        if not stale['volume2'] and attached not in ([], [server_id]):
+            stale['volume2'] = 'attached to %s' % ', '.join(attached)
+        if 'attachment' in fixture and attached != [server_id]:
+            stale['attachment'] = 'missing'
+
+    for part, dependents in DEPENDENTS.items():
+        for dependent in dependents:
+            if stale.get(part) and not stale.get(dependent):
+                stale[dependent] = 'requires %s' % part
+    return collections.OrderedDict((part, reason) for part, reason
+                                   in stale.items() if reason)
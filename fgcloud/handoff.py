@@ -0,0 +1,254 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Rendezvous between UserIsolationSetup and UserIsolationRun
+
+The setup side (user A) listens on a Unix domain socket named after the
+site_id (or image_ref), the run side (user B) connects to it as soon as it
+starts. Both sides then exchange newline delimited JSON messages :
+
+    heartbeat   sent by both sides every heartbeat_interval
+    fixture     setup -> run, the ids of the resources created by user A
+    abort       setup -> run, the fixture could not be created
+    done        run -> setup, the isolation tests are over
+
+A side which does not hear from its peer for heartbeat_timeout seconds, or
+whose peer closes the connection, fails at once instead of waiting forever.
+The heartbeats only start once connected : a side whose peer has not
+connected within handoff_connect_timeout seconds (the peer died before
+listening or connecting) fails too.
+"""
+
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+
+from oslo_log import log as logging
+from six.moves import queue
+
+from tempest.api.fgcloud import options
+from tempest import config
+from tempest import exceptions
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+_EOF = object()
+
+
+class HandoffError(exceptions.TempestException):
+    message = "Isolation handoff failed: %(reason)s"
+
+
+class PeerLost(HandoffError):
+    message = "Isolation peer lost: %(reason)s"
+
+
+class PeerAborted(HandoffError):
+    message = "Isolation peer aborted: %(reason)s"
+
+
+def get_key():
+    """Key shared by the two sides of an isolation check"""
+    return options.CONF.fgcloud.site_id or CONF.compute.image_ref.strip()
+
+
+def get_path(key=None):
+    return os.path.join(options.CONF.fgcloud.handoff_dir,
+                        'tempest_%s.sock' % (key or get_key()))
+
+
+def get_deadline():
+    return time.time() + options.CONF.fgcloud.handoff_timeout
+
+
+def get_connect_deadline(deadline):
+    """Deadline of the first contact with the peer"""
+    return min(deadline,
+               time.time() + options.CONF.fgcloud.handoff_connect_timeout)
+
+
+class Channel(object):
+    """Connected end of the rendezvous, with heartbeats in both ways"""
+
+    def __init__(self, sock, name):
+        self.sock = sock
+        self.name = name
+        self.interval = options.CONF.fgcloud.handoff_heartbeat_interval
+        self.timeout = options.CONF.fgcloud.handoff_heartbeat_timeout
+        self.messages = queue.Queue()
+        self.last_seen = time.time()
+        self._send_lock = threading.Lock()
+        self._closed = threading.Event()
+        for target in (self._read, self._heartbeat):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def send(self, kind, **data):
+        data['type'] = kind
+        line = (json.dumps(data) + '\n').encode('utf-8')
+        with self._send_lock:
+            self.sock.sendall(line)
+
+    def _heartbeat(self):
+        while not self._closed.wait(self.interval):
+            try:
+                self.send('heartbeat')
+            except (IOError, OSError):
+                return
+
+    def _read(self):
+        reader = self.sock.makefile('rb')
+        try:
+            for line in reader:
+                self.last_seen = time.time()
+                message = json.loads(line.decode('utf-8'))
+                if message['type'] != 'heartbeat':
+                    self.messages.put(message)
+        except (IOError, OSError, ValueError) as exc:
+            LOG.warning("%s: cannot read from peer (%s)", self.name, exc)
+        finally:
+            self.messages.put(_EOF)
+
+    def wait_for(self, kind, deadline):
+        """Return the next message of type kind, fail fast on a dead peer"""
+        while True:
+            now = time.time()
+            if now > deadline:
+                raise exceptions.TimeoutException(
+                    "%s: no '%s' message before the deadline" %
+                    (self.name, kind))
+            if now - self.last_seen > self.timeout:
+                raise PeerLost(reason="no heartbeat for %ds" %
+                               (now - self.last_seen))
+            try:
+                message = self.messages.get(
+                    timeout=min(self.interval, deadline - now))
+            except queue.Empty:
+                continue
+            if message is _EOF:
+                raise PeerLost(reason="connection closed")
+            if message['type'] == 'abort':
+                raise PeerAborted(reason=message.get('reason'))
+            if message['type'] == kind:
+                return message
+            LOG.warning("%s: unexpected message %s", self.name, message)
+
+    def close(self):
+        self._closed.set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except (IOError, OSError):
+            pass
+        self.sock.close()
+
+
+class Publisher(object):
+    """Setup side: listens, then publishes the fixture"""
+
+    def __init__(self, key=None):
+        self.path = get_path(key)
+        # Held as long as the socket is in use, released even on a crash
+        self.lock = open(self.path + '.lock', 'a')
+        try:
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            self.lock.close()
+            # Its run side would get our fixture, or the other way round
+            raise HandoffError(reason="another isolation check is in "
+                                      "flight on %s" % self.path)
+        if os.path.exists(self.path):
+            LOG.info("/!\\ deleting previous socket %s /!\\" % self.path)
+            os.remove(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen(1)
+        self.connect_deadline = get_connect_deadline(get_deadline())
+        self.channel = None
+        self._connected = threading.Event()
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        try:
+            sock = self.server.accept()[0]
+        except (IOError, OSError):
+            # Closed before any peer showed up
+            return
+        self.channel = Channel(sock, 'UserIsolationSetup')
+        self._connected.set()
+
+    def _wait_peer(self, deadline):
+        deadline = min(deadline, self.connect_deadline)
+        if not self._connected.wait(max(0, deadline - time.time())):
+            raise exceptions.TimeoutException(
+                "UserIsolationRun did not connect to %s" % self.path)
+        return self.channel
+
+    def publish(self, fixture, deadline):
+        self._wait_peer(deadline).send('fixture', fixture=fixture)
+
+    def wait_done(self, deadline):
+        self._wait_peer(deadline).wait_for('done', deadline)
+
+    def close(self, reason=None):
+        """Close the rendezvous, telling the peer why if it still waits"""
+        if self.channel is not None:
+            if reason is not None:
+                try:
+                    self.channel.send('abort', reason=reason)
+                except (IOError, OSError):
+                    pass
+            self.channel.close()
+        self.server.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.lock.close()
+
+
+class Subscriber(object):
+    """Run side: connects, then receives the fixture"""
+
+    def __init__(self, deadline, key=None):
+        self.path = get_path(key)
+        # The setup side may not have started listening yet, or never will
+        connect_deadline = get_connect_deadline(deadline)
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                break
+            except (IOError, OSError):
+                sock.close()
+                if time.time() > connect_deadline:
+                    raise exceptions.TimeoutException(
+                        "UserIsolationSetup is not listening on %s" %
+                        self.path)
+                time.sleep(0.1)
+        self.channel = Channel(sock, 'UserIsolationRun')
+
+    def receive(self, deadline):
+        return self.channel.wait_for('fixture', deadline)['fixture']
+
+    def done(self):
+        try:
+            self.channel.send('done')
+        finally:
+            self.channel.close()
@@ -0,0 +1,183 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Throughput, IOPS and latency of a disk of a server, over SSH
+
+A bounded workload runs in a file of [fgcloud]io_probe_size MB of a
+directory of the server : a sequential write then read by 1 MB blocks, then
+random writes and reads by 4 KB blocks, none of them served by the page
+cache.
+
+With fio on the server, each of the four jobs stops after
+[fgcloud]io_probe_runtime seconds, and the latencies are those of fio. The
+guests without it (cirros) run dd instead, timed by the server itself
+(/proc/uptime) : [fgcloud]io_probe_ops random blocks, the writes being
+synced and the page cache dropped before the reads. dd gives no latency
+percentile, only the mean latency of each random block, the start of dd
+included.
+
+The series (see add_perfdata) are MB/s, IOPS and ms :
+
+    <target>_seq_write_mbps, <target>_seq_read_mbps,
+    <target>_rand_write_iops, <target>_rand_read_iops,
+    <target>_rand_write_lat_avg, <target>_rand_read_lat_avg,
+    <target>_rand_write_lat_p95, <target>_rand_write_lat_p99... (fio only)
+
+A threshold of a _mbps or _iops series is a floor : it is raised when the
+value drops below it (see perfdata.py).
+"""
+
+import json
+import random
+
+from oslo_log import log as logging
+from six.moves import shlex_quote
+
+from tempest.api.fgcloud import options
+from tempest.lib import exceptions as lib_exc
+
+LOG = logging.getLogger(__name__)
+
+FILE_NAME = 'fgcloud-io-probe'
+JOBS = (('seq_write', 'write', '1m'),
+        ('seq_read', 'read', '1m'),
+        ('rand_write', 'randwrite', '4k'),
+        ('rand_read', 'randread', '4k'))
+JOB_NAMES = set(job[0] for job in JOBS)
+PERCENTILES = (95, 99)
+
+DD_SCRIPT = """
+f=%(path)s
+trap 'rm -f $f' EXIT
+now() { cut -d' ' -f1 /proc/uptime; }
+s=$(now); dd if=/dev/zero of=$f bs=1M count=%(size)d conv=fsync 2>/dev/null
+echo seq_write $s $(now)
+sync; echo 3 > /proc/sys/vm/drop_caches
+s=$(now); dd if=$f of=/dev/null bs=1M 2>/dev/null
+echo seq_read $s $(now)
+s=$(now)
+for o in %(offsets)s; do
+    dd if=/dev/zero of=$f bs=4k count=1 seek=$o conv=notrunc,fsync 2>/dev/null
+done
+echo rand_write $s $(now)
+sync; echo 3 > /proc/sys/vm/drop_caches
+s=$(now)
+for o in %(offsets)s; do
+    dd if=$f of=/dev/null bs=4k count=1 skip=$o 2>/dev/null
+done
+echo rand_read $s $(now)
+"""
+
+
+def fio_command(path, size, runtime):
+    """One fio run of the four jobs, one after the other"""
+    args = ['fio', '--output-format=json', '--filename=%s' % path,
+            '--size=%dm' % size, '--direct=1', '--ioengine=psync',
+            '--runtime=%d' % runtime]
+    for name, rw, block_size in JOBS:
+        args.extend(['--name=%s' % name, '--rw=%s' % rw,
+                     '--bs=%s' % block_size, '--stonewall'])
+    return 'sudo sh -c %s' % shlex_quote(
+        '%s; rc=$?; rm -f %s; exit $rc' % (' '.join(args), path))
+
+
+def _latencies(stats):
+    """(mean, {percentile: latency}) of fio job stats, in ms"""
+    if 'clat_ns' in stats:
+        clat, scale = stats['clat_ns'], 1e-6
+    else:
+        # fio < 3
+        clat, scale = stats['clat'], 1e-3
+    percentiles = dict((float(rank), value * scale)
+                       for rank, value in clat.get('percentile', {}).items())
+    return clat['mean'] * scale, percentiles
+
+
+def parse_fio(output):
+    """{metric: value} of a fio JSON output"""
+    # fio may print warnings before the JSON document
+    report = json.loads(output[output.index('{'):])
+    metrics = {}
+    for job in report['jobs']:
+        name = job['jobname']
+        stats = job['write' if 'write' in name else 'read']
+        if name.startswith('seq_'):
+            # KiB/s
+            metrics['%s_mbps' % name] = stats['bw'] / 1024.0
+            continue
+        metrics['%s_iops' % name] = stats['iops']
+        mean, percentiles = _latencies(stats)
+        metrics['%s_lat_avg' % name] = mean
+        for rank in PERCENTILES:
+            if float(rank) in percentiles:
+                metrics['%s_lat_p%d' % (name, rank)] = percentiles[rank]
+    return metrics
+
+
+def dd_command(path, size, ops):
+    """The dd workload, ops random 4 KB blocks of the file"""
+    offsets = ' '.join(str(random.randrange(size * 256)) for _ in range(ops))
+    script = DD_SCRIPT % {'path': path, 'size': size, 'offsets': offsets}
+    return 'sudo sh -c %s' % shlex_quote(script)
+
+
+def parse_dd(output, size, ops):
+    """{metric: value} of the output of the dd workload"""
+    metrics = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) != 3 or fields[0] not in JOB_NAMES:
+            continue
+        # /proc/uptime has a resolution of 10 ms
+        elapsed = max(float(fields[2]) - float(fields[1]), 0.01)
+        name = fields[0]
+        if name.startswith('seq_'):
+            metrics['%s_mbps' % name] = size / elapsed
+        else:
+            metrics['%s_iops' % name] = ops / elapsed
+            metrics['%s_lat_avg' % name] = elapsed * 1000.0 / ops
+    return metrics
+
+
+def run(ssh_client, directory, size=None, runtime=None, ops=None):
+    """Run the workload in directory, return {metric: value}"""
+    conf = options.CONF.fgcloud
+    size = size or conf.io_probe_size
+    path = '%s/%s' % (directory.rstrip('/'), FILE_NAME)
+    try:
+        ssh_client.exec_command('command -v fio')
+    except lib_exc.SSHExecCommandFailed:
+        ops = ops or conf.io_probe_ops
+        LOG.info('No fio on the server, %d random blocks with dd', ops)
+        return parse_dd(ssh_client.exec_command(dd_command(path, size, ops)),
+                        size, ops)
+    return parse_fio(ssh_client.exec_command(
+        fio_command(path, size, runtime or conf.io_probe_runtime)))
+
+
+def add_perfdata(perf, target, metrics, suffix=''):
+    """Add the metrics of target (volume, ephemeral...) to perf
+
+    The series of a second run (suffix '_after_reboot'...) have the
+    thresholds of the first one.
+    """
+    for metric in sorted(metrics):
+        label = '%s_%s' % (target, metric)
+        if '_lat_' in metric:
+            perf.add(label + suffix, round(metrics[metric], 3), unit='ms',
+                     threshold_label=label)
+        else:
+            perf.add(label + suffix, round(metrics[metric], 1), unit='',
+                     floor=True, threshold_label=label)
@@ -0,0 +1,139 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Table driven isolation tests
+
+Each isolation test is a single API call made by user B on a resource of
+user A, described by a Case. run_cases() makes all the calls of a test class
+from resource_setup : concurrently, but for the destructive ones, which would
+change the resources the other calls use if they succeeded. Those are made
+one after the other once all the others are over, as the tests were run one
+by one before. add_tests() generates one test method per case which checks
+the outcome of its call : every case is still reported as its own test,
+with its own idempotent id.
+"""
+
+import sys
+
+import six
+import testtools
+
+from tempest.api.fgcloud import executor
+from tempest import config
+from tempest import test
+
+CONF = config.CONF
+
+
+def call(*args, **kwargs):
+    """Arguments of a case, as returned by its builder"""
+    return args, kwargs
+
+
+class Case(object):
+    """An API call of user B and its expected outcome
+
+    client is the name of the client attribute of the test class, builder
+    is called with the test class and returns call(...). The call must raise
+    one of the accepted exceptions. When may_succeed is set, succeeding is
+    accepted as well. A case without any accepted exception makes no call,
+    as the test it replaces : it only checks that the client has the method
+    (whether user B may call it depends on the policy of the site).
+
+    feature is a (group, option) pair of the tempest configuration, the case
+    is skipped when that option is disabled.
+    """
+
+    def __init__(self, name, idempotent_id, client, method, builder,
+                 accepted=(), may_succeed=False, destructive=False,
+                 feature=None, skip_msg=None):
+        self.name = name
+        self.idempotent_id = idempotent_id
+        self.client = client
+        self.method = method
+        self.builder = builder
+        self.accepted = accepted
+        self.may_succeed = may_succeed
+        self.destructive = destructive
+        self.feature = feature
+        self.skip_msg = skip_msg
+
+    @property
+    def enabled(self):
+        if self.feature is None:
+            return True
+        group, option = self.feature
+        return getattr(getattr(CONF, group), option)
+
+    def run(self, cls):
+        """Make the call with a client of its own, return its exc_info"""
+        try:
+            client = executor.clone(getattr(cls, self.client))
+            method = getattr(client, self.method)
+            args, kwargs = self.builder(cls)
+            if self.accepted:
+                method(*args, **kwargs)
+        except Exception:
+            return sys.exc_info()
+        return None
+
+    def check(self, test_case, exc_info):
+        if exc_info is None:
+            if self.accepted and not self.may_succeed:
+                test_case.fail("%s did not raise any of %s" %
+                               (self.method, ', '.join(
+                                   e.__name__ for e in self.accepted)))
+        elif not issubclass(exc_info[0], self.accepted):
+            six.reraise(*exc_info)
+
+
+def run_cases(cls, cases):
+    """Make the calls of the enabled cases, return {name: exc_info}"""
+    graph = executor.TaskGraph(cls.__name__)
+    enabled = [case for case in cases if case.enabled]
+    for case in enabled:
+        if not case.destructive:
+            graph.add(case.name, lambda case=case: case.run(cls))
+    # Each destructive call waits for all the others before it
+    previous = list(graph.tasks)
+    for case in enabled:
+        if case.destructive:
+            graph.add(case.name, lambda case=case: case.run(cls),
+                      requires=previous)
+            previous = [case.name]
+    return graph.run()
+
+
+def _make_test(case):
+    def test_case(self):
+        case.check(self, self.outcomes[case.name])
+
+    test_case.__name__ = 'test_' + case.name
+    if case.accepted:
+        test_case = test.attr(type=['negative'])(test_case)
+    test_case = test.idempotent_id(case.idempotent_id)(test_case)
+    if case.feature is not None:
+        test_case = testtools.skipUnless(case.enabled,
+                                         case.skip_msg)(test_case)
+    return test_case
+
+
+def add_tests(cls, cases):
+    """Add a test method per case to cls
+
+    cls.outcomes must be set to the result of run_cases() by resource_setup.
+    """
+    for case in cases:
+        setattr(cls, 'test_' + case.name, _make_test(case))
@@ -0,0 +1,138 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Round trip times and TCP throughput of the network of a server
+
+ping() sends a burst of [fgcloud]net_probe_ping_count pings from the
+monitoring host, remote_ping() the same burst from a server over SSH (one
+per second, the ping of busybox has no interval option). Both give the
+min / avg / p95 / max round trip time of the replies (ms) and the loss (%).
+
+throughput() sends [fgcloud]net_probe_size MB from a server to another one
+with dd and nc (busybox, so that it runs on cirros), timed by the sending
+server (/proc/uptime), the rate being that of the bytes the receiver got
+(MB/s).
+
+The series (see add_perfdata) are <path>_rtt_min, <path>_rtt_avg,
+<path>_rtt_p95, <path>_rtt_max, <path>_loss and <path>_tcp_mbps, whose
+threshold is a floor (see perfdata.py).
+"""
+
+import re
+import subprocess
+
+from oslo_log import log as logging
+from six.moves import shlex_quote
+
+from tempest.api.fgcloud import options
+from tempest.api.fgcloud import perfdata
+
+LOG = logging.getLogger(__name__)
+
+REPLY_TIME = re.compile(r'time[=<]\s*([\d.]+)\s*ms')
+TRANSMITTED = re.compile(r'(\d+) packets transmitted, (\d+) (?:packets )?'
+                         r'received')
+RECEIVED_FILE = '/tmp/fgcloud-net-probe'
+
+LISTEN_SCRIPT = """
+rm -f %(received)s
+(nc -l -p %(port)d < /dev/null | wc -c > %(received)s.tmp
+ mv %(received)s.tmp %(received)s) > /dev/null 2>&1 &
+sleep 1
+"""
+SEND_SCRIPT = """
+now() { cut -d' ' -f1 /proc/uptime; }
+s=$(now)
+dd if=/dev/zero bs=64k count=%(blocks)d 2>/dev/null |
+    nc -w %(timeout)d %(ip)s %(port)d
+echo $s $(now)
+"""
+WAIT_SCRIPT = """
+i=0
+while [ ! -f %(received)s ] && [ $i -lt %(timeout)d ]; do
+    sleep 1; i=$((i + 1))
+done
+cat %(received)s
+"""
+
+
+def parse_ping(output):
+    """{metric: value} of the output of ping (iputils or busybox)"""
+    times = sorted(float(time) for time in REPLY_TIME.findall(output))
+    counts = TRANSMITTED.search(output)
+    if counts is None:
+        raise ValueError('Not the output of ping : %r' % output[-200:])
+    sent, received = int(counts.group(1)), int(counts.group(2))
+    metrics = {'loss': 100.0 * (sent - received) / sent if sent else 100.0}
+    if times:
+        metrics.update(rtt_min=times[0],
+                       rtt_avg=sum(times) / len(times),
+                       rtt_p95=perfdata.percentile(times, 95),
+                       rtt_max=times[-1])
+    return metrics
+
+
+def ping(ip_address, count=None, interval=None):
+    """Burst of pings from the monitoring host"""
+    conf = options.CONF.fgcloud
+    cmd = ['ping', '-n', '-c', str(count or conf.net_probe_ping_count),
+           '-i', str(interval or conf.net_probe_ping_interval), '-W', '1',
+           ip_address]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    output = proc.communicate()[0]
+    # The exit status is not 0 when a reply is missing, the loss says it
+    return parse_ping(output.decode('utf-8', 'replace'))
+
+
+def remote_ping(ssh_client, ip_address, count=None):
+    """Burst of pings from a server"""
+    count = count or options.CONF.fgcloud.net_probe_ping_count
+    return parse_ping(ssh_client.exec_command(
+        'ping -c %d %s || true' % (count, ip_address)))
+
+
+def throughput(sender, receiver, ip_address, size=None, port=None):
+    """{'tcp_mbps': rate} of size MB sent by sender to ip_address"""
+    conf = options.CONF.fgcloud
+    size = size or conf.net_probe_size
+    port = port or conf.net_probe_port
+    # At least 1 MB/s
+    timeout = max(size, 10)
+    values = {'received': RECEIVED_FILE, 'port': port, 'ip': ip_address,
+              'blocks': size * 16, 'timeout': timeout}
+    receiver.exec_command('sh -c %s' % shlex_quote(LISTEN_SCRIPT % values))
+    output = sender.exec_command('sh -c %s' % shlex_quote(
+        SEND_SCRIPT % values))
+    start, end = [float(value) for value in output.split()[-2:]]
+    received = int(receiver.exec_command('sh -c %s' % shlex_quote(
+        WAIT_SCRIPT % values)).strip() or 0)
+    if received < size * 1024 * 1024:
+        LOG.warning('%s received %d bytes out of %d MB', ip_address,
+                    received, size)
+    # /proc/uptime has a resolution of 10 ms
+    return {'tcp_mbps': received / 1048576.0 / max(end - start, 0.01)}
+
+
+def add_perfdata(perf, path, metrics):
+    """Add the metrics of path (fip, vm_fixed...) to perf"""
+    for metric in sorted(metrics):
+        label = '%s_%s' % (path, metric)
+        if metric == 'tcp_mbps':
+            perf.add(label, round(metrics[metric], 1), unit='', floor=True)
+        elif metric == 'loss':
+            perf.add(label, round(metrics[metric], 1), unit='%')
+        else:
+            perf.add(label, round(metrics[metric], 3), unit='ms')
@@ -0,0 +1,197 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""The [fgcloud] section of tempest.conf
+
+These options are not known by tempest itself, so they are registered on the
+global oslo.config object tempest parses its configuration file with.
+"""
+
+from oslo_config import cfg
+
+CONF = cfg.CONF
+
+fgcloud_group = cfg.OptGroup(name='fgcloud',
+                             title='FG-Cloud monitoring options')
+
+FgcloudGroup = [
+    cfg.DictOpt('phase_warning',
+                default={},
+                help="WARNING thresholds (in seconds) of the perfdata "
+                     "series, ex: boot_time:60,ssh_ready_time:90 (minimums "
+                     "of the throughput and IOPS series, ex: "
+                     "volume_seq_write_mbps:20)"),
+    cfg.DictOpt('phase_critical',
+                default={},
+                help="CRITICAL thresholds (in seconds) of the perfdata "
+                     "series, ex: boot_time:180,ssh_ready_time:240"),
+    cfg.StrOpt('site_id',
+               help="Identifier of the site, shared by the two tempest.conf "
+                    "files of an isolation check (defaults to "
+                    "[compute]image_ref)"),
+    cfg.StrOpt('handoff_dir',
+               default='/tmp',
+               help="Directory of the Unix sockets used by the isolation "
+                    "checks to hand the fixture over"),
+    cfg.IntOpt('handoff_heartbeat_interval',
+               default=2,
+               help="Seconds between two heartbeats of an isolation check "
+                    "side"),
+    cfg.IntOpt('handoff_heartbeat_timeout',
+               default=20,
+               help="An isolation check fails when its peer has not been "
+                    "heard of for that many seconds"),
+    cfg.IntOpt('handoff_connect_timeout',
+               default=60,
+               help="An isolation check fails when its peer has not "
+                    "connected within that many seconds of its start"),
+    cfg.IntOpt('handoff_timeout',
+               default=1200,
+               help="Deadline (in seconds) of an isolation check handoff"),
+    cfg.IntOpt('cleanup_timeout',
+               default=300,
+               help="Deadline (in seconds) shared by all the deletions of "
+                    "a fgcloud test cleanup"),
+    cfg.IntOpt('max_workers',
+               default=8,
+               help="Maximum number of API calls or waits run concurrently "
+                    "by a fgcloud test"),
+    cfg.BoolOpt('pool_enabled',
+                default=False,
+                help="test_basic_scenario leases its server, volume and "
+                     "floating IP from the warm pool daemon (fgcloud/pool.py) "
+                     "when one is running"),
+    cfg.IntOpt('pool_size',
+               default=2,
+               help="Number of warm servers, volumes and floating IPs kept "
+                    "ready by the pool daemon for each of its accounts"),
+    cfg.ListOpt('pool_accounts',
+                default=[],
+                help="Usernames of the accounts.yaml accounts the pool "
+                     "daemon provisions (defaults to the first account)"),
+    cfg.IntOpt('pool_max_age',
+               default=3600,
+               help="Seconds after which a warm server is deleted and booted "
+                    "again, so that the boot latency keeps being measured"),
+    cfg.IntOpt('pool_lease_timeout',
+               default=1800,
+               help="Seconds after which a leased server which was not "
+                    "released is recycled"),
+    cfg.IntOpt('pool_refill_interval',
+               default=10,
+               help="Seconds between two refills of the warm pool"),
+    cfg.BoolOpt('token_cache',
+                default=False,
+                help="Share the Keystone token and service catalog of an "
+                     "account between the check runs (fgcloud/auth_cache.py)"),
+    cfg.StrOpt('token_cache_dir',
+               default='/tmp',
+               help="Directory of the token cache files"),
+    cfg.IntOpt('token_expiry_margin',
+               default=300,
+               help="A cached token is not used any more that many seconds "
+                    "before it expires"),
+    cfg.DictOpt('poll_initial_interval',
+                default={},
+                help="Seconds before the second status poll of a wait, per "
+                     "resource type (fgcloud/polling.py), ex: "
+                     "default:0.5,server:2 (default : 0.5)"),
+    cfg.DictOpt('poll_max_interval',
+                default={},
+                help="Longest interval between two status polls, per "
+                     "resource type (default : [compute]build_interval)"),
+    cfg.DictOpt('poll_backoff_factor',
+                default={},
+                help="The polling interval is multiplied by this factor "
+                     "after each poll, per resource type (default : 2)"),
+    cfg.DictOpt('poll_jitter',
+                default={},
+                help="Each polling interval is randomized by +/- this "
+                     "fraction, per resource type (default : 0.1)"),
+    cfg.BoolOpt('io_probe',
+                default=False,
+                help="test_basic_scenario measures the throughput, IOPS and "
+                     "latency of the attached volume and of the ephemeral "
+                     "disk, before and after the reboot "
+                     "(fgcloud/io_probe.py)"),
+    cfg.IntOpt('io_probe_size',
+               default=64,
+               help="Size (in MB) of the file written and read by the I/O "
+                    "probe"),
+    cfg.IntOpt('io_probe_runtime',
+               default=10,
+               help="Longest duration (in seconds) of each of the four fio "
+                    "jobs of the I/O probe"),
+    cfg.IntOpt('io_probe_ops',
+               default=200,
+               help="Random 4 KB writes and reads of the I/O probe on the "
+                    "servers without fio"),
+    cfg.StrOpt('io_probe_ephemeral_dir',
+               default='/var/tmp',
+               help="Directory of the ephemeral disk the I/O probe writes "
+                    "into"),
+    cfg.BoolOpt('net_probe',
+                default=False,
+                help="test_basic_scenario measures the round trip times to "
+                     "its floating IP, and boots a second server to measure "
+                     "the round trip times and TCP throughput between them, "
+                     "on the fixed and floating IPs (fgcloud/net_probe.py)"),
+    cfg.IntOpt('net_probe_ping_count',
+               default=20,
+               help="Pings of each round trip time measure of the network "
+                    "probe"),
+    cfg.FloatOpt('net_probe_ping_interval',
+                 default=0.2,
+                 help="Seconds between two pings of the monitoring host "
+                      "(less than 0.2 needs root)"),
+    cfg.IntOpt('net_probe_size',
+               default=16,
+               help="MB sent from a server to the other one by each "
+                    "throughput measure of the network probe"),
+    cfg.IntOpt('net_probe_port',
+               default=5001,
+               help="TCP port of the throughput measures, opened on the "
+                    "second server"),
+    cfg.StrOpt('net_probe_flavor',
+               help="Flavor of the second server of the network probe "
+                    "(defaults to [compute]flavor_ref)"),
+    cfg.IntOpt('health_repeat',
+               default=5,
+               help="Calls of each endpoint by test_api_health"),
+    cfg.IntOpt('health_concurrency',
+               default=4,
+               help="Calls of test_api_health made at the same time"),
+    cfg.BoolOpt('snapshot_boot',
+                default=False,
+                help="UserIsolationSetup also boots a server from its server "
+                     "snapshot, exported as snapshot_boot_time"),
+    cfg.BoolOpt('isolation_persistent',
+                default=False,
+                help="UserIsolationSetup keeps its resources between runs "
+                     "and only creates again the missing or broken ones "
+                     "(see fgcloud/fixture.py)"),
+    cfg.IntOpt('isolation_fixture_max_age',
+               default=0,
+               help="Seconds after which the persistent isolation fixture is "
+                    "deleted and created again, so that its creation keeps "
+                    "being measured (0 : never)"),
+    cfg.BoolOpt('poll_batch',
+                default=True,
+                help="Concurrent waits on the servers, volumes or snapshots "
+                     "of an account share a single list call per poll"),
+]
+
+CONF.register_group(fgcloud_group)
+CONF.register_opts(FgcloudGroup, group=fgcloud_group)
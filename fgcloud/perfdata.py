@@ -0,0 +1,106 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Export timings and values of a test as perfdata series
+
+The series are attached to the test result as a JSON detail named
+'fgcloud-perfdata'. monitoring/subunit_filter.py reads it from the subunit
+stream and appends the series to the Nagios perfdata.
+"""
+
+import collections
+import contextlib
+import json
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2.7, oslo.utils depends on it
+    from monotonic import monotonic
+
+from testtools import content
+
+from tempest.api.fgcloud import options
+
+DETAIL_NAME = 'fgcloud-perfdata'
+
+
+def percentile(values, rank):
+    """Linear interpolation of the rank-th percentile of sorted values"""
+    position = (len(values) - 1) * rank / 100.0
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def _threshold(thresholds, label):
+    value = thresholds.get(label)
+    return float(value) if value not in (None, '') else None
+
+
+class PerfData(object):
+    """Ordered collection of perfdata series
+
+    Thresholds are read from [fgcloud]phase_warning / phase_critical. The
+    threshold of a floor series (a throughput...) is a minimum. A series
+    measured before the test (the latencies of a warm pool slot) has its age
+    and no thresholds.
+    """
+
+    def __init__(self, warning=None, critical=None):
+        if warning is None:
+            warning = options.CONF.fgcloud.phase_warning
+        if critical is None:
+            critical = options.CONF.fgcloud.phase_critical
+        self.warning = warning
+        self.critical = critical
+        self.series = collections.OrderedDict()
+
+    def add(self, label, value, unit='s', floor=False, threshold_label=None,
+            age=None):
+        """threshold_label is the label of the thresholds, label's default
+
+        age is the number of seconds since value was measured, if not now.
+        """
+        threshold_label = threshold_label or label
+        serie = {'label': label,
+                 'value': value,
+                 'unit': unit,
+                 'warn': _threshold(self.warning, threshold_label),
+                 'crit': _threshold(self.critical, threshold_label)}
+        if floor:
+            serie['floor'] = True
+        if age is not None:
+            serie['age'] = age
+            serie['warn'] = serie['crit'] = None
+        self.series[label] = serie
+
+    @contextlib.contextmanager
+    def timer(self, label):
+        """Time a block with a monotonic clock, even if it raises"""
+        start = monotonic()
+        try:
+            yield
+        finally:
+            previous = self.series.get(label, {}).get('value', 0)
+            self.add(label, previous + monotonic() - start)
+
+    def to_json(self):
+        return json.dumps(list(self.series.values()))
+
+    def attach(self, test):
+        """Attach the series to the result of test (a testtools TestCase)"""
+        test.addDetail(DETAIL_NAME,
+                       content.text_content(self.to_json()))
@@ -0,0 +1,397 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Status waits with an adaptive polling interval
+
+The tempest waiters poll every [compute]build_interval seconds : a long
+interval adds up to a whole interval to each measured step, a short one
+hammers the APIs for the whole length of a boot. The waits of this module
+poll again after [fgcloud]poll_initial_interval seconds, then multiply the
+interval by [fgcloud]poll_backoff_factor up to [fgcloud]poll_max_interval
+(by default [compute]build_interval), each interval being randomized by
++/- [fgcloud]poll_jitter so that concurrent waits do not poll together.
+
+These options are dicts keyed by resource type (server, volume, snapshot,
+image, secgroup...), the 'default' key applying to the other types, ex:
+
+    poll_initial_interval = default:0.5,server:2
+
+Each wait records its number of polls and the latency its last interval
+may have added (the resource reached its status at some point of that
+interval). They are summed per resource type by stats() and exported as
+perfdata series by add_perfdata() (<type>_polls, <type>_poll_latency).
+
+With [fgcloud]poll_batch, the concurrent waits on the servers, volumes or
+snapshots of an account share a BatchPoller : a single detailed list call
+refreshes the status of all of them, instead of a GET per resource.
+
+The wait_for_* functions take the same arguments and raise the same
+exceptions as their tempest.common.waiters counterparts.
+"""
+
+import random
+import threading
+import time
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2.7, oslo.utils depends on it
+    from monotonic import monotonic
+
+from oslo_log import log as logging
+
+from tempest.api.fgcloud import executor
+from tempest.api.fgcloud import options
+from tempest import config
+from tempest import exceptions
+from tempest.lib import exceptions as lib_exc
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+DEFAULTS = {'poll_initial_interval': 0.5,
+            'poll_backoff_factor': 2.0,
+            'poll_jitter': 0.1}
+
+_lock = threading.Lock()
+_stats = {}
+
+
+def _get(name, kind):
+    values = getattr(options.CONF.fgcloud, name)
+    value = values.get(kind, values.get('default'))
+    if value in (None, ''):
+        if name == 'poll_max_interval':
+            return float(CONF.compute.build_interval)
+        return DEFAULTS[name]
+    return float(value)
+
+
+class Backoff(object):
+    """Polling intervals of the waits on a resource type"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.initial = _get('poll_initial_interval', kind)
+        self.maximum = max(_get('poll_max_interval', kind), self.initial)
+        self.factor = _get('poll_backoff_factor', kind)
+        self.jitter = _get('poll_jitter', kind)
+
+    def intervals(self):
+        interval = self.initial
+        while True:
+            yield interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+            interval = min(interval * self.factor, self.maximum)
+
+
+def _record(kind, polls, latency, elapsed):
+    with _lock:
+        stats = _stats.setdefault(kind, {'waits': 0, 'polls': 0,
+                                         'latency': 0.0, 'time': 0.0})
+        stats['waits'] += 1
+        stats['polls'] += polls
+        stats['latency'] += latency
+        stats['time'] += elapsed
+
+
+def stats():
+    """{type: {'waits', 'polls', 'latency', 'time'}} since the last reset"""
+    with _lock:
+        return dict((kind, dict(values)) for kind, values in _stats.items())
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def add_perfdata(perf):
+    """Add the polls and added latency of each resource type to perf"""
+    for kind, values in sorted(stats().items()):
+        perf.add('%s_polls' % kind, values['polls'], unit='')
+        perf.add('%s_poll_latency' % kind, round(values['latency'], 3))
+
+
+def wait(kind, check, timeout, message):
+    """Poll check() until it returns a true value, and return this value
+
+    check() raises to abort the wait. TimeoutException (with message) is
+    raised when it still returns a false value after timeout seconds.
+    """
+    start = monotonic()
+    intervals = Backoff(kind).intervals()
+    polls = 0
+    interval = 0
+    result = None
+    try:
+        while True:
+            polls += 1
+            result = check()
+            if result:
+                return result
+            elapsed = monotonic() - start
+            if elapsed >= timeout:
+                raise exceptions.TimeoutException(
+                    '%s within the required time (%s s).' % (message,
+                                                             timeout))
+            interval = min(next(intervals), timeout - elapsed)
+            time.sleep(interval)
+    finally:
+        elapsed = monotonic() - start
+        _record(kind, polls, interval if result else 0.0, elapsed)
+        LOG.debug("%s: %d polls in %.1f s", message, polls, elapsed)
+
+
+def call_until_true(kind, func, timeout):
+    """Same as tempest.test.call_until_true, polling adaptively"""
+    try:
+        return wait(kind, func, timeout, 'Waiting for %s' % kind)
+    except exceptions.TimeoutException:
+        return False
+
+
+def _list_servers(client, since):
+    return client.list_servers(detail=True,
+                               **{'changes-since': since})['servers']
+
+
+def _list_volumes(client, since):
+    return client.list_volumes(detail=True)['volumes']
+
+
+def _list_snapshots(client, since):
+    return client.list_snapshots(detail=True)['snapshots']
+
+
+# List call and show method of the types polled in batch
+BATCH = {'server': (_list_servers, 'show_server'),
+         'volume': (_list_volumes, 'show_volume'),
+         'snapshot': (_list_snapshots, 'show_snapshot')}
+# changes-since is not that precise, and the clocks may differ
+CHANGES_SINCE_MARGIN = 300
+# A resource not polled for that long is not waited for any more
+FORGET_AFTER = 600
+
+_pollers = {}
+
+
+class BatchPoller(object):
+    """Statuses of all the resources of a type, from a single list call
+
+    It stands for the client of the wait_for_* functions : the statuses
+    are refreshed by a detailed list of the resources of the tenant (the
+    servers changed since the oldest wait started) at most once every
+    max_age seconds, whatever the number of concurrent waits. The waits
+    which poll meanwhile wait for the running list call. A resource which
+    is not listed (deleted, beyond the first page) is shown on its own.
+    """
+
+    def __init__(self, kind, client, max_age):
+        self.kind = kind
+        self.client = client
+        self.build_timeout = client.build_timeout
+        self.max_age = max_age
+        self._list, self._show = BATCH[kind]
+        self._cond = threading.Condition()
+        self._listing = False
+        # monotonic() when the last list call started
+        self._listed = None
+        self._resources = {}
+        # {id: (first poll, its time.time(), last poll)}
+        self._watched = {}
+
+    def _fresh(self, first_poll):
+        return (self._listed is not None and self._listed >= first_poll and
+                monotonic() - self._listed < self.max_age)
+
+    def _since(self):
+        now = monotonic()
+        for resource_id, (_, _, last) in list(self._watched.items()):
+            if now - last > FORGET_AFTER:
+                del self._watched[resource_id]
+        oldest = min(first for _, first, _ in self._watched.values())
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                             time.gmtime(oldest - CHANGES_SINCE_MARGIN))
+
+    def _get(self, resource_id):
+        with self._cond:
+            now = monotonic()
+            first_poll, first_time, _ = self._watched.get(
+                resource_id, (now, time.time(), now))
+            self._watched[resource_id] = (first_poll, first_time, now)
+            # The first listing started after the first poll of this
+            # resource is awaited, so that a new resource is listed too
+            while self._listing and not self._fresh(first_poll):
+                self._cond.wait()
+            if self._fresh(first_poll):
+                return self._resources.get(resource_id)
+            self._listing = True
+            since = self._since()
+        started = monotonic()
+        resources = None
+        try:
+            resources = self._list(self.client, since)
+        finally:
+            with self._cond:
+                self._listing = False
+                if resources is not None:
+                    self._resources = dict((r['id'], r) for r in resources)
+                    self._listed = started
+                self._cond.notify_all()
+        return self._resources.get(resource_id)
+
+    def show(self, resource_id):
+        resource = self._get(resource_id)
+        if resource is None or resource.get('status') == 'DELETED':
+            return getattr(self.client, self._show)(
+                resource_id)[self.kind]
+        return resource
+
+    def show_server(self, server_id):
+        return {'server': self.show(server_id)}
+
+    def show_volume(self, volume_id):
+        return {'volume': self.show(volume_id)}
+
+    def show_snapshot(self, snapshot_id):
+        return {'snapshot': self.show(snapshot_id)}
+
+
+def batch(kind, client):
+    """The BatchPoller of kind shared by the clones of client
+
+    client itself if [fgcloud]poll_batch is not set or kind is not polled
+    in batch.
+    """
+    if (not options.CONF.fgcloud.poll_batch or kind not in BATCH or
+            isinstance(client, BatchPoller)):
+        return client
+    key = (kind, type(client), client.auth_provider)
+    with _lock:
+        poller = _pollers.get(key)
+        if poller is None:
+            # Polled from many threads, with its own connection
+            polling_client = executor.clone(client)
+            executor.thread_safe(polling_client)
+            poller = BatchPoller(kind, polling_client,
+                                 Backoff(kind).initial)
+            _pollers[key] = poller
+        return poller
+
+
+def wait_for_server_status(client, server_id, status, ready_wait=True,
+                           raise_on_error=True):
+    """Waits for a server to reach a given status."""
+    client = batch('server', client)
+
+    def check():
+        body = client.show_server(server_id)['server']
+        server_status = body['status']
+        task_state = body.get('OS-EXT-STS:task_state', None)
+        if status == 'BUILD':
+            return server_status != 'UNKNOWN'
+        if server_status == 'ERROR' and raise_on_error and status != 'ERROR':
+            if 'fault' in body:
+                raise exceptions.BuildErrorException(body['fault'],
+                                                     server_id=server_id)
+            raise exceptions.BuildErrorException(server_id=server_id)
+        if server_status != status:
+            return False
+        # The server is "ready for action" when no task is in progress
+        return not ready_wait or str(task_state) == 'None'
+
+    wait('server', check, client.build_timeout,
+         'Server %s failed to reach %s status' % (server_id, status))
+    if ready_wait and status != 'BUILD':
+        # Without the state api extension, as the tempest waiter does
+        time.sleep(CONF.compute.ready_wait)
+
+
+def wait_for_server_termination(client, server_id, ignore_error=False):
+    """Waits for server to reach termination."""
+    client = batch('server', client)
+
+    def check():
+        try:
+            body = client.show_server(server_id)['server']
+        except lib_exc.NotFound:
+            return True
+        if body['status'] == 'ERROR' and not ignore_error:
+            raise exceptions.BuildErrorException(server_id=server_id)
+        return False
+
+    wait('server', check, client.build_timeout,
+         'Server %s failed to terminate' % server_id)
+
+
+def wait_for_volume_status(client, volume_id, status):
+    """Waits for a Volume to reach a given status."""
+    client = batch('volume', client)
+
+    def check():
+        volume_status = client.show_volume(volume_id)['volume']['status']
+        if volume_status == status:
+            return True
+        if volume_status == 'error':
+            raise exceptions.VolumeBuildErrorException(volume_id=volume_id)
+        if volume_status == 'error_restoring':
+            raise exceptions.VolumeRestoreErrorException(volume_id=volume_id)
+        return False
+
+    wait('volume', check, client.build_timeout,
+         'Volume %s failed to reach %s status' % (volume_id, status))
+
+
+def wait_for_snapshot_status(client, snapshot_id, status):
+    """Waits for a Snapshot to reach a given status."""
+    client = batch('snapshot', client)
+
+    def check():
+        snapshot_status = client.show_snapshot(
+            snapshot_id)['snapshot']['status']
+        if snapshot_status == status:
+            return True
+        if snapshot_status == 'error':
+            raise exceptions.SnapshotBuildErrorException(
+                snapshot_id=snapshot_id)
+        return False
+
+    wait('snapshot', check, client.build_timeout,
+         'Snapshot %s failed to reach %s status' % (snapshot_id, status))
+
+
+def wait_for_image_status(client, image_id, status):
+    """Waits for an image to reach a given status."""
+    def check():
+        image = client.show_image(image_id)
+        # Unlike the glance one, the compute client wraps the image
+        if 'image' in image:
+            image = image['image']
+        if image['status'] == status:
+            return True
+        if image['status'] == 'ERROR':
+            raise exceptions.AddImageException(image_id=image_id)
+        return False
+
+    wait('image', check, client.build_timeout,
+         'Image %s failed to reach %s status' % (image_id, status))
+
+
+def wait_for_resource_deletion(client, kind, resource_id):
+    """Same as client.wait_for_resource_deletion, polling adaptively"""
+    wait(kind, lambda: client.is_resource_deleted(resource_id),
+         client.build_timeout,
+         '%s %s failed to delete' % (kind.capitalize(), resource_id))
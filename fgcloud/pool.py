@@ -0,0 +1,553 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Warm pool of servers, volumes and floating IPs for test_basic_scenario
+
+The daemon keeps [fgcloud]pool_size slots ready for each of its accounts. A
+slot is an ACTIVE server booted with the keypair of the pool, an available
+volume and an allocated floating IP, all tagged with the fgcloud_pool
+metadata (or recorded in the state file for the floating IPs). Slots are
+built concurrently in the background, the latency of each resource is
+recorded and handed over with the slot, so that the boot latency is still
+reported, as pool_boot_time, pool_volume_create_time and pool_fip_time.
+
+test_basic_scenario leases a slot when [fgcloud]pool_enabled is set, then
+releases it : a healthy slot younger than [fgcloud]pool_max_age goes back to
+the pool, any other one is deleted and replaced.
+
+The daemon listens on a Unix socket next to the handoff ones, each request
+is a single JSON line answered by a single JSON line :
+
+    lease      {"username": ...} -> {"slot": {...}} or {"slot": null}
+    release    {"slot": id, "healthy": bool}
+    status     -> {"pools": {username: [slot states]}}
+
+Run it from the tempest directory, with the TEMPEST_CONFIG variables of the
+monitored site (see warm_pool.sh) :
+
+    python -m tempest.api.fgcloud.pool
+"""
+
+import argparse
+import collections
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from oslo_log import log as logging
+
+from tempest.api.fgcloud import executor
+from tempest.api.fgcloud import handoff
+from tempest.api.fgcloud import options
+from tempest.api.fgcloud import polling
+from tempest import clients
+from tempest.common import credentials_factory
+from tempest.common import fixed_network
+from tempest.common import preprov_creds
+from tempest import config
+from tempest.lib import exceptions as lib_exc
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+METADATA_KEY = 'fgcloud_pool'
+CREDENTIAL_FIELDS = ('username', 'password', 'tenant_name', 'project_name',
+                     'tenant_id', 'project_id', 'user_id', 'domain_name',
+                     'user_domain_name', 'project_domain_name')
+# Latency of the slot resources, as reported by test_basic_scenario
+TIMINGS = collections.OrderedDict([('server', 'pool_boot_time'),
+                                   ('volume', 'pool_volume_create_time'),
+                                   ('floating_ip', 'pool_fip_time')])
+
+
+def get_path(key=None):
+    return os.path.join(options.CONF.fgcloud.handoff_dir,
+                        'tempest_pool_%s.sock' % (key or handoff.get_key()))
+
+
+def get_state_path(username, key=None):
+    return os.path.join(options.CONF.fgcloud.handoff_dir,
+                        'tempest_pool_%s_%s.json' %
+                        (key or handoff.get_key(), username))
+
+
+def _request(message, timeout=10):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(get_path())
+        sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        line = sock.makefile('rb').readline()
+    finally:
+        sock.close()
+    if not line:
+        raise IOError("the pool daemon closed the connection")
+    return json.loads(line.decode('utf-8'))
+
+
+def lease(username):
+    """Lease a slot of the warm pool, None if there is none ready"""
+    try:
+        slot = _request({'type': 'lease', 'username': username})['slot']
+    except (IOError, OSError, ValueError) as exc:
+        LOG.warning("Warm pool not available (%s)", exc)
+        return None
+    if slot is None:
+        LOG.warning("Warm pool of %s is empty", username)
+    return slot
+
+
+def release(slot_id, healthy):
+    """Give a leased slot back, it is recycled unless healthy"""
+    try:
+        _request({'type': 'release', 'slot': slot_id, 'healthy': healthy})
+    except (IOError, OSError, ValueError) as exc:
+        # The daemon recycles the slot when its lease times out
+        LOG.warning("Cannot release %s to the warm pool (%s)", slot_id, exc)
+
+
+def status():
+    return _request({'type': 'status'})
+
+
+def load_config():
+    """Parse tempest.conf, the [fgcloud] options are parsed along"""
+    return CONF.auth
+
+
+def read_accounts():
+    """The accounts.yaml entries of [fgcloud]pool_accounts"""
+    accounts = preprov_creds.read_accounts_yaml(
+        load_config().test_accounts_file)
+    usernames = options.CONF.fgcloud.pool_accounts
+    if not usernames:
+        return accounts[:1]
+    found = [a for a in accounts if a['username'] in usernames]
+    missing = set(usernames) - set(a['username'] for a in found)
+    if missing:
+        raise ValueError("No account %s in %s" %
+                         (', '.join(sorted(missing)),
+                          CONF.auth.test_accounts_file))
+    return found
+
+
+class Slot(object):
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:8]
+        self.name = 'fgcloud-pool-%s' % self.id
+        self.server = None
+        self.volume = None
+        self.floating_ip = None
+        self.timings = {}
+        self.state = 'building'
+        self.created = time.time()
+        self.leased = None
+
+    def to_dict(self, keypair):
+        return {'id': self.id,
+                'server': self.server,
+                'volume': self.volume,
+                'floating_ip': self.floating_ip,
+                'keypair': keypair,
+                'timings': self.timings,
+                'created': self.created}
+
+
+class WarmPool(object):
+    """Slots of a single account"""
+
+    def __init__(self, account, key, size=None):
+        self.username = account['username']
+        self.key = key
+        self.size = options.CONF.fgcloud.pool_size if size is None else size
+        self.max_age = options.CONF.fgcloud.pool_max_age
+        self.lease_timeout = options.CONF.fgcloud.pool_lease_timeout
+        credentials = credentials_factory.get_credentials(
+            **dict((k, v) for k, v in account.items()
+                   if k in CREDENTIAL_FIELDS))
+        manager = clients.Manager(credentials=credentials)
+        self.servers_client = manager.servers_client
+        self.floating_ips_client = manager.compute_floating_ips_client
+        self.keypairs_client = manager.keypairs_client
+        if CONF.volume_feature_enabled.api_v1:
+            self.volumes_client = manager.volumes_client
+        else:
+            self.volumes_client = manager.volumes_v2_client
+        network_name = (account.get('resources', {}).get('network') or
+                        CONF.compute.fixed_network_name)
+        self.network = {}
+        if network_name:
+            self.network = fixed_network.get_network_from_name(
+                network_name, manager.compute_networks_client)
+        self.keypair = None
+        self.slots = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    # Lifecycle
+
+    def start(self):
+        self.sweep()
+        name = 'fgcloud-pool-%s-%s' % (self.key, self.username)
+        try:
+            self.keypairs_client.delete_keypair(name)
+        except lib_exc.NotFound:
+            pass
+        keypair = self.keypairs_client.create_keypair(name=name)['keypair']
+        self.keypair = {'name': keypair['name'],
+                        'private_key': keypair['private_key']}
+
+    def sweep(self):
+        """Delete what a previous daemon left behind"""
+        servers = self.servers_client.list_servers(detail=True)['servers']
+        volumes = self.volumes_client.list_volumes(detail=True)['volumes']
+        graph = executor.TaskGraph('%s sweep' % self.username)
+        # Each task has its own clients, the deletions really overlap
+        for server in servers:
+            if server.get('metadata', {}).get(METADATA_KEY) == self.key:
+                graph.add(server['id'], lambda s=server: self._delete_server(
+                    executor.clone(self.servers_client), s))
+        for volume in volumes:
+            if volume.get('metadata', {}).get(METADATA_KEY) == self.key:
+                graph.add(volume['id'], lambda v=volume: self._delete_volume(
+                    executor.clone(self.volumes_client), v))
+        try:
+            with open(get_state_path(self.username, self.key)) as state:
+                floating_ips = json.load(state)['floating_ips']
+        except (IOError, ValueError, KeyError):
+            floating_ips = []
+        for floating_ip in floating_ips:
+            graph.add(floating_ip['id'],
+                      lambda f=floating_ip: self._delete_floating_ip(
+                          executor.clone(self.floating_ips_client), f))
+        graph.run(deadline=time.time() + options.CONF.fgcloud.cleanup_timeout,
+                  raise_errors=False)
+        self._save()
+
+    def _save(self):
+        """Record the floating IPs, they cannot be tagged"""
+        path = get_state_path(self.username, self.key)
+        # The builds and recycles of the slots save at once : one writer of
+        # the tmp file at a time
+        with self.lock:
+            floating_ips = [s.floating_ip for s in self.slots.values()
+                            if s.floating_ip is not None]
+            with open(path + '.tmp', 'w') as state:
+                json.dump({'floating_ips': floating_ips}, state)
+            os.rename(path + '.tmp', path)
+
+    # Slots
+
+    def refill(self):
+        """Recycle the expired slots, then build the missing ones"""
+        now = time.time()
+        with self.lock:
+            for slot in self.slots.values():
+                if (slot.state == 'ready' and
+                        now - slot.created > self.max_age):
+                    LOG.info("%s: slot %s expired", self.username, slot.id)
+                    self._start(self._recycle, slot)
+                elif (slot.state == 'leased' and
+                        now - slot.leased > self.lease_timeout):
+                    LOG.warning("%s: lease of %s timed out", self.username,
+                                slot.id)
+                    self._start(self._recycle, slot)
+            active = [s for s in self.slots.values()
+                      if s.state in ('building', 'ready', 'leased',
+                                     'checking')]
+            for _ in range(self.size - len(active)):
+                slot = Slot()
+                self.slots[slot.id] = slot
+                self._start(self._build, slot)
+
+    def _start(self, target, slot):
+        if target == self._recycle:
+            slot.state = 'recycling'
+        thread = threading.Thread(target=target, args=(slot,))
+        thread.daemon = True
+        thread.start()
+
+    def _build(self, slot):
+        # Each task has its own clients, the three builds really overlap
+        servers_client = executor.clone(self.servers_client)
+        volumes_client = executor.clone(self.volumes_client)
+        floating_ips_client = executor.clone(self.floating_ips_client)
+        metadata = {METADATA_KEY: self.key}
+
+        def create_server():
+            kwargs = fixed_network.set_networks_kwarg(self.network, {}) or {}
+            slot.server = servers_client.create_server(
+                name=slot.name, imageRef=CONF.compute.image_ref,
+                flavorRef=CONF.compute.flavor_ref,
+                key_name=self.keypair['name'], metadata=metadata,
+                **kwargs)['server']
+            polling.wait_for_server_status(servers_client, slot.server['id'],
+                                           'ACTIVE')
+            slot.server = servers_client.show_server(
+                slot.server['id'])['server']
+
+        def create_volume():
+            slot.volume = volumes_client.create_volume(
+                display_name=slot.name, metadata=metadata)['volume']
+            polling.wait_for_volume_status(volumes_client, slot.volume['id'],
+                                           'available')
+            slot.volume = volumes_client.show_volume(
+                slot.volume['id'])['volume']
+
+        def create_floating_ip():
+            slot.floating_ip = floating_ips_client.create_floating_ip(
+                pool=CONF.network.floating_network_name)['floating_ip']
+            self._save()
+
+        graph = executor.TaskGraph('%s slot %s' % (self.username, slot.id))
+        graph.add('server', create_server)
+        graph.add('volume', create_volume)
+        graph.add('floating_ip', create_floating_ip)
+        graph.run(raise_errors=False)
+        slot.timings = dict((TIMINGS[name], elapsed)
+                            for name, elapsed in graph.timings.items())
+        if graph.report():
+            LOG.warning("%s: cannot build slot %s %s", self.username, slot.id,
+                        json.dumps(graph.report()))
+            self._recycle(slot)
+            return
+        LOG.info("%s: slot %s ready %s", self.username, slot.id,
+                 json.dumps(slot.timings))
+        with self.lock:
+            slot.created = time.time()
+            slot.state = 'ready'
+
+    def _recycle(self, slot):
+        with self.lock:
+            slot.state = 'recycling'
+        servers_client = executor.clone(self.servers_client)
+        volumes_client = executor.clone(self.volumes_client)
+        floating_ips_client = executor.clone(self.floating_ips_client)
+        graph = executor.TaskGraph('%s recycle %s' % (self.username, slot.id))
+        if slot.floating_ip is not None:
+            graph.add('floating_ip', lambda: self._delete_floating_ip(
+                floating_ips_client, slot.floating_ip))
+        if slot.server is not None:
+            graph.add('server', lambda: self._delete_server(
+                servers_client, slot.server))
+        if slot.volume is not None:
+            # An attached volume is freed by the deletion of the server
+            graph.add('volume', lambda: self._delete_volume(
+                volumes_client, slot.volume),
+                requires=['server'] if slot.server is not None else [])
+        graph.run(deadline=time.time() + options.CONF.fgcloud.cleanup_timeout,
+                  raise_errors=False)
+        if graph.report():
+            LOG.warning("%s: cannot recycle slot %s %s", self.username,
+                        slot.id, json.dumps(graph.report()))
+        with self.lock:
+            self.slots.pop(slot.id, None)
+        self._save()
+
+    def _check(self, slot):
+        """Put a released slot back in the pool if nothing was left on it"""
+        # Other slots are checked, built or recycled meanwhile
+        servers_client = executor.clone(self.servers_client)
+        volumes_client = executor.clone(self.volumes_client)
+        floating_ips_client = executor.clone(self.floating_ips_client)
+        try:
+            server = servers_client.show_server(slot.server['id'])['server']
+            volume = volumes_client.show_volume(slot.volume['id'])['volume']
+            floating_ip = floating_ips_client.show_floating_ip(
+                slot.floating_ip['id'])['floating_ip']
+            healthy = (server['status'] == 'ACTIVE' and
+                       volume['status'] == 'available' and
+                       not floating_ip.get('instance_id'))
+        except lib_exc.NotFound:
+            healthy = False
+        # Under the lock : a ready slot can be leased at once
+        with self.lock:
+            if slot.state != 'checking':
+                # drain() is recycling it meanwhile
+                return
+            if healthy:
+                slot.state = 'ready'
+                return
+        LOG.warning("%s: released slot %s is not clean", self.username,
+                    slot.id)
+        self._recycle(slot)
+
+    def _delete_server(self, client, server):
+        try:
+            client.delete_server(server['id'])
+        except lib_exc.NotFound:
+            return
+        polling.wait_for_server_termination(client, server['id'])
+
+    def _delete_volume(self, client, volume):
+        try:
+            polling.wait_for_volume_status(client, volume['id'], 'available')
+            client.delete_volume(volume['id'])
+        except lib_exc.NotFound:
+            return
+        polling.wait_for_resource_deletion(client, 'volume', volume['id'])
+
+    def _delete_floating_ip(self, client, floating_ip):
+        try:
+            client.delete_floating_ip(floating_ip['id'])
+        except lib_exc.NotFound:
+            pass
+
+    # Requests
+
+    def lease(self):
+        with self.lock:
+            for slot in self.slots.values():
+                if slot.state == 'ready':
+                    slot.state = 'leased'
+                    slot.leased = time.time()
+                    LOG.info("%s: slot %s leased", self.username, slot.id)
+                    return slot.to_dict(self.keypair)
+        return None
+
+    def release(self, slot_id, healthy):
+        with self.lock:
+            slot = self.slots.get(slot_id)
+            if slot is None or slot.state != 'leased':
+                return False
+            slot.state = 'checking'
+        LOG.info("%s: slot %s released (healthy: %s)", self.username,
+                 slot.id, healthy)
+        if healthy and time.time() - slot.created < self.max_age:
+            self._start(self._check, slot)
+        else:
+            self._start(self._recycle, slot)
+        return True
+
+    def status(self):
+        with self.lock:
+            return [{'id': s.id, 'state': s.state, 'created': s.created,
+                     'timings': s.timings} for s in self.slots.values()]
+
+    def drain(self):
+        """Delete all the slots, leased ones included"""
+        with self.lock:
+            slots = list(self.slots.values())
+        graph = executor.TaskGraph('%s drain' % self.username)
+        for slot in slots:
+            graph.add(slot.id, lambda s=slot: self._recycle(s))
+        graph.run(raise_errors=False)
+        try:
+            self.keypairs_client.delete_keypair(self.keypair['name'])
+        except lib_exc.NotFound:
+            pass
+
+
+class PoolServer(object):
+    """Serve the lease requests of the checks, refill the pools"""
+
+    def __init__(self, pools, key=None):
+        self.pools = dict((pool.username, pool) for pool in pools)
+        self.path = get_path(key)
+        self._stopped = threading.Event()
+
+    def serve(self):
+        if os.path.exists(self.path):
+            LOG.info("/!\\ deleting previous socket %s /!\\" % self.path)
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        # Slots carry the private key of the pool
+        os.chmod(self.path, 0o600)
+        server.listen(16)
+        thread = threading.Thread(target=self._accept, args=(server,))
+        thread.daemon = True
+        thread.start()
+        try:
+            while not self._stopped.is_set():
+                for pool in self.pools.values():
+                    pool.refill()
+                self._stopped.wait(options.CONF.fgcloud.pool_refill_interval)
+        finally:
+            server.close()
+            os.remove(self.path)
+            for pool in self.pools.values():
+                pool.drain()
+
+    def stop(self, *args):
+        self._stopped.set()
+
+    def _accept(self, server):
+        while True:
+            try:
+                sock = server.accept()[0]
+            except (IOError, OSError):
+                return
+            thread = threading.Thread(target=self._handle, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, sock):
+        try:
+            line = sock.makefile('rb').readline()
+            reply = self.dispatch(json.loads(line.decode('utf-8')))
+            sock.sendall((json.dumps(reply) + '\n').encode('utf-8'))
+        except (IOError, OSError, ValueError, KeyError) as exc:
+            LOG.warning("Bad pool request (%s)", exc)
+        finally:
+            sock.close()
+
+    def dispatch(self, message):
+        if message['type'] == 'lease':
+            pool = self.pools.get(message['username'])
+            return {'slot': pool.lease() if pool is not None else None}
+        if message['type'] == 'release':
+            released = any(pool.release(message['slot'], message['healthy'])
+                           for pool in self.pools.values())
+            return {'released': released}
+        if message['type'] == 'status':
+            return {'pools': dict((name, pool.status())
+                                  for name, pool in self.pools.items())}
+        raise ValueError("unknown request %s" % message['type'])
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Keep warm servers, volumes and floating IPs ready for "
+                    "test_basic_scenario")
+    parser.add_argument('--status', action='store_true',
+                        help="Print the slots of the running daemon and exit")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    load_config()
+    if args.status:
+        print(json.dumps(status(), indent=2, sort_keys=True))
+        return 0
+    key = handoff.get_key()
+    pools = [WarmPool(account, key) for account in read_accounts()]
+    for pool in pools:
+        pool.start()
+    server = PoolServer(pools, key)
+    signal.signal(signal.SIGTERM, server.stop)
+    signal.signal(signal.SIGINT, server.stop)
+    server.serve()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
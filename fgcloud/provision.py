@@ -0,0 +1,583 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Create the tempest accounts of accounts.yaml (admin side)
+
+Account i is the project <prefix>_tenant_i, the user <prefix>_user_i, the
+network <prefix>_net_i, its subnet <prefix>_subnet_i and the router
+<prefix>_router_i, plugged into the subnet and into the external network.
+
+The users, projects, networks, subnets, routers and router interfaces are
+listed at once with a single admin session (the same as teardown.py), the
+missing resources are then created stage by stage, each resource as soon as
+the ones it depends on exist (see executor.py), at most --workers API calls
+at a time :
+
+    project -> user -> role
+            -> network -> subnet -> interface
+            -> router ------------>
+
+Nothing is created twice : a run after a failed one only fills the gaps. The
+subnets get the first /--prefixlen blocks of --supernet which overlap no
+existing subnet. accounts.yaml is then written again (atomically, readable by
+the owner only) with the passwords of the accounts it already has : the
+password of an existing user it does not have is reset (Keystone v2 only).
+Every account whose user exists with a known password is written, those
+with errors are marked incomplete ; the entries of the other accounts are
+kept as they were.
+
+Run it from the tempest directory, with the TEMPEST_CONFIG variables of the
+site (see tools/create_tempest_users.sh) :
+
+    python -m tempest.api.fgcloud.provision --accounts 60
+    python -m tempest.api.fgcloud.provision -a 60 --supernet 10.64.0.0/16
+"""
+
+import argparse
+import collections
+import json
+import os
+import random
+import string
+import sys
+import threading
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2.7, oslo.utils depends on it
+    from monotonic import monotonic
+
+import netaddr
+from oslo_log import log as logging
+import yaml
+
+from tempest.api.fgcloud import executor
+from tempest.api.fgcloud import options
+from tempest.api.fgcloud import pool
+from tempest.api.fgcloud import teardown
+from tempest import clients
+from tempest import config
+from tempest.lib import exceptions as lib_exc
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+# Stages, in the order of the report, with the stages they wait for
+STAGES = collections.OrderedDict([
+    ('project', []),
+    ('user', ['project']),
+    ('role', ['user']),
+    ('network', ['project']),
+    ('subnet', ['network']),
+    ('router', ['project']),
+    ('interface', ['router', 'subnet']),
+])
+# Resource names of account i
+NAMES = {'project': '%s_tenant_%d', 'user': '%s_user_%d',
+         'network': '%s_net_%d', 'subnet': '%s_subnet_%d',
+         'router': '%s_router_%d'}
+PASSWORD_CHARS = string.ascii_letters + string.digits + '_'
+
+
+def generate_password(length=16):
+    generator = random.SystemRandom()
+    return ''.join(generator.choice(PASSWORD_CHARS) for _ in range(length))
+
+
+def read_passwords(path):
+    """{username: account} of an existing accounts.yaml"""
+    if not os.path.exists(path):
+        return collections.OrderedDict()
+    with open(path) as accounts:
+        entries = yaml.safe_load(accounts) or []
+    return collections.OrderedDict((entry['username'], entry)
+                                   for entry in entries)
+
+
+class Account(object):
+    """Names and resources of account i"""
+
+    def __init__(self, prefix, index):
+        self.index = index
+        self.names = dict((stage, name % (prefix, index))
+                          for stage, name in NAMES.items())
+        self.resources = {}
+        self.password = None
+        self.cidr = None
+
+    def to_yaml(self, incomplete=()):
+        """incomplete are the stages of the account which failed"""
+        mark = ''
+        if incomplete:
+            mark = ("# Incomplete (%s failed), run provision again\n" %
+                    ', '.join(incomplete))
+        return ("\n# Test user %d\n"
+                "%s"
+                "- username: '%s'\n"
+                "  tenant_name: '%s'\n"
+                "  password: '%s'\n"
+                "  resources:\n"
+                "    network: '%s'\n" % (
+                    self.index, mark, self.names['user'],
+                    self.names['project'],
+                    self.password, self.names['network']))
+
+
+class Provision(object):
+    """Users, projects and networks of the tempest accounts"""
+
+    def __init__(self, credentials, prefix, count, supernet, prefixlen,
+                 external_network, roles, workers, dry_run=False):
+        self.prefix = prefix
+        self.supernet = netaddr.IPNetwork(supernet)
+        self.prefixlen = prefixlen
+        self.external_network = external_network
+        self.roles = roles
+        self.workers = workers
+        self.dry_run = dry_run
+        self.slots = threading.BoundedSemaphore(workers)
+        self._output = threading.Lock()
+        manager = clients.Manager(credentials=credentials)
+        self.auth_provider = manager.auth_provider
+        self.routers_client = manager.routers_client
+        self.subnets_client = manager.subnets_client
+        self.networks_client = manager.networks_client
+        self.ports_client = manager.ports_client
+        self.v3 = CONF.identity.auth_version == 'v3'
+        if self.v3:
+            self.users_client = manager.users_v3_client
+            self.projects_client = manager.projects_client
+            self.roles_client = manager.roles_v3_client
+        else:
+            self.users_client = manager.users_client
+            self.projects_client = manager.tenants_client
+            self.roles_client = manager.roles_client
+        self.accounts = [Account(prefix, index)
+                         for index in range(1, count + 1)]
+        self.todo = collections.OrderedDict((stage, []) for stage in STAGES)
+        self.created = dict((stage, []) for stage in STAGES)
+        self.errors = dict((stage, []) for stage in STAGES)
+        self.gateway = None
+        self.role_ids = []
+        self.graph = None
+        self.elapsed = None
+
+    # Listing, once per type
+
+    def _list_users(self):
+        return self.users_client.list_users()['users']
+
+    def _list_projects(self):
+        if self.v3:
+            return self.projects_client.list_projects()['projects']
+        return self.projects_client.list_tenants()['tenants']
+
+    def _list_roles(self):
+        if not self.roles:
+            return []
+        return self.roles_client.list_roles()['roles']
+
+    def _list_networks(self):
+        return self.networks_client.list_networks()['networks']
+
+    def _list_subnets(self):
+        return self.subnets_client.list_subnets()['subnets']
+
+    def _list_routers(self):
+        return self.routers_client.list_routers()['routers']
+
+    def _list_interfaces(self):
+        return self.ports_client.list_ports(
+            device_owner='network:router_interface')['ports']
+
+    def _find_roles(self, roles):
+        by_name = dict((r['name'], r['id']) for r in roles)
+        missing = [name for name in self.roles if name not in by_name]
+        if missing:
+            raise lib_exc.NotFound('No role %s' % ', '.join(missing))
+        return [by_name[name] for name in self.roles]
+
+    def _find_gateway(self, networks):
+        if not self.external_network:
+            return None
+        for network in networks:
+            if self.external_network in (network['id'], network['name']):
+                return network['id']
+        raise lib_exc.NotFound('No external network %s' %
+                               self.external_network)
+
+    def _allocate(self, subnets):
+        """Free blocks of the supernet, in order"""
+        used = netaddr.IPSet(s['cidr'] for s in subnets
+                             if s.get('ip_version', 4) == 4)
+        for block in self.supernet.subnet(self.prefixlen):
+            if not used.intersection(netaddr.IPSet([block])):
+                yield block
+
+    def list(self, path):
+        """List everything at once, then find what each account lacks"""
+        # Authenticate before the concurrent calls, they would all do it
+        self.auth_provider.get_token()
+        kinds = ('users', 'projects', 'roles', 'networks', 'subnets',
+                 'routers', 'interfaces')
+        graph = executor.TaskGraph('provision list', max_workers=len(kinds))
+        for kind in kinds:
+            graph.add(kind, getattr(self, '_list_%s' % kind))
+        listed = graph.run()
+        self.role_ids = self._find_roles(listed['roles'])
+        self.gateway = self._find_gateway(listed['networks'])
+
+        def by_name(kind):
+            return dict((r.get('name'), r) for r in listed[kind])
+        projects = by_name('projects')
+        users = by_name('users')
+        known = read_passwords(path)
+        for account in self.accounts:
+            project = projects.get(account.names['project'])
+            user = users.get(account.names['user'])
+            if project is not None:
+                account.resources['project'] = project
+            else:
+                self.todo['project'].append(account)
+            if user is None:
+                account.password = generate_password()
+                self.todo['user'].append(account)
+                if self.role_ids:
+                    self.todo['role'].append(account)
+            else:
+                account.resources['user'] = user
+                entry = known.get(account.names['user'])
+                if entry is not None:
+                    account.password = entry.get('password')
+                else:
+                    # Existing user not in accounts.yaml
+                    account.password = generate_password()
+                    self.todo['user'].append(account)
+            self._list_network(account, listed)
+        free = self._allocate(listed['subnets'])
+        for account in self.todo['subnet']:
+            account.cidr = next(free, None)
+            if account.cidr is None:
+                raise ValueError('No /%d left in %s for %d subnets' % (
+                    self.prefixlen, self.supernet, len(self.todo['subnet'])))
+        return self.todo
+
+    def _list_network(self, account, listed):
+        project = account.resources.get('project')
+        if project is None:
+            for stage in ('network', 'subnet', 'router', 'interface'):
+                self.todo[stage].append(account)
+            return
+
+        def find(kind, **fields):
+            for resource in listed[kind]:
+                if all(resource.get(key) == value
+                       for key, value in fields.items()):
+                    return resource
+        for stage, kind in (('network', 'networks'), ('router', 'routers')):
+            resource = find(kind, name=account.names[stage],
+                            tenant_id=project['id'])
+            if resource is None:
+                self.todo[stage].append(account)
+            else:
+                account.resources[stage] = resource
+        network = account.resources.get('network')
+        subnet = network and find('subnets', name=account.names['subnet'],
+                                  network_id=network['id'])
+        if not subnet:
+            self.todo['subnet'].append(account)
+        else:
+            account.resources['subnet'] = subnet
+        router = account.resources.get('router')
+        if router is not None and not router.get('external_gateway_info') \
+                and self.gateway and account not in self.todo['router']:
+            # Created before its gateway was set
+            self.todo['router'].append(account)
+        if not subnet or router is None or not any(
+                p['device_id'] == router['id'] and
+                any(ip['subnet_id'] == subnet['id'] for ip in p['fixed_ips'])
+                for p in listed['interfaces']):
+            self.todo['interface'].append(account)
+
+    # Creation
+
+    def _progress(self, stage, done, total):
+        with self._output:
+            sys.stderr.write('%-9s %4d / %d\n' % (stage, done, total))
+            sys.stderr.flush()
+
+    def _create_project(self, client, account):
+        name = account.names['project']
+        description = 'Tempest tenant %d' % account.index
+        if self.v3:
+            return client.create_project(
+                name, description=description)['project']
+        return client.create_tenant(name, description=description)['tenant']
+
+    def _create_user(self, client, account):
+        user = account.resources.get('user')
+        project_id = account.resources['project']['id']
+        if user is None:
+            if self.v3:
+                return client.create_user(
+                    account.names['user'], password=account.password,
+                    project_id=project_id,
+                    default_project_id=project_id)['user']
+            return client.create_user(account.names['user'],
+                                      account.password, project_id,
+                                      None)['user']
+        if self.v3:
+            raise lib_exc.Conflict('user %s exists, its password is not in '
+                                   'accounts.yaml' % account.names['user'])
+        client.update_user_password(user['id'], password=account.password)
+        return user
+
+    def _create_role(self, client, account):
+        for role_id in self.role_ids:
+            args = (account.resources['project']['id'],
+                    account.resources['user']['id'], role_id)
+            try:
+                if self.v3:
+                    client.assign_user_role_on_project(*args)
+                else:
+                    client.assign_user_role(*args)
+            except lib_exc.Conflict:
+                pass
+        return account.resources['user']
+
+    def _create_network(self, client, account):
+        return client.create_network(
+            name=account.names['network'],
+            tenant_id=account.resources['project']['id'])['network']
+
+    def _create_subnet(self, client, account):
+        return client.create_subnet(
+            name=account.names['subnet'], ip_version=4,
+            cidr=str(account.cidr),
+            network_id=account.resources['network']['id'],
+            tenant_id=account.resources['project']['id'])['subnet']
+
+    def _create_router(self, client, account):
+        gateway = ({'network_id': self.gateway} if self.gateway else None)
+        router = account.resources.get('router')
+        if router is not None:
+            return client.update_router(
+                router['id'], external_gateway_info=gateway)['router']
+        return client.create_router(
+            name=account.names['router'], external_gateway_info=gateway,
+            tenant_id=account.resources['project']['id'])['router']
+
+    def _create_interface(self, client, account):
+        return client.add_router_interface(
+            account.resources['router']['id'],
+            subnet_id=account.resources['subnet']['id'])
+
+    def _client(self, stage):
+        return {'project': self.projects_client,
+                'user': self.users_client,
+                'role': self.roles_client,
+                'network': self.networks_client,
+                'subnet': self.subnets_client,
+                'router': self.routers_client,
+                'interface': self.routers_client}[stage]
+
+    def _create(self, stage, account):
+        # Each creation has a client of its own
+        client = executor.clone(self._client(stage))
+        with self.slots:
+            resource = getattr(self, '_create_%s' % stage)(client, account)
+            with self._output:
+                if stage != 'interface':
+                    account.resources[stage] = resource
+                self.created[stage].append(account.names[
+                    {'role': 'user', 'interface': 'router'}.get(stage,
+                                                                stage)])
+                done = len(self.created[stage])
+        self._progress(stage, done, len(self.todo[stage]))
+
+    def create(self):
+        """Create what is missing, stage by stage for each account"""
+        self.graph = executor.TaskGraph('provision', max_workers=self.workers)
+        for stage, requires in STAGES.items():
+            for account in self.todo[stage]:
+                self.graph.add(
+                    '%s %d' % (stage, account.index),
+                    lambda s=stage, a=account: self._create(s, a),
+                    requires=['%s %d' % (r, account.index) for r in requires
+                              if account in self.todo[r]])
+        self.graph.run(raise_errors=False)
+        for failure in self.graph.report():
+            stage, index = failure['task'].split()
+            self.errors[stage].append({
+                'account': int(index),
+                'error': failure['error'] or failure['state']})
+
+    # accounts.yaml
+
+    def write(self, path):
+        """Write the accounts with a user, keep the other entries of the file
+
+        The password of a user whose creation (or reset) failed is unknown :
+        its previous entry, if any, is kept as is.
+        """
+        failed = collections.defaultdict(list)
+        for stage in STAGES:
+            for error in self.errors[stage]:
+                failed[error['account']].append(stage)
+        content = ['# Generated users for use with tempest API\n']
+        written = set()
+        for account in self.accounts:
+            if ('user' not in account.resources or
+                    'user' in failed[account.index]):
+                continue
+            content.append(account.to_yaml(failed[account.index]))
+            written.add(account.names['user'])
+        others = [entry for username, entry in read_passwords(path).items()
+                  if username not in written]
+        if others:
+            content.append('\n# Other accounts\n')
+            content.append(yaml.safe_dump(others, default_flow_style=False))
+        tmp_path = '%s.%d' % (path, os.getpid())
+        # Passwords are secrets : readable by the owner only
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as accounts:
+            accounts.write(''.join(content))
+        os.rename(tmp_path, path)
+
+    def provision(self, path):
+        """List, create what is missing, then write accounts.yaml"""
+        start = monotonic()
+        self.list(path)
+        if not self.dry_run:
+            self.create()
+            self.write(path)
+        self.elapsed = monotonic() - start
+
+    def stage_timings(self):
+        """{stage: calls, wall time and slowest call} of the creations"""
+        timings = collections.OrderedDict()
+        tasks = self.graph.tasks.values() if self.graph else []
+        for stage in STAGES:
+            ran = [t for t in tasks if t.name.split()[0] == stage and
+                   t.elapsed is not None]
+            if not ran:
+                continue
+            first = min(t.start for t in ran)
+            last = max(t.start + t.elapsed for t in ran)
+            timings[stage] = {'calls': len(ran),
+                              'wall': round(last - first, 3),
+                              'max': round(max(t.elapsed for t in ran), 3)}
+        return timings
+
+    def report(self):
+        return {'prefix': self.prefix,
+                'dry_run': self.dry_run,
+                'elapsed': round(self.elapsed or 0, 3),
+                'accounts': len(self.accounts),
+                'stages': collections.OrderedDict(
+                    (stage, {'missing': [a.index for a in accounts],
+                             'created': self.created[stage],
+                             'errors': self.errors[stage]})
+                    for stage, accounts in self.todo.items()),
+                'cidrs': dict((a.names['subnet'], str(a.cidr))
+                              for a in self.todo['subnet']),
+                'timings': self.stage_timings()}
+
+
+def print_report(report):
+    print('prefix %s, %d accounts (%.1fs)' % (
+        report['prefix'], report['accounts'], report['elapsed']))
+    for stage, resources in report['stages'].items():
+        if not resources['missing']:
+            continue
+        if report['dry_run']:
+            print('  Would create %d %s(s)' % (
+                len(resources['missing']), stage))
+            continue
+        timing = report['timings'].get(stage, {})
+        print('  %-9s %4d missing %4d created %4d errors %7.2fs '
+              '(slowest %.2fs)' % (
+                  stage, len(resources['missing']),
+                  len(resources['created']), len(resources['errors']),
+                  timing.get('wall', 0), timing.get('max', 0)))
+        for error in resources['errors']:
+            print('    account %d : %s' % (error['account'], error['error']))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Create the tempest users, projects and networks")
+    parser.add_argument('-a', '--accounts', type=int, default=6,
+                        help="Number of accounts (default : 6)")
+    parser.add_argument('-p', '--prefix', default='tempest',
+                        help="Prefix of the names of the resources")
+    parser.add_argument('--supernet', default='192.168.0.0/16',
+                        help="Range of the subnets of the accounts (default "
+                             ": 192.168.0.0/16)")
+    parser.add_argument('--prefixlen', type=int, default=24,
+                        help="Size of the subnets (default : 24)")
+    parser.add_argument('-e', '--external-network',
+                        help="Name or id of the network of the router "
+                             "gateways (default : [network]"
+                             "public_network_id)")
+    parser.add_argument('-r', '--role', action='append', dest='roles',
+                        help="Role of the users on their project (default "
+                             ": [auth]tempest_roles, Member with Keystone "
+                             "v3)")
+    parser.add_argument('-o', '--output',
+                        help="accounts.yaml to write (default : [auth]"
+                             "test_accounts_file)")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="List what is missing, do not create it")
+    parser.add_argument('-w', '--workers', type=int,
+                        help="API calls at the same time (default : "
+                             "[fgcloud]max_workers)")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the report as JSON")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    pool.load_config()
+    if not args.prefix or args.accounts < 1:
+        sys.stderr.write("A prefix and at least one account are needed\n")
+        return 2
+    roles = args.roles or CONF.auth.tempest_roles
+    if not roles and CONF.identity.auth_version == 'v3':
+        # A v3 user has no access to its default project without a role
+        roles = ['Member']
+    provision = Provision(
+        teardown.admin_credentials(), args.prefix, args.accounts,
+        args.supernet, args.prefixlen,
+        args.external_network or CONF.network.public_network_id, roles,
+        args.workers or options.CONF.fgcloud.max_workers,
+        dry_run=args.dry_run)
+    try:
+        provision.provision(args.output or CONF.auth.test_accounts_file)
+    except (ValueError, lib_exc.NotFound) as exc:
+        sys.stderr.write("%s\n" % exc)
+        return 2
+    report = provision.report()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 1 if any(provision.errors.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
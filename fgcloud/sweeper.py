@@ -0,0 +1,470 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Delete the resources the tests left behind
+
+The resources named after [DEFAULT]resources_prefix (the tempest-... names
+given by the tests, or --prefix) are deleted for each account of
+accounts.yaml (or the --username ones). Each account authenticates once
+(through the token cache, see auth_cache.py) and lists each resource type
+once, the servers being filtered by name on the Nova side.
+
+The deletions run concurrently, at most --workers API calls at a time, in
+dependency order (see executor.py) :
+
+ * servers, server snapshots (images), volume snapshots and keypairs at once
+ * the volumes attached to a server which is not swept are detached
+ * the volumes once the servers, the detachments and the volume snapshots
+   are over, the floating IPs of the swept servers (and, with --free-ips,
+   the unassociated ones) and the security groups once the servers are over
+
+The end of the deletions (or of the detachments) of a resource type is
+awaited with a single list call per poll, whatever the number of resources.
+A resource that the account is not allowed to delete (the one of another
+user with the isolation policies) is left to its owner.
+
+Run it from the tempest directory, with the TEMPEST_CONFIG variables of the
+site (see tools/clean_stack.sh) :
+
+    python -m tempest.api.fgcloud.sweeper --dry-run
+    python -m tempest.api.fgcloud.sweeper --prefix fgmonitoring --json
+"""
+
+import argparse
+import collections
+import json
+import sys
+import threading
+import time
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2.7, oslo.utils depends on it
+    from monotonic import monotonic
+
+from oslo_log import log as logging
+
+from tempest.api.fgcloud import auth_cache
+from tempest.api.fgcloud import executor
+from tempest.api.fgcloud import options
+from tempest.api.fgcloud import polling
+from tempest.api.fgcloud import pool
+from tempest import clients
+from tempest.common import credentials_factory
+from tempest.common import preprov_creds
+from tempest import config
+from tempest import exceptions
+from tempest.lib import exceptions as lib_exc
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+# Resource types, in the order of the report
+KINDS = ('server', 'image', 'volume_snapshot', 'volume', 'floating_ip',
+         'security_group', 'keypair')
+# Volume statuses which forbid a deletion for a while
+BUSY = ('in-use', 'attaching', 'detaching', 'creating', 'downloading',
+        'uploading', 'backing-up', 'restoring-backup')
+
+
+def _name(resource):
+    # Cinder v1 has display_name, keypairs have no id
+    return resource.get('name') or resource.get('display_name') or ''
+
+
+def _summary(resource):
+    return {'id': resource.get('id') or resource['name'],
+            'name': _name(resource)}
+
+
+class Sweeper(object):
+    """Leftovers of a single account"""
+
+    def __init__(self, account, prefix, workers, dry_run=False,
+                 free_ips=False):
+        self.username = account['username']
+        self.prefix = prefix
+        self.dry_run = dry_run
+        self.free_ips = free_ips
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(workers)
+        # Not filled in, which would take a token of its own
+        credentials = credentials_factory.get_credentials(
+            fill_in=False, **dict((k, v) for k, v in account.items()
+                                  if k in pool.CREDENTIAL_FIELDS))
+        manager = clients.Manager(credentials=credentials)
+        self.auth_provider = manager.auth_provider
+        self.servers_client = manager.servers_client
+        self.images_client = manager.compute_images_client
+        self.keypairs_client = manager.keypairs_client
+        self.security_client = manager.compute_security_groups_client
+        self.floating_ips_client = manager.compute_floating_ips_client
+        if CONF.volume_feature_enabled.api_v1:
+            self.volumes_client = manager.volumes_client
+            self.snapshots_client = manager.snapshots_client
+        else:
+            self.volumes_client = manager.volumes_v2_client
+            self.snapshots_client = manager.snapshots_v2_client
+        self.found = collections.OrderedDict((kind, []) for kind in KINDS)
+        self.deleted = dict((kind, []) for kind in KINDS)
+        self.forbidden = dict((kind, []) for kind in KINDS)
+        self.errors = dict((kind, []) for kind in KINDS)
+        self.detached = set()
+        self.elapsed = None
+
+    def _match(self, resource):
+        return _name(resource).startswith(self.prefix)
+
+    # Listing, once per type
+
+    def _list_servers(self, client):
+        # A regex on the Nova side, checked again as a prefix here
+        return client.list_servers(detail=True,
+                                   name=self.prefix)['servers']
+
+    def _list_images(self, client):
+        return client.list_images(detail=True)['images']
+
+    def _list_volume_snapshots(self, client):
+        return client.list_snapshots(detail=True)['snapshots']
+
+    def _list_volumes(self, client):
+        return client.list_volumes(detail=True)['volumes']
+
+    def _list_floating_ips(self, client):
+        return client.list_floating_ips()['floating_ips']
+
+    def _list_security_groups(self, client):
+        return client.list_security_groups()['security_groups']
+
+    def _list_keypairs(self, client):
+        return [k['keypair'] for k in client.list_keypairs()['keypairs']]
+
+    def _client(self, kind):
+        return {'server': self.servers_client,
+                'image': self.images_client,
+                'volume_snapshot': self.snapshots_client,
+                'volume': self.volumes_client,
+                'floating_ip': self.floating_ips_client,
+                'security_group': self.security_client,
+                'keypair': self.keypairs_client}[kind]
+
+    def _list(self, kind):
+        """All the resources of kind, from a client of its own"""
+        client = executor.clone(self._client(kind))
+        return getattr(self, '_list_%ss' % kind)(client)
+
+    def list(self):
+        """Find the leftovers, all the types being listed at once"""
+        # Authenticate before the concurrent calls, they would all do it
+        self.auth_provider.get_token()
+        graph = executor.TaskGraph('%s list' % self.username,
+                                   max_workers=len(KINDS))
+        for kind in KINDS:
+            graph.add(kind, lambda k=kind: self._list(k))
+        listed = graph.run()
+        for kind in KINDS:
+            if kind == 'floating_ip':
+                continue
+            self.found[kind] = [r for r in listed[kind] if self._match(r)]
+        servers = set(s['id'] for s in self.found['server'])
+        self.found['floating_ip'] = [
+            f for f in listed['floating_ip']
+            if f.get('instance_id') in servers or
+            (self.free_ips and not f.get('instance_id'))]
+        return self.found
+
+    # Deletion
+
+    def _call(self, kind, resource, func, client=None):
+        """Run a deletion call within the worker slots"""
+        resource_id = _summary(resource)['id']
+        with self.slots:
+            try:
+                func(executor.clone(client or self._client(kind)),
+                     resource_id)
+            except lib_exc.NotFound:
+                pass
+            except lib_exc.Forbidden:
+                LOG.info("%s: %s %s belongs to another user", self.username,
+                         kind, resource_id)
+                self.forbidden[kind].append(resource_id)
+                return False
+        return True
+
+    def _record(self, kind, graph):
+        """Errors of a graph of per resource tasks"""
+        for failure in graph.report():
+            self.errors[kind].append({
+                'id': failure['task'],
+                'error': failure['error'] or failure['state']})
+
+    def _delete_all(self, kind, resources, func):
+        """Call func(client, id) on each resource, return the called ids"""
+        graph = executor.TaskGraph('%s %s' % (self.username, kind),
+                                   max_workers=self.workers)
+        for resource in resources:
+            graph.add(_summary(resource)['id'],
+                      lambda r=resource: self._call(kind, r, func))
+        results = graph.run(raise_errors=False)
+        self._record(kind, graph)
+        return [resource_id for resource_id, called in results.items()
+                if called]
+
+    def _wait(self, kind, ids, pending, deadline):
+        """Wait until pending(listed resources) is empty for ids
+
+        A single list call per poll, whatever the number of resources.
+        Those still pending at the deadline are reported as errors.
+        """
+        remaining = set(ids)
+        if not remaining:
+            return
+
+        def check():
+            listed = dict((_summary(r)['id'], r) for r in self._list(kind))
+            for resource_id in list(remaining):
+                if not pending(listed.get(resource_id)):
+                    remaining.discard(resource_id)
+            return not remaining
+
+        try:
+            polling.wait(kind, check, max(0, deadline - time.time()),
+                         '%d %s(s) of %s' % (len(remaining), kind,
+                                             self.username))
+        except exceptions.TimeoutException:
+            for resource_id in sorted(remaining):
+                self.errors[kind].append({'id': resource_id,
+                                          'error': 'still there'})
+
+    def _gone(self, kind, ids, deadline):
+        self._wait(kind, ids, lambda resource: resource is not None,
+                   deadline)
+        self.deleted[kind] = [i for i in ids if i not in set(
+            e['id'] for e in self.errors[kind])]
+
+    def _sweep_servers(self, deadline):
+        ids = self._delete_all('server', self.found['server'],
+                               lambda c, i: c.delete_server(i))
+        self._gone('server', ids, deadline)
+
+    def _sweep_images(self, deadline):
+        ids = self._delete_all('image', self.found['image'],
+                               lambda c, i: c.delete_image(i))
+        # Glance deletes at once
+        self.deleted['image'] = ids
+
+    def _sweep_volume_snapshots(self, deadline):
+        ids = self._delete_all('volume_snapshot',
+                               self.found['volume_snapshot'],
+                               lambda c, i: c.delete_snapshot(i))
+        self._gone('volume_snapshot', ids, deadline)
+
+    def _detach(self, deadline):
+        """Detach the volumes from the servers which are not swept"""
+        swept = set(s['id'] for s in self.found['server'])
+        attached = [(a['server_id'], v) for v in self.found['volume']
+                    for a in v.get('attachments', [])
+                    if a.get('server_id') and a['server_id'] not in swept]
+        graph = executor.TaskGraph('%s detach' % self.username,
+                                   max_workers=self.workers)
+        for server_id, volume in attached:
+            graph.add(volume['id'], lambda s=server_id, v=volume: self._call(
+                'volume', v, lambda c, i: c.detach_volume(s, i),
+                client=self.servers_client))
+        results = graph.run(raise_errors=False)
+        self._record('volume', graph)
+        self.detached = set(i for i, called in results.items() if called)
+
+    def _sweep_volumes(self, deadline):
+        # Freed by the server deletions and the detachments, the others
+        # stay attached
+        gone = set(self.deleted['server']) | self.detached
+        volumes = []
+        for volume in self.found['volume']:
+            servers = [a['server_id'] for a in volume.get('attachments', [])
+                       if a.get('server_id') and a['server_id'] not in gone]
+            if not servers or volume['id'] in self.detached:
+                volumes.append(volume)
+            elif volume['id'] in self.forbidden['volume']:
+                continue
+            elif set(servers) <= set(self.forbidden['server']):
+                # Left to the owner of the server
+                self.forbidden['volume'].append(volume['id'])
+            else:
+                self.errors['volume'].append({
+                    'id': volume['id'],
+                    'error': 'attached to %s' % ', '.join(servers)})
+        self._wait('volume', [v['id'] for v in volumes],
+                   lambda v: v is not None and v['status'] in BUSY, deadline)
+        ids = self._delete_all('volume', volumes,
+                               lambda c, i: c.delete_volume(i))
+        self._gone('volume', ids, deadline)
+
+    def _sweep_floating_ips(self, deadline):
+        self.deleted['floating_ip'] = self._delete_all(
+            'floating_ip', self.found['floating_ip'],
+            lambda c, i: c.delete_floating_ip(i))
+
+    def _sweep_security_groups(self, deadline):
+        self.deleted['security_group'] = self._delete_all(
+            'security_group', self.found['security_group'],
+            lambda c, i: c.delete_security_group(i))
+
+    def _sweep_keypairs(self, deadline):
+        self.deleted['keypair'] = self._delete_all(
+            'keypair', self.found['keypair'],
+            lambda c, i: c.delete_keypair(i))
+
+    def sweep(self, deadline):
+        """List, then delete the leftovers in dependency order"""
+        start = monotonic()
+        self.list()
+        if not self.dry_run:
+            graph = executor.TaskGraph('%s sweep' % self.username,
+                                       max_workers=len(KINDS) + 1)
+            graph.add('server', lambda: self._sweep_servers(deadline))
+            graph.add('image', lambda: self._sweep_images(deadline))
+            graph.add('volume_snapshot',
+                      lambda: self._sweep_volume_snapshots(deadline))
+            graph.add('keypair', lambda: self._sweep_keypairs(deadline))
+            graph.add('detach', lambda: self._detach(deadline))
+            graph.add('volume', lambda: self._sweep_volumes(deadline),
+                      requires=['server', 'detach', 'volume_snapshot'])
+            graph.add('floating_ip',
+                      lambda: self._sweep_floating_ips(deadline),
+                      requires=['server'])
+            graph.add('security_group',
+                      lambda: self._sweep_security_groups(deadline),
+                      requires=['server'])
+            graph.run(deadline=deadline, raise_errors=False)
+            for failure in graph.report():
+                kind = 'volume' if failure['task'] == 'detach' else (
+                    failure['task'])
+                self.errors[kind].append({
+                    'id': None, 'error': failure['error'] or failure['state']})
+        self.elapsed = monotonic() - start
+
+    def report(self):
+        return {'elapsed': round(self.elapsed or 0, 3),
+                'resources': collections.OrderedDict(
+                    (kind, {'found': [_summary(r) for r in resources],
+                            'deleted': self.deleted[kind],
+                            'forbidden': self.forbidden[kind],
+                            'errors': self.errors[kind]})
+                    for kind, resources in self.found.items())}
+
+
+def read_accounts(usernames=None):
+    """The accounts.yaml entries, all of them or those of usernames"""
+    accounts = preprov_creds.read_accounts_yaml(
+        pool.load_config().test_accounts_file)
+    if not usernames:
+        return accounts
+    found = [a for a in accounts if a['username'] in usernames]
+    missing = set(usernames) - set(a['username'] for a in found)
+    if missing:
+        raise ValueError("No account %s in %s" %
+                         (', '.join(sorted(missing)),
+                          CONF.auth.test_accounts_file))
+    return found
+
+
+def print_report(report):
+    for username, account in report['accounts'].items():
+        print('%s (%.1fs)' % (username, account['elapsed']))
+        for kind, resources in account['resources'].items():
+            if report['dry_run']:
+                for resource in resources['found']:
+                    print('  Would delete %s %s (%s)' % (
+                        kind, resource['id'], resource['name']))
+                continue
+            if not resources['found']:
+                continue
+            print('  %-16s %4d found %4d deleted %4d forbidden %4d errors' % (
+                kind, len(resources['found']), len(resources['deleted']),
+                len(resources['forbidden']), len(resources['errors'])))
+            for error in resources['errors']:
+                print('    %s : %s' % (error['id'], error['error']))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Delete the resources the tests left behind")
+    parser.add_argument('-p', '--prefix',
+                        help="Prefix of the names of the resources to "
+                             "delete (default : [DEFAULT]resources_prefix)")
+    parser.add_argument('-u', '--username', action='append',
+                        help="Account of accounts.yaml to sweep (repeat for "
+                             "more, default : all of them)")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="List the resources, do not delete them")
+    parser.add_argument('-w', '--workers', type=int,
+                        help="API calls at the same time (default : "
+                             "[fgcloud]max_workers)")
+    parser.add_argument('-t', '--timeout', type=int,
+                        help="Deadline of the deletions of each account, in "
+                             "seconds (default : [fgcloud]cleanup_timeout)")
+    parser.add_argument('--free-ips', action='store_true',
+                        help="Release the unassociated floating IPs too")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the report as JSON")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    pool.load_config()
+    prefix = args.prefix or CONF.resources_prefix
+    if not prefix:
+        # Everything would match
+        sys.stderr.write("No prefix, set [DEFAULT]resources_prefix or "
+                         "--prefix\n")
+        return 2
+    workers = args.workers or options.CONF.fgcloud.max_workers
+    timeout = args.timeout or options.CONF.fgcloud.cleanup_timeout
+    try:
+        accounts = read_accounts(args.username)
+    except ValueError as exc:
+        sys.stderr.write("%s\n" % exc)
+        return 2
+    auth_cache.install()
+
+    report = {'prefix': prefix, 'dry_run': args.dry_run,
+              'accounts': collections.OrderedDict()}
+    failed = False
+    # One account after the other : the tenant-wide lists of the next one
+    # no longer show what the previous one has deleted
+    for account in accounts:
+        sweeper = Sweeper(account, prefix, workers, dry_run=args.dry_run,
+                          free_ips=args.free_ips)
+        try:
+            sweeper.sweep(time.time() + timeout)
+        except Exception as exc:
+            LOG.exception("%s: sweep failed", sweeper.username)
+            sweeper.errors['server'].append({'id': None, 'error': str(exc)})
+        report['accounts'][sweeper.username] = sweeper.report()
+        failed = failed or any(sweeper.errors.values())
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Delete the tempest users, projects and networks (admin side)
+
+The users, projects, routers, subnets and networks whose name starts with
+--prefix (tempest, as named by tools/create_tempest_users.sh) are listed at
+once, along with the router interfaces of these routers, with a single
+admin session : the admin-creds variables (OS_USERNAME...) when they are
+set, the [auth]admin_* credentials of tempest.conf otherwise (Keystone is
+always the [identity]uri one).
+
+They are then deleted layer by layer, each layer as soon as the ones it
+depends on are over (see executor.py), the resources of a layer
+concurrently, at most --workers API calls at a time :
+
+    interface -> router
+              -> subnet -> network -> project
+    user
+
+A project is deleted once its routers and networks are, so that a failed
+teardown can be run again. The progress goes to stderr, nothing is written
+to disk, several teardowns can run at once.
+
+Run it from the tempest directory, with the TEMPEST_CONFIG variables of the
+site (see tools/clear_tempest.sh) :
+
+    python -m tempest.api.fgcloud.teardown --dry-run
+    python -m tempest.api.fgcloud.teardown --prefix tempest_ --json
+"""
+
+import argparse
+import collections
+import json
+import os
+import sys
+import threading
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2.7, oslo.utils depends on it
+    from monotonic import monotonic
+
+from oslo_log import log as logging
+
+from tempest.api.fgcloud import executor
+from tempest.api.fgcloud import options
+from tempest.api.fgcloud import pool
+from tempest import clients
+from tempest.common import credentials_factory
+from tempest import config
+from tempest.lib import exceptions as lib_exc
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+# Layers, in the order of the report, with the layers they wait for
+LAYERS = collections.OrderedDict([
+    ('interface', []),
+    ('router', ['interface']),
+    ('subnet', ['interface']),
+    ('network', ['subnet']),
+    ('user', []),
+    ('project', ['router', 'network']),
+])
+# admin-creds variables
+ENVIRON = {'OS_USERNAME': 'username', 'OS_PASSWORD': 'password',
+           'OS_TENANT_NAME': 'tenant_name', 'OS_PROJECT_NAME': 'project_name',
+           'OS_USER_DOMAIN_NAME': 'user_domain_name',
+           'OS_PROJECT_DOMAIN_NAME': 'project_domain_name'}
+
+
+def admin_credentials():
+    """Credentials of admin-creds if sourced, of tempest.conf otherwise"""
+    if os.environ.get('OS_USERNAME'):
+        return credentials_factory.get_credentials(
+            fill_in=False, **dict((name, os.environ[variable])
+                                  for variable, name in ENVIRON.items()
+                                  if os.environ.get(variable)))
+    return credentials_factory.get_configured_credentials(
+        'identity_admin', fill_in=False)
+
+
+class Teardown(object):
+    """Users, projects and networks of the tempest accounts"""
+
+    def __init__(self, credentials, prefix, workers, dry_run=False):
+        self.prefix = prefix
+        self.workers = workers
+        self.dry_run = dry_run
+        self.slots = threading.BoundedSemaphore(workers)
+        self._output = threading.Lock()
+        manager = clients.Manager(credentials=credentials)
+        self.auth_provider = manager.auth_provider
+        self.routers_client = manager.routers_client
+        self.subnets_client = manager.subnets_client
+        self.networks_client = manager.networks_client
+        self.ports_client = manager.ports_client
+        if CONF.identity.auth_version == 'v3':
+            self.users_client = manager.users_v3_client
+            self.projects_client = manager.projects_client
+        else:
+            self.users_client = manager.users_client
+            self.projects_client = manager.tenants_client
+        self.found = collections.OrderedDict((layer, []) for layer in LAYERS)
+        self.deleted = dict((layer, []) for layer in LAYERS)
+        self.errors = dict((layer, []) for layer in LAYERS)
+        self.elapsed = None
+
+    def _match(self, resource):
+        return (resource.get('name') or '').startswith(self.prefix)
+
+    # Listing, once per type
+
+    def _list_users(self):
+        return self.users_client.list_users()['users']
+
+    def _list_projects(self):
+        if CONF.identity.auth_version == 'v3':
+            return self.projects_client.list_projects()['projects']
+        return self.projects_client.list_tenants()['tenants']
+
+    def _list_routers(self):
+        return self.routers_client.list_routers()['routers']
+
+    def _list_subnets(self):
+        return self.subnets_client.list_subnets()['subnets']
+
+    def _list_networks(self):
+        return self.networks_client.list_networks()['networks']
+
+    def _list_interfaces(self):
+        return self.ports_client.list_ports(
+            device_owner='network:router_interface')['ports']
+
+    def list(self):
+        """Build the whole graph, all the types being listed at once"""
+        # Authenticate before the concurrent calls, they would all do it
+        self.auth_provider.get_token()
+        graph = executor.TaskGraph('teardown list', max_workers=len(LAYERS))
+        for layer in LAYERS:
+            graph.add(layer, getattr(self, '_list_%ss' % layer))
+        listed = graph.run()
+        for layer in LAYERS:
+            if layer != 'interface':
+                self.found[layer] = [r for r in listed[layer]
+                                     if self._match(r)]
+        routers = set(r['id'] for r in self.found['router'])
+        self.found['interface'] = [p for p in listed['interface']
+                                   if p['device_id'] in routers]
+        return self.found
+
+    # Deletion
+
+    def _progress(self, layer, done, total):
+        with self._output:
+            sys.stderr.write('%-9s %4d / %d\n' % (layer, done, total))
+            sys.stderr.flush()
+
+    def _delete(self, client, layer, resource):
+        with self.slots:
+            try:
+                if layer == 'interface':
+                    client.remove_router_interface(resource['device_id'],
+                                                   port_id=resource['id'])
+                elif layer == 'project' and hasattr(client, 'delete_tenant'):
+                    client.delete_tenant(resource['id'])
+                else:
+                    getattr(client, 'delete_%s' % layer)(resource['id'])
+            except lib_exc.NotFound:
+                pass
+            with self._output:
+                self.deleted[layer].append(resource['id'])
+                done = len(self.deleted[layer])
+        self._progress(layer, done, len(self.found[layer]))
+
+    def _client(self, layer):
+        return {'interface': self.routers_client,
+                'router': self.routers_client,
+                'subnet': self.subnets_client,
+                'network': self.networks_client,
+                'user': self.users_client,
+                'project': self.projects_client}[layer]
+
+    def _delete_layer(self, layer):
+        """Delete the resources of a layer concurrently"""
+        graph = executor.TaskGraph('teardown %s' % layer,
+                                   max_workers=self.workers)
+        for resource in self.found[layer]:
+            # Each deletion has a client of its own
+            graph.add(resource['id'], lambda r=resource: self._delete(
+                executor.clone(self._client(layer)), layer, r))
+        graph.run(raise_errors=False)
+        for failure in graph.report():
+            self.errors[layer].append({
+                'id': failure['task'],
+                'error': failure['error'] or failure['state']})
+        if self.errors[layer]:
+            # The layers depending on it are skipped
+            raise RuntimeError('%d %s(s) not deleted' % (
+                len(self.errors[layer]), layer))
+
+    def teardown(self):
+        """List, then delete layer by layer"""
+        start = monotonic()
+        self.list()
+        if not self.dry_run:
+            graph = executor.TaskGraph('teardown', max_workers=len(LAYERS))
+            for layer, requires in LAYERS.items():
+                graph.add(layer, lambda name=layer: self._delete_layer(name),
+                          requires=requires)
+            graph.run(raise_errors=False)
+            for failure in graph.report():
+                if failure['state'] == 'skipped':
+                    self.errors[failure['task']].append({
+                        'id': None, 'error': 'skipped, a layer it depends '
+                                             'on failed'})
+        self.elapsed = monotonic() - start
+
+    def report(self):
+        return {'prefix': self.prefix,
+                'dry_run': self.dry_run,
+                'elapsed': round(self.elapsed or 0, 3),
+                'layers': collections.OrderedDict(
+                    (layer, {'found': [{'id': r['id'],
+                                        'name': r.get('name') or ''}
+                                       for r in resources],
+                             'deleted': self.deleted[layer],
+                             'errors': self.errors[layer]})
+                    for layer, resources in self.found.items())}
+
+
+def print_report(report):
+    print('prefix %s (%.1fs)' % (report['prefix'], report['elapsed']))
+    for layer, resources in report['layers'].items():
+        if report['dry_run']:
+            for resource in resources['found']:
+                print('  Would delete %s %s (%s)' % (
+                    layer, resource['id'], resource['name']))
+            continue
+        if not resources['found'] and not resources['errors']:
+            continue
+        print('  %-9s %4d found %4d deleted %4d errors' % (
+            layer, len(resources['found']), len(resources['deleted']),
+            len(resources['errors'])))
+        for error in resources['errors']:
+            print('    %s : %s' % (error['id'], error['error']))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Delete the tempest users, projects and networks")
+    parser.add_argument('-p', '--prefix', default='tempest',
+                        help="Prefix of the names of the resources to "
+                             "delete")
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help="List the resources, do not delete them")
+    parser.add_argument('-w', '--workers', type=int,
+                        help="API calls at the same time (default : "
+                             "[fgcloud]max_workers)")
+    parser.add_argument('--json', action='store_true',
+                        help="Print the report as JSON")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    pool.load_config()
+    if not args.prefix:
+        # Everything would match
+        sys.stderr.write("An empty prefix would match everything\n")
+        return 2
+    teardown = Teardown(admin_credentials(), args.prefix,
+                        args.workers or options.CONF.fgcloud.max_workers,
+                        dry_run=args.dry_run)
+    teardown.teardown()
+    report = teardown.report()
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 1 if any(teardown.errors.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
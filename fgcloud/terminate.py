@@ -0,0 +1,41 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Cleanup of the fgcloud tests stopped by SIGTERM
+
+monitoring/check_sites.py and monitoring/scheduler.py stop an overdue check
+with SIGTERM, then with SIGKILL after a grace period. Python dies at once on
+SIGTERM : once install() is called, the test gets Terminated instead, so it
+fails and its cleanups and resource_cleanup delete what it has created. The
+stream filter ignores SIGTERM, it keeps reading the results meanwhile.
+"""
+
+import signal
+
+
+class Terminated(Exception):
+    pass
+
+
+def _terminate(signum, frame):
+    raise Terminated("Check stopped by signal %d" % signum)
+
+
+def install():
+    try:
+        signal.signal(signal.SIGTERM, _terminate)
+    except ValueError:
+        # Handlers are set by the main thread only
+        pass
@@ -0,0 +1,162 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2.7, oslo.utils depends on it
+    from monotonic import monotonic
+
+from oslo_log import log as logging
+from tempest.api.fgcloud import auth_cache
+from tempest.api.fgcloud import executor
+from tempest.api.fgcloud import options
+from tempest.api.fgcloud import perfdata
+from tempest.api.fgcloud import terminate
+from tempest import config
+from tempest.scenario import manager
+from tempest import test
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+# label, service ([service_available]), client, call
+Endpoint = collections.namedtuple('Endpoint',
+                                  ['label', 'service', 'client', 'call'])
+
+ENDPOINTS = [
+    Endpoint('token', None, None, None),
+    Endpoint('servers', 'nova', 'servers_client',
+             lambda c: c.list_servers()),
+    Endpoint('flavors', 'nova', 'flavors_client',
+             lambda c: c.list_flavors()),
+    Endpoint('images', 'glance', 'image_client',
+             lambda c: c.list_images()),
+    Endpoint('volumes', 'cinder', 'volumes_client',
+             lambda c: c.list_volumes()),
+    Endpoint('networks', 'neutron', 'networks_client',
+             lambda c: c.list_networks()),
+    Endpoint('floating_ips', 'nova', 'compute_floating_ips_client',
+             lambda c: c.list_floating_ips()),
+]
+PERCENTILES = (50, 95, 99)
+
+
+class TestApiHealth(manager.ScenarioTest):
+
+    """This is a fast health test of the APIs.
+
+    This test works:
+    * as a regular user
+    * with read-only calls, nothing is created
+
+    Steps:
+    1. Get a new token from Keystone
+    2. List the servers, flavors, images, volumes, networks and floating
+       IPs of the services the basic scenario depends on
+
+    Each call is made [fgcloud]health_repeat times, at most
+    [fgcloud]health_concurrency at a time, each with a connection of its own.
+    The p50, p95 and p99 of the latency of each endpoint and its rate of
+    errors are exported as perfdata series (<endpoint>_p50..., in seconds,
+    <endpoint>_errors, in %, see fgcloud/perfdata.py). The test fails when
+    every call of an endpoint fails : set thresholds on the _errors series
+    to be warned of the intermittent ones.
+
+    It takes a few seconds, so that it can run every minute while the basic
+    scenario runs on a slower schedule.
+
+    """
+
+    @classmethod
+    def setup_credentials(cls):
+        auth_cache.install()
+        # Delete the resources when the check is stopped (see terminate.py)
+        terminate.install()
+        super(TestApiHealth, cls).setup_credentials()
+
+    def issue_token(self):
+        # Not the token of the clients, which may come from the cache
+        provider = self.manager.auth_provider
+        token_client = executor.clone(provider.auth_client)
+        return token_client.get_token(**provider._auth_params())
+
+    def _call(self, endpoint):
+        if endpoint.call is None:
+            return self.issue_token()
+        return endpoint.call(executor.clone(getattr(self, endpoint.client)))
+
+    def _timed(self, endpoint):
+        start = monotonic()
+        self._call(endpoint)
+        return monotonic() - start
+
+    def measure(self, endpoints, repeat, concurrency):
+        """{label: (latencies of the calls which succeeded, errors)}"""
+        # Authenticate before the concurrent calls, they would all do it
+        # and their first latencies would include it
+        self.manager.auth_provider.get_token()
+        graph = executor.TaskGraph('api health', max_workers=concurrency)
+        # Round robin, so that the endpoints share the concurrency
+        for index in range(repeat):
+            for endpoint in endpoints:
+                graph.add('%s %d' % (endpoint.label, index),
+                          lambda e=endpoint: self._timed(e))
+        results = graph.run(raise_errors=False)
+        errors = collections.defaultdict(list)
+        for failure in graph.report():
+            errors[failure['task'].split()[0]].append(failure['error'])
+        measures = collections.OrderedDict()
+        for endpoint in endpoints:
+            latencies = sorted(
+                results['%s %d' % (endpoint.label, index)]
+                for index in range(repeat)
+                if graph.tasks['%s %d' % (endpoint.label,
+                                          index)].state == 'done')
+            measures[endpoint.label] = (latencies, errors[endpoint.label])
+        return measures
+
+    @test.idempotent_id('59799c40-5806-4f8c-af15-3db6bd768203')
+    def test_api_health(self):
+        perf = perfdata.PerfData()
+        self.addCleanup(perf.attach, self)
+        # The clients authenticate on their first call, read at the end
+        self.addCleanup(lambda: perf.add('auth_time', auth_cache.auth_time()))
+
+        endpoints = [e for e in ENDPOINTS if e.service is None or
+                     getattr(CONF.service_available, e.service)]
+        repeat = options.CONF.fgcloud.health_repeat
+        measures = self.measure(endpoints, repeat,
+                                options.CONF.fgcloud.health_concurrency)
+
+        down = []
+        for label, (latencies, errors) in measures.items():
+            for rank in PERCENTILES:
+                if latencies:
+                    perf.add('%s_p%d' % (label, rank),
+                             round(perfdata.percentile(latencies, rank), 3))
+            perf.add('%s_errors' % label,
+                     round(100.0 * len(errors) / repeat, 1), unit='%')
+            for error in sorted(set(errors)):
+                LOG.warning('%s : %s', label, error)
+            if not latencies:
+                down.append('%s (%s)' % (label, errors[0]))
+            else:
+                LOG.info('%s : p50 %.3fs, %d error(s) out of %d calls',
+                         label, perfdata.percentile(latencies, 50),
+                         len(errors), repeat)
+        self.assertEqual([], down, 'Every call failed')
@@ -12,9 +12,19 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+
+import time
+
 from oslo_log import log as logging
+from tempest.api.fgcloud import auth_cache
+from tempest.api.fgcloud import io_probe
+from tempest.api.fgcloud import net_probe
+from tempest.api.fgcloud import options
+from tempest.api.fgcloud import perfdata
+from tempest.api.fgcloud import polling
+from tempest.api.fgcloud import pool
+from tempest.api.fgcloud import terminate
 from tempest.common import custom_matchers
-from tempest.common import waiters
 from tempest.common.utils import data_utils
 from tempest import config
 from tempest import exceptions
@@ -48,13 +58,46 @@ class TestBasicScenario(manager.ScenarioTest):
     11. Check SSH connection to instance after reboot
     12. Read/Compare the timestamp onto the attached volume
 
+    Each step is timed and exported as a perfdata series (boot_time,
+    volume_create_time, attach_time, fip_time, secgroup_time, ssh_ready_time,
+    reboot_time, timestamp_rw_time), see fgcloud/perfdata.py, as well as
+    the time spent getting a token (auth_time, see fgcloud/auth_cache.py).
+    The status waits poll adaptively, their number of polls and the latency
+    they added are exported per resource type (server_polls,
+    server_poll_latency, volume_polls..., see fgcloud/polling.py).
+
+    With [fgcloud]pool_enabled, steps 2 to 4 are replaced by the lease of a
+    warm server, volume and floating IP (see fgcloud/pool.py) : boot_time and
+    volume_create_time are then replaced by the lease_time of the slot and
+    the latencies measured by the pool when it was built (pool_boot_time,
+    pool_volume_create_time, pool_fip_time, without thresholds) and the age
+    of these measures (pool_slot_age), fip_time only times the association.
+
+    With [fgcloud]io_probe, a bounded I/O workload runs on the attached
+    volume and on the ephemeral disk after step 9 and again after step 12,
+    their throughput, IOPS and latency being exported as volume_* and
+    ephemeral_* series (volume_*_after_reboot..., see fgcloud/io_probe.py).
+
+    With [fgcloud]net_probe, a second server boots on the same network
+    along with the first one. At the end, a burst of pings measures the
+    round trip times to the floating IP (fip_*), then the first server pings
+    the second one and sends it data over TCP, on its fixed IP (vm_fixed_*)
+    and on a floating IP (vm_floating_*, see fgcloud/net_probe.py).
+
     """
 
+    @classmethod
+    def setup_credentials(cls):
+        auth_cache.install()
+        # Delete the resources when the check is stopped (see terminate.py)
+        terminate.install()
+        super(TestBasicScenario, cls).setup_credentials()
+
     def _wait_for_server_status(self, server, status):
         server_id = server['id']
         # Raise on error defaults to True, which is consistent with the
         # original function from scenario tests here
-        waiters.wait_for_server_status(self.servers_client,
+        polling.wait_for_server_status(self.servers_client,
                                        server_id, status)
 
     def nova_list(self):
@@ -73,7 +116,17 @@ class TestBasicScenario(manager.ScenarioTest):
                 got_server, excluded_keys=excluded_keys))
 
     def cinder_create(self):
-        return self.create_volume()
+        # manager.create_volume, waiting with polling
+        name = data_utils.rand_name(self.__class__.__name__)
+        volume = self.volumes_client.create_volume(
+            display_name=name)['volume']
+        self.addCleanup(polling.wait_for_resource_deletion,
+                        self.volumes_client, 'volume', volume['id'])
+        self.addCleanup(self.delete_wrapper,
+                        self.volumes_client.delete_volume, volume['id'])
+        polling.wait_for_volume_status(self.volumes_client,
+                                       volume['id'], 'available')
+        return self.volumes_client.show_volume(volume['id'])['volume']
 
     def cinder_list(self):
         return self.volumes_client.list_volumes()['volumes']
@@ -82,6 +135,20 @@ class TestBasicScenario(manager.ScenarioTest):
         got_volume = self.volumes_client.show_volume(volume['id'])['volume']
         self.assertEqual(volume, got_volume)
 
+    def nova_volume_attach(self, server, volume_to_attach):
+        volume = self.servers_client.attach_volume(
+            server['id'], volumeId=volume_to_attach['id'], device='/dev/%s'
+            % CONF.compute.volume_device_name)['volumeAttachment']
+        self.assertEqual(volume_to_attach['id'], volume['id'])
+        polling.wait_for_volume_status(self.volumes_client,
+                                       volume['id'], 'in-use')
+        return self.volumes_client.show_volume(volume['id'])['volume']
+
+    def nova_volume_detach(self, server, volume):
+        self.servers_client.detach_volume(server['id'], volume['id'])
+        polling.wait_for_volume_status(self.volumes_client,
+                                       volume['id'], 'available')
+
     def nova_reboot(self, server):
         self.servers_client.reboot_server(server['id'], type='SOFT')
         self._wait_for_server_status(server, 'ACTIVE')
@@ -91,6 +158,61 @@ class TestBasicScenario(manager.ScenarioTest):
         partitions = self.linux_client.get_partitions()
         self.assertEqual(1, partitions.count(CONF.compute.volume_device_name))
 
+    def probe_disks(self, perf, dev_name, suffix=''):
+        """I/O probe of the attached volume, then of the ephemeral disk"""
+        LOG.info('Probing the I/O of /dev/%s...', dev_name)
+        self.linux_client.mount(dev_name)
+        try:
+            metrics = io_probe.run(self.linux_client, '/mnt')
+        finally:
+            self.linux_client.umount()
+        io_probe.add_perfdata(perf, 'volume', metrics, suffix)
+        directory = options.CONF.fgcloud.io_probe_ephemeral_dir
+        LOG.info('Probing the I/O of %s...', directory)
+        metrics = io_probe.run(self.linux_client, directory)
+        io_probe.add_perfdata(perf, 'ephemeral', metrics, suffix)
+
+    def boot_peer(self, image, keypair):
+        """Boot the second server of the network probe, without waiting
+
+        Its security group lets the throughput measures in.
+        """
+        port = options.CONF.fgcloud.net_probe_port
+        secgroup = self._create_security_group()
+        self.compute_security_group_rules_client.create_security_group_rule(
+            parent_group_id=secgroup['id'], ip_protocol='tcp',
+            from_port=port, to_port=port, cidr='0.0.0.0/0')
+        name = data_utils.rand_name('TestBasicScenario-peer')
+        flavor = (options.CONF.fgcloud.net_probe_flavor or
+                  CONF.compute.flavor_ref)
+        return self.create_server(name=name, image_id=image, flavor=flavor,
+                                  key_name=keypair['name'],
+                                  security_groups=[{'name': secgroup['name']}])
+
+    def probe_network(self, perf, peer, floating_ip, keypair):
+        """Round trip times to the floating IP, then to and from the peer"""
+        LOG.info('Probing the network of %s...', floating_ip['ip'])
+        net_probe.add_perfdata(perf, 'fip', net_probe.ping(floating_ip['ip']))
+        self._wait_for_server_status(peer, 'ACTIVE')
+        peer = self.servers_client.show_server(peer['id'])['server']
+        fixed_ip = [address['addr']
+                    for addresses in peer['addresses'].values()
+                    for address in addresses
+                    if address.get('OS-EXT-IPS:type', 'fixed') == 'fixed' and
+                    address['version'] == 4][0]
+        peer_floating_ip = self.create_floating_ip(
+            peer, pool_name=CONF.network.floating_network_name)
+        peer_client = self.get_remote_client(
+            peer_floating_ip['ip'], private_key=keypair['private_key'])
+        for path, ip_address in (('vm_fixed', fixed_ip),
+                                 ('vm_floating', peer_floating_ip['ip'])):
+            LOG.info('Probing the network from %s to %s...',
+                     floating_ip['ip'], ip_address)
+            metrics = net_probe.remote_ping(self.linux_client, ip_address)
+            metrics.update(net_probe.throughput(
+                self.linux_client, peer_client, ip_address))
+            net_probe.add_perfdata(perf, path, metrics)
+
     def create_and_add_security_group_to_server(self, server):
         secgroup = self._create_security_group()
         self.servers_client.add_security_group(server['id'],
@@ -103,17 +225,50 @@ class TestBasicScenario(manager.ScenarioTest):
                     ['server'])
             return {'name': secgroup['name']} in body['security_groups']
 
-        if not test.call_until_true(wait_for_secgroup_add,
-                                    CONF.compute.build_timeout,
-                                    CONF.compute.build_interval):
+        if not polling.call_until_true('secgroup', wait_for_secgroup_add,
+                                       CONF.compute.build_timeout):
             msg = ('Timed out waiting for adding security group %s to server '
                    '%s' % (secgroup['id'], server['id']))
             raise exceptions.TimeoutException(msg)
         return secgroup['name']
 
+    def lease_from_pool(self, perf):
+        username = self.manager.credentials.username
+        with perf.timer('lease_time'):
+            slot = pool.lease(username)
+        if slot is None:
+            LOG.warning('No warm slot, falling back to a cold boot')
+            return None
+        LOG.info('Slot leased from the warm pool : %s', slot['id'])
+        # Released last, once the volume, IP and security group are removed
+        slot['healthy'] = False
+        self.addCleanup(lambda: pool.release(slot['id'], slot['healthy']))
+        # Measured when the slot was built, up to pool_max_age ago
+        age = max(0, time.time() - slot['created'])
+        perf.add('pool_slot_age', age)
+        for label, value in sorted(slot['timings'].items()):
+            perf.add(label, value, age=age)
+        return slot
+
+    def associate_floating_ip(self, server, floating_ip):
+        client = self.compute_floating_ips_client
+        client.associate_floating_ip_to_server(floating_ip['ip'],
+                                               server['id'])
+        self.addCleanup(self.delete_wrapper,
+                        client.disassociate_floating_ip_from_server,
+                        floating_ip['ip'], server['id'])
+        return floating_ip
+
     @test.idempotent_id('53f75314-eed0-4db6-8f43-b21883d3941f')
     @test.services('compute', 'volume', 'image', 'network')
     def test_basic_scenario(self):
+        perf = perfdata.PerfData()
+        self.addCleanup(perf.attach, self)
+        # Added last, with the waits of the other cleanups
+        polling.reset()
+        self.addCleanup(polling.add_perfdata, perf)
+        # The clients authenticate on their first call, read at the end
+        self.addCleanup(lambda: perf.add('auth_time', auth_cache.auth_time()))
 
         # Create an image from local files (see conf.scenario.*_img_file)
         # image = self.glance_image_create()
@@ -122,25 +277,45 @@ class TestBasicScenario(manager.ScenarioTest):
         image = CONF.compute.image_ref
         LOG.info('Use existing image ref : %s' % image)
 
-        # Create keypair for auth
-        LOG.info('Creating keypair...')
-        keypair = self.create_keypair()
-        LOG.info('Keypair created : %s (%s)', keypair['name'],
-                 keypair['fingerprint'])
-
-        # Create and boot server
-        LOG.info('Creating server...')
-        name = data_utils.rand_name("TestBasicScenario")
-        server = self.create_server(name=name, image_id=image,
-                                    key_name=keypair['name'],
-                                    wait_until='ACTIVE')
+        slot = None
+        if options.CONF.fgcloud.pool_enabled:
+            slot = self.lease_from_pool(perf)
+
+        if slot is None:
+            # Create keypair for auth
+            LOG.info('Creating keypair...')
+            keypair = self.create_keypair()
+            LOG.info('Keypair created : %s (%s)', keypair['name'],
+                     keypair['fingerprint'])
+
+            # Create and boot server
+            LOG.info('Creating server...')
+            name = data_utils.rand_name("TestBasicScenario")
+            with perf.timer('boot_time'):
+                server = self.create_server(name=name, image_id=image,
+                                            key_name=keypair['name'])
+                self._wait_for_server_status(server, 'ACTIVE')
+            server = self.servers_client.show_server(
+                server['id'])['server']
+        else:
+            keypair = slot['keypair']
+            server = slot['server']
+            self._wait_for_server_status(server, 'ACTIVE')
+        peer = None
+        if options.CONF.fgcloud.net_probe:
+            # Boots while the scenario goes on
+            peer = self.boot_peer(image, keypair)
         servers = self.nova_list()
         self.assertIn(server['id'], [x['id'] for x in servers])
         LOG.info('Server created : %s', server['name'])
 
         # Create a new volume
-        LOG.info('Creating volume...')
-        volume = self.cinder_create()
+        if slot is None:
+            LOG.info('Creating volume...')
+            with perf.timer('volume_create_time'):
+                volume = self.cinder_create()
+        else:
+            volume = slot['volume']
         volumes = self.cinder_list()
         self.assertIn(volume['id'], [x['id'] for x in volumes])
         if 'display_name' in volume:
@@ -151,47 +326,68 @@ class TestBasicScenario(manager.ScenarioTest):
 
         # Attach volume to server
         LOG.info('Attaching volume to instance...')
-        volume = self.nova_volume_attach(server, volume)
+        with perf.timer('attach_time'):
+            volume = self.nova_volume_attach(server, volume)
         self.addCleanup(self.nova_volume_detach, server, volume)
 
         # Create and associate a floating_ip to the server
         # We need to specify the pool_name as we may have multiple networks
         LOG.info('Creating Floating IP...')
         fip_net = CONF.network.floating_network_name
-        floating_ip = self.create_floating_ip(server, pool_name=fip_net)
+        with perf.timer('fip_time'):
+            if slot is None:
+                floating_ip = self.create_floating_ip(server,
+                                                      pool_name=fip_net)
+            else:
+                floating_ip = self.associate_floating_ip(
+                    server, slot['floating_ip'])
         LOG.info('Floating IP created : %s (%s)', floating_ip['id'],
                  floating_ip['ip'])
 
         LOG.info('Creating Security Group...')
-        sec_grp_name = self.create_and_add_security_group_to_server(server)
+        with perf.timer('secgroup_time'):
+            sec_grp_name = self.create_and_add_security_group_to_server(server)
         LOG.info('Security Group created : %s' % sec_grp_name)
 
         # check that we can PING and SSH to the server
         LOG.info('Checking connectivity...')
-        ping_result = self.ping_ip_address(ip_address=floating_ip['ip'])
-        self.linux_client = self.get_remote_client(
-            floating_ip['ip'], private_key=keypair['private_key'])
+        with perf.timer('ssh_ready_time'):
+            ping_result = self.ping_ip_address(ip_address=floating_ip['ip'])
+            self.linux_client = self.get_remote_client(
+                floating_ip['ip'], private_key=keypair['private_key'])
         LOG.info('Ping to Floating IP : %s' % ping_result)
 
         # Create a timestamp on the volume
         vdev_name = CONF.compute.volume_device_name
-        timestamp = self.create_timestamp(floating_ip['ip'],
-                                          dev_name=vdev_name,
-                                          private_key=keypair['private_key'])
+        with perf.timer('timestamp_rw_time'):
+            timestamp = self.create_timestamp(
+                floating_ip['ip'], dev_name=vdev_name,
+                private_key=keypair['private_key'])
         LOG.info('Timestamp created on /dev/%s', vdev_name)
+        if options.CONF.fgcloud.io_probe:
+            self.probe_disks(perf, vdev_name)
 
         # Reboot server
         LOG.info('Server Rebooting...')
-        self.nova_reboot(server)
+        # The server is only back when we can SSH to it again
+        with perf.timer('reboot_time'):
+            self.nova_reboot(server)
 
-        # check that we can SSH to the server after reboot
-        self.linux_client = self.get_remote_client(
-            floating_ip['ip'], private_key=keypair['private_key'])
+            # check that we can SSH to the server after reboot
+            self.linux_client = self.get_remote_client(
+                floating_ip['ip'], private_key=keypair['private_key'])
 
         # Check timestamp on volume after reboot
         LOG.info('Checking timestamp...')
-        timestamp2 = self.get_timestamp(floating_ip['ip'],
-                                        dev_name=vdev_name,
-                                        private_key=keypair['private_key'])
+        with perf.timer('timestamp_rw_time'):
+            timestamp2 = self.get_timestamp(
+                floating_ip['ip'], dev_name=vdev_name,
+                private_key=keypair['private_key'])
         self.assertEqual(timestamp, timestamp2)
+        if options.CONF.fgcloud.io_probe:
+            self.probe_disks(perf, vdev_name, suffix='_after_reboot')
+        if peer is not None:
+            self.probe_network(perf, peer, floating_ip, keypair)
+        if slot is not None:
+            slot['healthy'] = True
         LOG.info('End of tests, cleaning...')
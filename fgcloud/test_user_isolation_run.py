@@ -13,12 +13,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import json
-import os.path
-import testtools
-import time
 from oslo_log import log as logging
 from tempest.api.compute import base
+from tempest.api.fgcloud import auth_cache
+from tempest.api.fgcloud import handoff
+from tempest.api.fgcloud.isolation import Case
+from tempest.api.fgcloud.isolation import call
+from tempest.api.fgcloud import isolation
+from tempest.api.fgcloud import perfdata
+from tempest.api.fgcloud import polling
+from tempest.api.fgcloud import terminate
 from tempest import config
 from tempest.common.utils import data_utils
 from tempest.lib import exceptions as lib_exc
@@ -26,10 +30,301 @@ from tempest import test
 
 CONF = config.CONF
 LOG = logging.getLogger(__name__)
-file_path = "/tmp/tempest_" + CONF.compute.image_ref
+
+
+FORBIDDEN = (lib_exc.Forbidden,)
+DENIED = (lib_exc.Forbidden, lib_exc.NotFound)
+SERVER_SNAPSHOT = dict(feature=('compute_feature_enabled', 'snapshot'),
+                       skip_msg='Instance/image snapshotting is not available.')
+VOLUME_SNAPSHOT = dict(feature=('volume_feature_enabled', 'snapshot'),
+                       skip_msg='Volume snapshotting is not available.')
+
+CASES = [
+# General
+    Case('get_keypair_of_alt_account_fails',
+         'ebb37040-ea80-4d73-811f-7cb9a4846a7e',
+         'keypairs_client', 'show_keypair',
+         lambda c: call(c.keypairname),
+         accepted=(lib_exc.NotFound,)),
+    Case('delete_keypair_of_alt_account_fails',
+         '35c4d575-423d-4b8c-ab2a-3447b9677422',
+         'keypairs_client', 'delete_keypair',
+         lambda c: call(c.keypairname),
+         accepted=(lib_exc.NotFound,), destructive=True),
+    Case('get_security_group_of_alt_account',
+         '137f2014-79a7-4dcf-8e1c-710893b12d1f',
+         'security_client', 'show_security_group',
+         lambda c: call(c.security_group['id'])),
+
+# Server
+    Case('get_server_of_alt_account',
+         '1fb19bb3-d40b-49e3-b6f8-04e8ca354067',
+         'client', 'show_server',
+         lambda c: call(c.server['id'])),
+    Case('update_server_of_alt_account_fails',
+         '1e66dee1-1498-4ebb-9304-b952bf4e3ee3',
+         'client', 'update_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN),
+    Case('delete_server_of_alt_account_fails',
+         '5c968a59-aeae-4211-b227-adcc9ecd622c',
+         'client', 'delete_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('get_server_metadata_of_alt_account_fails',
+         '36c0b45f-cac3-4aa3-95aa-6722d697de9b',
+         'client', 'list_server_metadata',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN),
+    Case('update_server_metadata_of_alt_account_server_fails',
+         'c5011b7a-8e11-4f05-86fe-8e1b8b0ab5b1',
+         'client', 'set_server_metadata',
+         lambda c: call(c.server['id'],
+                        {'tempest_meta_key': 'tempest-server-data1'}),
+         accepted=FORBIDDEN),
+    Case('delete_server_metadata_of_alt_account_fails',
+         'bc8dd9e7-86a4-4bbf-858b-6eb03c9f5655',
+         'client', 'delete_server_metadata_item',
+         lambda c: call(c.server['id'], 'meta1'),
+         accepted=FORBIDDEN),
+    Case('get_server_password_of_alt_account_fails',
+         'caa72f38-63e4-41ce-bfd8-b134d22e919e',
+         'client', 'show_password',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN),
+    Case('update_server_password_of_alt_account_fails',
+         '6a990add-e4cc-4c99-99f7-b06c5ab88b5f',
+         'client', 'change_password',
+         lambda c: call(c.server['id'], adminPass='newpass'),
+         accepted=FORBIDDEN),
+    Case('get_console_output_of_alt_account_server_fails',
+         '0d0f26c4-f69a-4e71-abe8-a342c6975f14',
+         'client', 'get_console_output',
+         lambda c: call(c.server['id'], length=10),
+         accepted=FORBIDDEN),
+    Case('get_vnc_console_of_alt_account_server_fails',
+         '7aafc3bd-e664-4f69-b122-6a6e3e551188',
+         'client', 'get_vnc_console',
+         lambda c: call(c.server['id'], type='novnc'),
+         accepted=FORBIDDEN),
+    Case('rebuild_server_of_alt_account_fails',
+         '3080119d-6fa1-489d-9621-f983aff725ed',
+         'client', 'rebuild_server',
+         lambda c: call(c.server['id'], c.image_ref_alt),
+         accepted=FORBIDDEN, destructive=True),
+    Case('resize_server_of_alt_account_fails',
+         '827625bb-048d-4cf3-b489-2b36594fb5f8',
+         'client', 'resize_server',
+         lambda c: call(c.server['id'], c.flavor_ref_alt),
+         accepted=FORBIDDEN, destructive=True),
+    Case('reboot_server_of_alt_account_fails',
+         '9df2b0f5-ea2b-41ff-8401-0d1a00dc864a',
+         'client', 'reboot_server',
+         lambda c: call(c.server['id'], type='HARD'),
+         accepted=FORBIDDEN, destructive=True),
+    Case('start_server_of_alt_account_fails',
+         '65e47d5a-8bd4-406b-8d19-52c3eba6f65a',
+         'client', 'start_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('stop_server_of_alt_account_fails',
+         '56e11972-faac-4487-9420-031ee379319c',
+         'client', 'stop_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('lock_server_of_alt_account_fails',
+         '7e921ec4-ecec-4a1b-b673-da2f9dc009cc',
+         'client', 'lock_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('unlock_server_of_alt_account_fails',
+         '68cfdda6-0475-4734-909d-b2fe21987347',
+         'client', 'unlock_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('pause_server_of_alt_account_fails',
+         '41b5975f-e140-4cc9-83af-a83b8b6cf278',
+         'client', 'pause_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('unpause_server_of_alt_account_fails',
+         '0a1c4f53-fa8a-4ae9-b5ab-e55e539024d1',
+         'client', 'unpause_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('suspend_server_of_alt_account_fails',
+         '5af863a1-f10c-4a3a-a3de-2bf3506247f5',
+         'client', 'suspend_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('resume_server_of_alt_account_fails',
+         '4b93e4b9-b33f-4ff1-8cd0-5f1efe20624b',
+         'client', 'resume_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('shelve_server_of_alt_account_fails',
+         '1aea9960-897f-4273-ae69-bbd9bc45c359',
+         'client', 'shelve_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('unshelve_server_of_alt_account_fails',
+         '67e59d60-ccfc-443c-ac9b-9bcaf35044b6',
+         'client', 'unshelve_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('shelve_offload_server_of_alt_account_fails',
+         '0309c7ef-27af-4934-9cc0-66b37085b227',
+         'client', 'shelve_offload_server',
+         lambda c: call(c.server['id']),
+         accepted=FORBIDDEN, destructive=True),
+    Case('create_server_snapshot_of_alt_account_fails',
+         '088de95a-825c-4773-bf7d-26d9d830f741',
+         'compute_images_client', 'create_image',
+         lambda c: call(c.server['id'], name='test_snapshot'),
+         accepted=FORBIDDEN),
+
+# Image
+    Case('get_image_of_alt_account',
+         '383c3525-48e9-47b1-9533-1eed490402de',
+         'compute_images_client', 'show_image',
+         lambda c: call(CONF.compute.image_ref)),
+    Case('update_image_of_alt_account_fails',
+         '272698ef-994a-4e94-b187-9d65f2ab731b',
+         'image_client', 'update_image',
+         lambda c: call(CONF.compute.image_ref),
+         accepted=FORBIDDEN),
+    Case('delete_image_of_alt_account_fails',
+         '794e34e0-3752-4516-8c10-09923bf61e01',
+         'image_client', 'delete_image',
+         lambda c: call(CONF.compute.image_ref),
+         accepted=FORBIDDEN, destructive=True),
+    Case('get_image_metadata_of_alt_account',
+         '197f8b8e-d41d-4060-9266-f60b2e179a26',
+         'compute_images_client', 'list_image_metadata',
+         lambda c: call(CONF.compute.image_ref)),
+    Case('get_server_snapshot_of_alt_account',
+         '537a378c-1aab-4eba-b872-809f7510431f',
+         'compute_images_client', 'show_image',
+         lambda c: call(c.server_snapshot['id']),
+         **SERVER_SNAPSHOT),
+    Case('update_server_snapshot_of_alt_account_fails',
+         'e8e5ee2b-904d-4c9d-9765-ae433eecbf6b',
+         'image_client', 'update_image',
+         lambda c: call(c.server_snapshot['id']),
+         accepted=DENIED, may_succeed=True, **SERVER_SNAPSHOT),
+    Case('delete_server_snapshot_of_alt_account_fails',
+         'bf89b4ca-17a9-4474-b3ec-ff5549bde157',
+         'image_client', 'delete_image',
+         lambda c: call(c.server_snapshot['id']),
+         accepted=FORBIDDEN, destructive=True, **SERVER_SNAPSHOT),
+    Case('get_server_snapshot_metadata_of_alt_account_fails',
+         '3a682f31-9882-411c-91c5-4f4303eb6194',
+         'compute_images_client', 'list_image_metadata',
+         lambda c: call(c.server_snapshot['id']),
+         accepted=DENIED, may_succeed=True, **SERVER_SNAPSHOT),
+    Case('update_server_snapshot_metadata_of_alt_account_fails',
+         '3185f333-6de3-4c0a-9838-62e67ea39e5e',
+         'compute_images_client', 'update_image_metadata',
+         lambda c: call(c.server_snapshot['id'],
+                        {'key1': 'alt1', 'key2': 'value2'}),
+         accepted=DENIED, may_succeed=True, **SERVER_SNAPSHOT),
+    Case('delete_server_snapshot_metadata_of_alt_account_fails',
+         '898766e0-9774-42a3-ac7f-b9cf96e03aae',
+         'compute_images_client', 'delete_image_metadata_item',
+         lambda c: call(c.server_snapshot['id'], 'meta1'),
+         accepted=DENIED, may_succeed=True, **SERVER_SNAPSHOT),
+    Case('create_server_from_snapshot_of_alt_account_fails',
+         '795eb920-fd89-4c87-abce-fe760bd32a51',
+         'client', 'create_server',
+         lambda c: call(name=data_utils.rand_name('VM_From_Snapshot'),
+                        imageRef=c.server_snapshot['id'],
+                        flavorRef=CONF.compute.flavor_ref),
+         accepted=(lib_exc.ServerFault,), **SERVER_SNAPSHOT),
+
+# Volume
+    Case('get_volume_of_alt_account',
+         'ee2c468b-1cf2-4d70-abe4-6d13f8d5ad8a',
+         'volumes_client', 'show_volume',
+         lambda c: call(c.volume1['id'])),
+    Case('update_volume_of_alt_account_fails',
+         '3a7f0ebf-b36d-4899-b607-bcc5e998ed72',
+         'volumes_client', 'update_volume',
+         lambda c: call(c.volume1['id']),
+         accepted=DENIED, may_succeed=True),
+    Case('delete_volume_of_alt_account_fails',
+         '0bce9bd7-4032-4c81-b277-093bb9058219',
+         'volumes_client', 'delete_volume',
+         lambda c: call(c.volume1['id']),
+         accepted=DENIED, may_succeed=True, destructive=True),
+    Case('get_volume_metadata_of_alt_account',
+         '49c06e08-d56e-48c6-846f-b9256370760b',
+         'volumes_client', 'show_volume_metadata',
+         lambda c: call(c.volume1['id'])),
+    Case('update_volume_metadata_of_alt_account_fails',
+         'd279a2c0-f554-4ae9-9a39-2a5caf9fced3',
+         'volumes_client', 'update_volume_metadata',
+         lambda c: call(c.volume1['id'],
+                        {'new_meta': data_utils.rand_name('new_metadata')}),
+         accepted=DENIED, may_succeed=True),
+    Case('delete_volume_metadata_of_alt_account_fails',
+         'b4a11b21-72c6-4450-985c-6ea9bd0e6d36',
+         'volumes_client', 'delete_volume_metadata_item',
+         lambda c: call(c.volume1['id'], 'vol_metadata'),
+         accepted=DENIED, may_succeed=True),
+    Case('attach_volume_of_alt_account_fails',
+         '1c48d877-6f4b-480e-ab18-5fe26418bc0a',
+         'client', 'attach_volume',
+         lambda c: call(c.server_run['id'], volumeId=c.volume1['id']),
+         accepted=DENIED, may_succeed=True, destructive=True),
+    Case('detach_volume_of_alt_account_fails',
+         '2074a6b1-5d08-4724-bfc7-61b6247a017e',
+         'client', 'detach_volume',
+         lambda c: call(c.server['id'], c.volume2['id']),
+         accepted=DENIED, may_succeed=True, destructive=True),
+    Case('update_volume_attachment_of_alt_account_fails',
+         '46e0198f-52e1-410f-8edc-a287b189d7b7',
+         'client', 'update_attached_volume',
+         lambda c: call(c.server['id'], attachment_id=c.attachment['id'],
+                        volumeId=c.volume1['id']),
+         accepted=DENIED, may_succeed=True, destructive=True),
+    Case('extend_volume_of_alt_account_fails',
+         'f9be1ab4-0975-4b6b-ae36-da4e7a576b24',
+         'volumes_client', 'extend_volume',
+         lambda c: call(c.volume1['id'],
+                        new_size=int(c.volume1['size']) + 1),
+         accepted=DENIED, may_succeed=True, destructive=True),
+    Case('create_volume_snapshot_of_alt_account_fails',
+         '09cfd067-831a-47fc-ac07-13e05290cf30',
+         'snapshots_client', 'create_snapshot',
+         lambda c: call(c.volume1['id']),
+         accepted=DENIED, may_succeed=True, **VOLUME_SNAPSHOT),
+    Case('get_volume_snapshot_of_alt_account_fails',
+         '2cad9a8f-cc65-429c-a7d4-908bd86358f1',
+         'snapshots_client', 'show_snapshot',
+         lambda c: call(c.vol_snapshot['id']),
+         accepted=DENIED, may_succeed=True, **VOLUME_SNAPSHOT),
+    Case('update_volume_snapshot_of_alt_account_fails',
+         '9a9274a8-f385-4c00-b7f9-405e13d8dd74',
+         'image_client', 'update_image',
+         lambda c: call(c.vol_snapshot['id']),
+         accepted=DENIED, may_succeed=True, **VOLUME_SNAPSHOT),
+    Case('delete_volume_snapshot_of_alt_account_fails',
+         'e4fb10e9-a017-4c02-8299-bc361cf04828',
+         'snapshots_client', 'delete_snapshot',
+         lambda c: call(c.vol_snapshot['id']),
+         accepted=FORBIDDEN, destructive=True, **VOLUME_SNAPSHOT),
+]
 
 
 class UserIsolationRun(base.BaseV2ComputeTest):
+    """Calls of user B on the resources of user A
+
+    The calls are listed in CASES and made by resource_setup (concurrently,
+    the destructive ones last and one at a time, see isolation.py), the test
+    methods generated from CASES check their outcomes.
+    test_snapshot_pipeline exports the timings of the snapshots made by
+    UserIsolationSetup (and of its persistent fixture) as perfdata series.
+    """
 
     credentials = ['primary']
 
@@ -45,6 +340,10 @@ class UserIsolationRun(base.BaseV2ComputeTest):
 
     @classmethod
     def setup_credentials(cls):
+        # Reuse the token of the previous runs (see auth_cache.py)
+        auth_cache.install()
+        # Delete the resources when the check is stopped (see terminate.py)
+        terminate.install()
         super(UserIsolationRun, cls).setup_credentials()
 
     @classmethod
@@ -66,19 +365,20 @@ class UserIsolationRun(base.BaseV2ComputeTest):
     def resource_setup(cls):
         super(UserIsolationRun, cls).resource_setup()
 
+        # Connect to UserIsolationSetup first, so that both sides can watch
+        # each other while their servers are building (see handoff.py)
+        deadline = handoff.get_deadline()
+        cls.subscriber = handoff.Subscriber(deadline)
+
         LOG.info("Starting VM_Run")
         name = data_utils.rand_name('VM_Run')
-        server = cls.create_test_server(name=name, wait_until='ACTIVE')
+        server = cls.create_test_server(name=name)
+        polling.wait_for_server_status(cls.client, server['id'], 'ACTIVE')
         cls.server_run = cls.client.show_server(server['id'])['server']
         LOG.info("VM_Run started and active ")
 
         LOG.info("Waiting for VM_Setup to get ready...")
-        while not os.path.exists(file_path):
-            time.sleep(3)
-
-        f = open(file_path)
-        fileinfo = json.load(f)
-        f.close()
+        fileinfo = cls.subscriber.receive(deadline)
 
         cls.server = fileinfo['server']
         if not CONF.compute_feature_enabled.snapshot:
@@ -96,496 +396,36 @@ class UserIsolationRun(base.BaseV2ComputeTest):
         else:
             cls.vol_snapshot = fileinfo['vol_snapshot']
         cls.attachment = fileinfo['attachment']
+        # Timings of the snapshots of UserIsolationSetup
+        cls.setup_perfdata = fileinfo.get('perfdata', [])
 
         LOG.info("Running isolation tests from user B...")
+        cls.outcomes = isolation.run_cases(cls, CASES)
 
     @classmethod
     def resource_cleanup(cls):
-        if hasattr(cls, 'server'):
-            cls.client.delete_server(cls.server_run['id'])
-        os.remove(file_path)
-        super(UserIsolationRun, cls).resource_cleanup()
-
-# General
-    @test.attr(type=['negative'])
-    @test.idempotent_id('ebb37040-ea80-4d73-811f-7cb9a4846a7e')
-    def test_get_keypair_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.NotFound,
-                          self.keypairs_client.show_keypair,
-                          self.keypairname)
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('35c4d575-423d-4b8c-ab2a-3447b9677422')
-    def test_delete_keypair_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.NotFound,
-                          self.keypairs_client.delete_keypair,
-                          self.keypairname)
-
-    @test.idempotent_id('137f2014-79a7-4dcf-8e1c-710893b12d1f')
-    def test_get_security_group_of_alt_account(self):
-        self.assertTrue(self.security_client.show_security_group,
-                        self.security_group['id'])
-
-# Server
-    @test.idempotent_id('1fb19bb3-d40b-49e3-b6f8-04e8ca354067')
-    def test_get_server_of_alt_account(self):
-        self.assertTrue(self.client.show_server,
-                        self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('1e66dee1-1498-4ebb-9304-b952bf4e3ee3')
-    def test_update_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.update_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('5c968a59-aeae-4211-b227-adcc9ecd622c')
-    def test_delete_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.delete_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('36c0b45f-cac3-4aa3-95aa-6722d697de9b')
-    def test_get_server_metadata_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.list_server_metadata,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('c5011b7a-8e11-4f05-86fe-8e1b8b0ab5b1')
-    def test_update_server_metadata_of_alt_account_server_fails(self):
-        req_metadata = {'tempest_meta_key': 'tempest-server-data1'}
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.set_server_metadata,
-                          self.server['id'],
-                          req_metadata)
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('bc8dd9e7-86a4-4bbf-858b-6eb03c9f5655')
-    def test_delete_server_metadata_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.delete_server_metadata_item,
-                          self.server['id'],
-                          'meta1')
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('caa72f38-63e4-41ce-bfd8-b134d22e919e')
-    def test_get_server_password_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.show_password,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('6a990add-e4cc-4c99-99f7-b06c5ab88b5f')
-    def test_update_server_password_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.change_password,
-                          self.server['id'],
-                          adminPass='newpass')
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('0d0f26c4-f69a-4e71-abe8-a342c6975f14')
-    def test_get_console_output_of_alt_account_server_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.get_console_output,
-                          self.server['id'],
-                          length=10)
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('7aafc3bd-e664-4f69-b122-6a6e3e551188')
-    def test_get_vnc_console_of_alt_account_server_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.get_vnc_console,
-                          self.server['id'],
-                          type='novnc')
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('3080119d-6fa1-489d-9621-f983aff725ed')
-    def test_rebuild_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.rebuild_server,
-                          self.server['id'],
-                          self.image_ref_alt)
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('827625bb-048d-4cf3-b489-2b36594fb5f8')
-    def test_resize_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.resize_server,
-                          self.server['id'],
-                          self.flavor_ref_alt)
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('9df2b0f5-ea2b-41ff-8401-0d1a00dc864a')
-    def test_reboot_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.reboot_server,
-                          self.server['id'], type='HARD')
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('65e47d5a-8bd4-406b-8d19-52c3eba6f65a')
-    def test_start_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.start_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('56e11972-faac-4487-9420-031ee379319c')
-    def test_stop_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.stop_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('7e921ec4-ecec-4a1b-b673-da2f9dc009cc')
-    def test_lock_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.lock_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('68cfdda6-0475-4734-909d-b2fe21987347')
-    def test_unlock_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.unlock_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('41b5975f-e140-4cc9-83af-a83b8b6cf278')
-    def test_pause_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.pause_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('0a1c4f53-fa8a-4ae9-b5ab-e55e539024d1')
-    def test_unpause_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.unpause_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('5af863a1-f10c-4a3a-a3de-2bf3506247f5')
-    def test_suspend_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.suspend_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('4b93e4b9-b33f-4ff1-8cd0-5f1efe20624b')
-    def test_resume_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.resume_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('1aea9960-897f-4273-ae69-bbd9bc45c359')
-    def test_shelve_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.shelve_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('67e59d60-ccfc-443c-ac9b-9bcaf35044b6')
-    def test_unshelve_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.unshelve_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('0309c7ef-27af-4934-9cc0-66b37085b227')
-    def test_shelve_offload_server_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.client.shelve_offload_server,
-                          self.server['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('088de95a-825c-4773-bf7d-26d9d830f741')
-    def test_create_server_snapshot_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.compute_images_client.create_image,
-                          self.server['id'], name='test_snapshot')
-
-# Image
-    @test.idempotent_id('383c3525-48e9-47b1-9533-1eed490402de')
-    def test_get_image_of_alt_account(self):
-        self.assertTrue(self.compute_images_client.show_image,
-                        CONF.compute.image_ref)
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('272698ef-994a-4e94-b187-9d65f2ab731b')
-    def test_update_image_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.image_client.update_image,
-                          CONF.compute.image_ref)
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('794e34e0-3752-4516-8c10-09923bf61e01')
-    def test_delete_image_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.image_client.delete_image,
-                          CONF.compute.image_ref)
-
-    @test.idempotent_id('197f8b8e-d41d-4060-9266-f60b2e179a26')
-    def test_get_image_metadata_of_alt_account(self):
-        self.assertTrue(self.compute_images_client.list_image_metadata,
-                        CONF.compute.image_ref)
-
-    @test.idempotent_id('537a378c-1aab-4eba-b872-809f7510431f')
-    @testtools.skipUnless(CONF.compute_feature_enabled.snapshot,
-                          'Instance/image snapshotting is not available.')
-    def test_get_server_snapshot_of_alt_account(self):
-        self.assertTrue(self.compute_images_client.show_image,
-                        self.server_snapshot['id'])
-
-    @test.attr(type=['negative'])
-    @testtools.skipUnless(CONF.compute_feature_enabled.snapshot,
-                          'Instance/image snapshotting is not available.')
-    @test.idempotent_id('e8e5ee2b-904d-4c9d-9765-ae433eecbf6b')
-    def test_update_server_snapshot_of_alt_account_fails(self):
-        try:
-            self.image_client.update_image(self.server_snapshot['id'])
-        except lib_exc.Forbidden:
-            pass
-        except lib_exc.NotFound:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @testtools.skipUnless(CONF.compute_feature_enabled.snapshot,
-                          'Instance/image snapshotting is not available.')
-    @test.idempotent_id('bf89b4ca-17a9-4474-b3ec-ff5549bde157')
-    def test_delete_server_snapshot_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.image_client.delete_image,
-                          self.server_snapshot['id'])
-
-    @test.attr(type=['negative'])
-    @testtools.skipUnless(CONF.compute_feature_enabled.snapshot,
-                          'Instance/image snapshotting is not available.')
-    @test.idempotent_id('3a682f31-9882-411c-91c5-4f4303eb6194')
-    def test_get_server_snapshot_metadata_of_alt_account_fails(self):
-        try:
-            self.compute_images_client.list_image_metadata(
-                                                self.server_snapshot['id'])
-        except lib_exc.Forbidden:
-            pass
-        except lib_exc.NotFound:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @testtools.skipUnless(CONF.compute_feature_enabled.snapshot,
-                          'Instance/image snapshotting is not available.')
-    @test.idempotent_id('3185f333-6de3-4c0a-9838-62e67ea39e5e')
-    def test_update_server_snapshot_metadata_of_alt_account_fails(self):
-        metadata = {'key1': 'alt1', 'key2': 'value2'}
-        try:
-            self.compute_images_client.update_image_metadata(
-                                                   self.server_snapshot['id'],
-                                                   metadata)
-        except lib_exc.Forbidden:
-            pass
-        except lib_exc.NotFound:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @testtools.skipUnless(CONF.compute_feature_enabled.snapshot,
-                          'Instance/image snapshotting is not available.')
-    @test.idempotent_id('898766e0-9774-42a3-ac7f-b9cf96e03aae')
-    def test_delete_server_snapshot_metadata_of_alt_account_fails(self):
-        try:
-            self.compute_images_client.delete_image_metadata_item(
-                                        self.server_snapshot['id'],'meta1')
-        except lib_exc.Forbidden:
-            pass
-        except lib_exc.NotFound:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @testtools.skipUnless(CONF.compute_feature_enabled.snapshot,
-                          'Instance/image snapshotting is not available.')
-    @test.idempotent_id('795eb920-fd89-4c87-abce-fe760bd32a51')
-    def test_create_server_from_snapshot_of_alt_account_fails(self):
-        name = data_utils.rand_name('VM_From_Snapshot')
-        self.assertRaises(lib_exc.ServerFault,
-                          self.client.create_server,
-                          name=name,
-                          imageRef=self.server_snapshot['id'],
-                          flavorRef=CONF.compute.flavor_ref)
-
-# Volume
-    @test.idempotent_id('ee2c468b-1cf2-4d70-abe4-6d13f8d5ad8a')
-    def test_get_volume_of_alt_account(self):
-        self.assertTrue(self.volumes_client.show_volume,
-                        self.volume1['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('3a7f0ebf-b36d-4899-b607-bcc5e998ed72')
-    def test_update_volume_of_alt_account_fails(self):
-        try:
-            self.volumes_client.update_volume(self.volume1['id'])
-        except lib_exc.Forbidden:
-            pass
-        except lib_exc.NotFound:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('0bce9bd7-4032-4c81-b277-093bb9058219')
-    def test_delete_volume_of_alt_account_fails(self):
+        # Let UserIsolationSetup start its own cleanup right away
+        if hasattr(cls, 'subscriber'):
+            try:
+                cls.subscriber.done()
+            except (IOError, OSError) as exc:
+                # UserIsolationSetup is gone, VM_Run is deleted all the same
+                LOG.warning("Cannot notify UserIsolationSetup (%s)" % exc)
         try:
-            self.volumes_client.delete_volume(self.volume1['id'])
-        except lib_exc.Forbidden:
-            pass
-        except lib_exc.NotFound:
-            pass
-        except:
-            raise
-
-    @test.idempotent_id('49c06e08-d56e-48c6-846f-b9256370760b')
-    def test_get_volume_metadata_of_alt_account(self):
-        self.assertTrue(self.volumes_client.show_volume_metadata,
-                        self.volume1['id'])
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('d279a2c0-f554-4ae9-9a39-2a5caf9fced3')
-    def test_update_volume_metadata_of_alt_account_fails(self):
-        metadata = {'new_meta': data_utils.rand_name('new_metadata')}
-        try:
-            self.volumes_client.update_volume_metadata(self.volume1['id'],
-                                                       metadata)
-        except lib_exc.Forbidden:
-            pass
-        except lib_exc.NotFound:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('b4a11b21-72c6-4450-985c-6ea9bd0e6d36')
-    def test_delete_volume_metadata_of_alt_account_fails(self):
-        try:
-            self.volumes_client.delete_volume_metadata_item(self.volume1['id'],
-                                                            'vol_metadata')
-        except lib_exc.Forbidden:
-            pass
-        except lib_exc.NotFound:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('1c48d877-6f4b-480e-ab18-5fe26418bc0a')
-    def test_attach_volume_of_alt_account_fails(self):
-        try:
-            self.client.attach_volume(self.server_run['id'],
-                                      volumeId=self.volume1['id'])
-        except lib_exc.NotFound:
-            pass
-        except lib_exc.Forbidden:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('2074a6b1-5d08-4724-bfc7-61b6247a017e')
-    def test_detach_volume_of_alt_account_fails(self):
-        try:
-            self.client.detach_volume(self.server['id'], self.volume2['id'])
-        except lib_exc.Forbidden:
-            pass
-        except lib_exc.NotFound:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('46e0198f-52e1-410f-8edc-a287b189d7b7')
-    def test_update_volume_attachment_of_alt_account_fails(self):
-        try:
-            self.client.update_attached_volume(self.server['id'],
-                                        attachment_id=self.attachment['id'],
-                                        volumeId=self.volume1['id'])
-        except lib_exc.Forbidden:
-            pass
-        except lib_exc.NotFound:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('f9be1ab4-0975-4b6b-ae36-da4e7a576b24')
-    def test_extend_volume_of_alt_account_fails(self):
-        extend_size = int(self.volume1['size']) + 1
-        try:
-            self.volumes_client.extend_volume(self.volume1['id'],
-                                              new_size=extend_size)
-        except lib_exc.Forbidden:
-            pass
-        except lib_exc.NotFound:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @testtools.skipUnless(CONF.volume_feature_enabled.snapshot,
-                          'Volume snapshotting is not available.')
-    @test.idempotent_id('09cfd067-831a-47fc-ac07-13e05290cf30')
-    def test_create_volume_snapshot_of_alt_account_fails(self):
-        try:
-            self.snapshots_client.create_snapshot(self.volume1['id'])
-        except lib_exc.NotFound:
-            pass
-        except lib_exc.Forbidden:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @testtools.skipUnless(CONF.volume_feature_enabled.snapshot,
-                          'Volume snapshotting is not available.')
-    @test.idempotent_id('2cad9a8f-cc65-429c-a7d4-908bd86358f1')
-    def test_get_volume_snapshot_of_alt_account_fails(self):
-        try:
-            self.snapshots_client.show_snapshot(self.vol_snapshot['id'])
-        except lib_exc.NotFound:
-            pass
-        except lib_exc.Forbidden:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @test.idempotent_id('9a9274a8-f385-4c00-b7f9-405e13d8dd74')
-    @testtools.skipUnless(CONF.volume_feature_enabled.snapshot,
-                          'Volume snapshotting is not available.')
-    def test_update_volume_snapshot_of_alt_account_fails(self):
-        try:
-            self.image_client.update_image(self.vol_snapshot['id'])
-        except lib_exc.NotFound:
-            pass
-        except lib_exc.Forbidden:
-            pass
-        except:
-            raise
-
-    @test.attr(type=['negative'])
-    @testtools.skipUnless(CONF.volume_feature_enabled.snapshot,
-                          'Volume snapshotting is not available.')
-    @test.idempotent_id('e4fb10e9-a017-4c02-8299-bc361cf04828')
-    def test_delete_volume_snapshot_of_alt_account_fails(self):
-        self.assertRaises(lib_exc.Forbidden,
-                          self.snapshots_client.delete_snapshot,
-                          self.vol_snapshot['id'])
-
-# EOF
+            if hasattr(cls, 'server_run'):
+                cls.client.delete_server(cls.server_run['id'])
+        finally:
+            super(UserIsolationRun, cls).resource_cleanup()
+
+    @test.idempotent_id('e7606ff2-b4b8-4758-a5cb-503ba953da73')
+    def test_snapshot_pipeline(self):
+        if not self.setup_perfdata:
+            raise self.skipException("No perfdata from UserIsolationSetup")
+        perf = perfdata.PerfData()
+        self.addCleanup(perf.attach, self)
+        # Added again, so that the thresholds of this site apply
+        for serie in self.setup_perfdata:
+            perf.add(serie['label'], serie['value'], unit=serie['unit'])
+
+
+isolation.add_tests(UserIsolationRun, CASES)
@@ -12,25 +12,61 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
+import collections
 import json
-import os.path
 import time
-import traceback
 from oslo_log import log as logging
 from tempest.api.compute import base
-from tempest.common import waiters
+from tempest.api.fgcloud import auth_cache
+from tempest.api.fgcloud import executor
+from tempest.api.fgcloud import fixture
+from tempest.api.fgcloud import handoff
+from tempest.api.fgcloud import options
+from tempest.api.fgcloud import perfdata
+from tempest.api.fgcloud import polling
+from tempest.api.fgcloud import terminate
 from tempest.common.utils import data_utils
 from tempest.lib import exceptions as lib_exc
 from tempest import config
+from tempest import exceptions
 from tempest import test
 
 CONF = config.CONF
 LOG = logging.getLogger(__name__)
-file_path = "/tmp/tempest_" + CONF.compute.image_ref
+
+# Task of resource_setup, class attribute and fixture key of each resource
+# handed over to UserIsolationRun
+FIXTURE = (('server', 'server', 'server'),
+           ('server_snapshot', 'snap', 'server_snapshot'),
+           ('keypair', 'keypairname', 'keypairname'),
+           ('security_group', 'security_group', 'security_group'),
+           ('rule', 'rule', 'rule'),
+           ('volume1', 'volume1', 'volume1'),
+           ('volume1', 'metadata', 'metadata'),
+           ('volume2', 'volume2', 'volume2'),
+           ('vol_snapshot', 'vol_snapshot', 'vol_snapshot'),
+           ('attachment', 'attachment', 'attachment'))
 
 
 class UserIsolationSetup(base.BaseV2ComputeTest):
 
+    """Resources of user A, handed over to UserIsolationRun
+
+    The create-to-ACTIVE time of the server snapshot (server_snapshot_time)
+    and its size (server_snapshot_size, in MB), the create-to-available time
+    of the volume snapshot (vol_snapshot_time) and, with
+    [fgcloud]snapshot_boot, the time to boot a server from the server
+    snapshot (snapshot_boot_time) are handed over along with the resources,
+    UserIsolationRun exports them as perfdata series, along with the latency
+    of each task of resource_setup (setup_<task>_time, setup_server_time...).
+
+    With [fgcloud]isolation_persistent, the resources are kept for the next
+    run, which validates them and only creates again the missing or broken
+    ones (see fgcloud/fixture.py) : the time of the validation
+    (fixture_validate_time) and the number of resources created
+    (fixture_rebuilt) are handed over too.
+    """
+
     credentials = ['primary']
 
     @classmethod
@@ -45,6 +81,10 @@ class UserIsolationSetup(base.BaseV2ComputeTest):
 
     @classmethod
     def setup_credentials(cls):
+        # Reuse the token of the previous runs (see auth_cache.py)
+        auth_cache.install()
+        # Delete the resources when the check is stopped (see terminate.py)
+        terminate.install()
         super(UserIsolationSetup, cls).setup_credentials()
 
     @classmethod
@@ -61,216 +101,369 @@ class UserIsolationSetup(base.BaseV2ComputeTest):
             cls.volumes_client = cls.os.volumes_client
         else:
             cls.volumes_client = cls.os.volumes_v2_client
+        # Setup and cleanup share these clients between threads
+        executor.thread_safe(cls.client, cls.compute_images_client,
+                             cls.image_client, cls.keypairs_client,
+                             cls.security_client, cls.rule_client,
+                             cls.snapshots_client, cls.volumes_client)
 
     @classmethod
     def resource_setup(cls):
         super(UserIsolationSetup, cls).resource_setup()
 
+        # Listen for UserIsolationRun before creating anything, so that both
+        # sides can watch each other (see handoff.py)
+        cls.deadline = handoff.get_deadline()
+        cls.publisher = handoff.Publisher()
+        cls.published = False
+        cls.perf = perfdata.PerfData()
+        cls.persistent = options.CONF.fgcloud.isolation_persistent
+        if cls.persistent:
+            cls._reuse_fixture()
+
+        # Independent resources are created concurrently, the server
+        # snapshot and the attachment start as soon as what they need is
+        # ready (see executor.py). The resources reused from the previous
+        # run are left out.
+        graph = executor.TaskGraph('UserIsolationSetup')
+        existing = cls._parts()
+
+        def add(name, func, requires=()):
+            if name not in existing:
+                graph.add(name, func, requires=[t for t in requires
+                                                if t in graph.tasks])
+
+        add('server', cls._create_server)
+        if not CONF.compute_feature_enabled.snapshot:
+            LOG.info("Snapshot skipped as instance/image snapshotting is not enabled")
+        else:
+            add('server_snapshot', cls._create_server_snapshot,
+                requires=['server'])
+            if options.CONF.fgcloud.snapshot_boot:
+                add('snapshot_server', cls._boot_from_snapshot,
+                    requires=['server_snapshot'])
+        add('keypair', cls._create_keypair)
+        add('security_group', cls._create_security_group)
+        add('rule', cls._create_rule, requires=['security_group'])
+        add('volume1', cls._create_volume1)
+        add('volume2', cls._create_volume2)
+        if not CONF.volume_feature_enabled.snapshot:
+            LOG.info("Snapshot skipped as volume snapshotting is not enabled")
+        else:
+            add('vol_snapshot', cls._create_vol_snapshot,
+                requires=['volume1'])
+        # Nova refuses to attach a volume while snapshotting the server
+        add('attachment', cls._attach_volume2,
+            requires=['server', 'server_snapshot', 'volume2'])
+        try:
+            graph.run()
+        finally:
+            if cls.persistent:
+                cls._record()
+        # Latency of each node of the graph, from its start
+        for name, elapsed in graph.timings.items():
+            cls.perf.add('setup_%s_time' % name, round(elapsed, 3))
+        if cls.persistent:
+            cls.perf.add('fixture_rebuilt',
+                         len([t for t in graph.tasks
+                              if t != 'snapshot_server']), unit='')
+
         # Prepare an array to store information
-        fileinfo = {}
-        if os.path.exists(file_path):
-            LOG.info("/!\\ deleting previous file /!\\")
-            os.remove(file_path)
+        fileinfo = cls._fixture()
+        fileinfo['perfdata'] = list(cls.perf.series.values())
+
+        # Hand the information over to UserIsolationRun
+        cls.publisher.publish(fileinfo, cls.deadline)
+        cls.published = True
+        LOG.info("Fixture published, waiting...")
+
+    @classmethod
+    def _fixture(cls):
+        """Resources handed over to UserIsolationRun, those created so far"""
+        return dict((key, getattr(cls, attribute))
+                    for task, attribute, key in FIXTURE
+                    if hasattr(cls, attribute))
+
+    @classmethod
+    def _parts(cls):
+        """Tasks of resource_setup whose resource exists"""
+        parts = set(task for task, attribute, key in FIXTURE
+                    if hasattr(cls, attribute))
+        if hasattr(cls, 'snapshot_server'):
+            parts.add('snapshot_server')
+        return parts
 
-        # Create a server
+    @classmethod
+    def _reuse_fixture(cls):
+        """Take the fixture of the previous run over, but its stale parts
+
+        The stale parts which still exist are deleted (see fixture.py).
+        """
+        cls.fixture_created = time.time()
+        state = fixture.load(cls.os.credentials.username)
+        if state is None:
+            LOG.info("No fixture recorded, creating it")
+            return
+        recorded = state['fixture']
+        with cls.perf.timer('fixture_validate_time'):
+            if fixture.expired(state):
+                stale = collections.OrderedDict(
+                    (task, 'expired') for task, attribute, key in FIXTURE
+                    if key in recorded)
+            else:
+                cls.fixture_created = state['created']
+                stale = fixture.validate(cls, recorded)
+        for task, attribute, key in FIXTURE:
+            if key in recorded:
+                setattr(cls, attribute, recorded[key])
+        if not stale:
+            LOG.info("Fixture reused as is")
+            return
+        LOG.info("Creating the stale parts of the fixture again : %s" %
+                 json.dumps(stale))
+        cls._delete([task for task, reason in stale.items()
+                     if reason != 'missing'], 'UserIsolationSetup stale parts')
+        for task, attribute, key in FIXTURE:
+            if task in stale and hasattr(cls, attribute):
+                delattr(cls, attribute)
+
+    @classmethod
+    def _record(cls):
+        try:
+            fixture.store(cls.os.credentials.username, cls._fixture(),
+                          cls.fixture_created)
+        except (IOError, OSError) as exc:
+            LOG.warning("Cannot record the fixture (%s)" % exc)
+
+    @classmethod
+    def _create_server(cls):
         LOG.info("Starting VM_Setup")
         name = data_utils.rand_name('VM_Setup')
-        server = cls.create_test_server(name=name, wait_until='ACTIVE')
+        server = cls.create_test_server(name=name)
+        polling.wait_for_server_status(cls.client, server['id'], 'ACTIVE')
         cls.server = cls.client.show_server(server['id'])['server']
-        fileinfo['server'] = cls.server
         LOG.info("VM_Setup created and active (%s)" % server['id'])
 
-        # Create a server snapshot
-        if not CONF.compute_feature_enabled.snapshot:
-            LOG.info("Snapshot skipped as instance/image snapshotting is not enabled")
-        else:
-            name = data_utils.rand_name('snapshot')
+    @classmethod
+    def _create_server_snapshot(cls):
+        name = data_utils.rand_name('snapshot')
+        with cls.perf.timer('server_snapshot_time'):
             body = cls.compute_images_client.create_image(cls.server['id'],
                                                           name=name)
             snap_id = data_utils.parse_image_id(body.response['location'])
-            waiters.wait_for_image_status(cls.compute_images_client,
+            polling.wait_for_image_status(cls.compute_images_client,
                                           snap_id, 'ACTIVE')
-            cls.snap = cls.compute_images_client.show_image(snap_id)['image']
-            fileinfo['server_snapshot'] = cls.snap
-            LOG.info("Server Snapshot created and active (%s)" % snap_id)
-
-        # Create a keypair
-        cls.keypairname = data_utils.rand_name('keypair')
-        cls.keypairs_client.create_keypair(name=cls.keypairname)
-        fileinfo['keypairname'] = cls.keypairname
+        cls.snap = cls.compute_images_client.show_image(snap_id)['image']
+        size = cls.snap.get('OS-EXT-IMG-SIZE:size')
+        if size is None:
+            # Not given by Nova before the 2.1 API
+            size = cls.image_client.get_image_meta(snap_id)['size']
+        cls.perf.add('server_snapshot_size',
+                     round(int(size) / 1048576.0, 1), unit='MB')
+        LOG.info("Server Snapshot created and active (%s)" % snap_id)
+
+    @classmethod
+    def _boot_from_snapshot(cls):
+        name = data_utils.rand_name('VM_Snapshot')
+        with cls.perf.timer('snapshot_boot_time'):
+            server = cls.create_test_server(name=name,
+                                            image_id=cls.snap['id'])
+            cls.snapshot_server = server
+            polling.wait_for_server_status(cls.client, server['id'],
+                                           'ACTIVE')
+        LOG.info("Server booted from the snapshot (%s)" % server['id'])
+
+    @classmethod
+    def _create_keypair(cls):
+        keypairname = data_utils.rand_name('keypair')
+        cls.keypairs_client.create_keypair(name=keypairname)
+        cls.keypairname = keypairname
         LOG.info("Keypair created (%s)" % cls.keypairname)
 
-        # Create a security group
+    @classmethod
+    def _create_security_group(cls):
         name = data_utils.rand_name('security')
         description = data_utils.rand_name('description')
         cls.security_group = cls.security_client.create_security_group(
             name=name, description=description)['security_group']
-        fileinfo['security_group'] = cls.security_group
         LOG.info("Security group created (%s)" % name)
 
-        # Create a security group rule
+    @classmethod
+    def _create_rule(cls):
         cls.rule = cls.rule_client.create_security_group_rule(
             parent_group_id=cls.security_group['id'], ip_protocol='tcp',
             from_port=22, to_port=22)['security_group_rule']
-        fileinfo['rule'] = cls.rule
         LOG.info("Security rule created (%s)" % cls.rule['id'])
 
-        # Create two volumes
+    @classmethod
+    def _create_volume1(cls):
         name = data_utils.rand_name('volume1')
         cls.metadata = {'vol_metadata': data_utils.rand_name('vol_metadata')}
         cls.volume1 = cls.volumes_client.create_volume(
             size=1, display_name=name, metadata=cls.metadata)['volume']
+        polling.wait_for_volume_status(cls.volumes_client,
+                                       cls.volume1['id'], 'available')
+        LOG.info("Volume 1 created (%s)" % cls.volume1['id'])
+
+    @classmethod
+    def _create_volume2(cls):
         name = data_utils.rand_name('volume2')
         cls.volume2 = cls.volumes_client.create_volume(
             size=1, display_name=name)['volume']
-        waiters.wait_for_volume_status(cls.volumes_client,
-                                       cls.volume1['id'], 'available')
-        waiters.wait_for_volume_status(cls.volumes_client,
+        polling.wait_for_volume_status(cls.volumes_client,
                                        cls.volume2['id'], 'available')
-        fileinfo['volume1'] = cls.volume1
-        fileinfo['metadata'] = cls.metadata
-        fileinfo['volume2'] = cls.volume2
-        LOG.info("Volumes created (1:%s / 2:%s)" %
-                 (cls.volume1['id'], cls.volume2['id']))
+        LOG.info("Volume 2 created (%s)" % cls.volume2['id'])
 
-        # Create a snapshot from volume1
-        if not CONF.volume_feature_enabled.snapshot:
-            LOG.info("Snapshot skipped as volume snapshotting is not enabled")
-        else:
-            name = data_utils.rand_name('vol_snapshot')
+    @classmethod
+    def _create_vol_snapshot(cls):
+        name = data_utils.rand_name('vol_snapshot')
+        with cls.perf.timer('vol_snapshot_time'):
             cls.vol_snapshot = cls.snapshots_client.create_snapshot(
                 volume_id=cls.volume1['id'],
                 display_name=name)['snapshot']
-            waiters.wait_for_snapshot_status(cls.snapshots_client,
+            polling.wait_for_snapshot_status(cls.snapshots_client,
                                              cls.vol_snapshot['id'],
                                              'available')
-            fileinfo['vol_snapshot'] = cls.vol_snapshot
-            LOG.info("Volume 1 snapshot created (%s)" % cls.vol_snapshot['id'])
+        LOG.info("Volume 1 snapshot created (%s)" % cls.vol_snapshot['id'])
 
-        # Attach volume2 to the server
+    @classmethod
+    def _attach_volume2(cls):
         cls.attachment = cls.servers_client.attach_volume(
             cls.server['id'],
             volumeId=cls.volume2['id'])['volumeAttachment']
-        waiters.wait_for_volume_status(cls.volumes_client,
+        polling.wait_for_volume_status(cls.volumes_client,
                                        cls.volume2['id'], 'in-use')
-        fileinfo['attachment'] = cls.attachment
         LOG.info("Volume 2 attached to server")
 
-        # Save array information to file
-        f = open(file_path, 'w')
-        json.dump(fileinfo, f)
-        f.close()
-        LOG.info("File created with ids, waiting...")
-
     @classmethod
-    def resource_cleanup(cls):
-
+    def _detach_volume2(cls):
         try:
-            if hasattr(cls, 'attachment'):
-                cls.client.detach_volume(cls.server['id'], cls.volume2['id'])
-                waiters.wait_for_volume_status(cls.volumes_client,
-                                               cls.volume2['id'], 'available')
+            cls.client.detach_volume(cls.server['id'], cls.volume2['id'])
+            polling.wait_for_volume_status(cls.volumes_client,
+                                           cls.volume2['id'], 'available')
         except lib_exc.NotFound:
             # The server may be already deleted so does the attachment...
             pass
         except lib_exc.Conflict:
             # Raised when instance is in ERROR state
             cls.client.delete_server(cls.server['id'])
-        except:
-            exc_info = traceback.format_exc().splitlines()
-            LOG.warning("Cannot cleanup attachment\n%s\n%s" %
-                      (exc_info[-1], exc_info[-2]))
 
+    @classmethod
+    def _delete_vol_snapshot(cls):
         try:
-            if hasattr(cls, 'vol_snapshot'):
-                waiters.wait_for_volume_status(cls.volumes_client,
+            try:
+                polling.wait_for_volume_status(cls.volumes_client,
                                                cls.volume1['id'], 'available')
-                cls.snapshots_client.delete_snapshot(cls.vol_snapshot['id'])
-                cls.snapshots_client.wait_for_resource_deletion(
-                                                        cls.vol_snapshot['id'])
+            except exceptions.VolumeBuildErrorException:
+                # A stale volume1 (see fixture.py), deleted right after
+                pass
+            cls.snapshots_client.delete_snapshot(cls.vol_snapshot['id'])
+            polling.wait_for_resource_deletion(
+                cls.snapshots_client, 'snapshot', cls.vol_snapshot['id'])
         except (lib_exc.BadRequest, lib_exc.NotFound):
             pass
-        except:
-            exc_info = traceback.format_exc().splitlines()
-            LOG.warning("Cannot cleanup snapshot\n%s\n%s" %
-                      (exc_info[-1], exc_info[-2]))
-        try:
-            if hasattr(cls, 'volume1'):
-                if hasattr(cls, 'vol_snapshot'):
-                    cls.snapshots_client.wait_for_resource_deletion(
-                                                        cls.vol_snapshot['id'])
-                cls.volumes_client.delete_volume(cls.volume1['id'])
-                cls.volumes_client.wait_for_resource_deletion(
-                                                        cls.volume1['id'])
-        except:
-            exc_info = traceback.format_exc().splitlines()
-            LOG.warning("Cannot cleanup volume1\n%s\n%s" %
-                      (exc_info[-1], exc_info[-2]))
 
-        try:
-            if hasattr(cls, 'volume2'):
-                waiters.wait_for_volume_status(cls.volumes_client,
-                                               cls.volume2['id'], 'available')
-                cls.volumes_client.delete_volume(cls.volume2['id'])
-                cls.volumes_client.wait_for_resource_deletion(
-                                                            cls.volume2['id'])
-        except:
-            exc_info = traceback.format_exc().splitlines()
-            LOG.warning("Cannot cleanup volume2\n%s\n%s" %
-                      (exc_info[-1], exc_info[-2]))
+    @classmethod
+    def _delete_volume1(cls):
+        cls.volumes_client.delete_volume(cls.volume1['id'])
+        polling.wait_for_resource_deletion(cls.volumes_client, 'volume',
+                                           cls.volume1['id'])
 
-        try:
-            if hasattr(cls, 'snap'):
-                cls.image_client.delete_image(cls.snap['id'])
-        except:
-            exc_info = traceback.format_exc().splitlines()
-            LOG.warning("Cannot cleanup server snapshot\n%s\n%s" %
-                      (exc_info[-1], exc_info[-2]))
+    @classmethod
+    def _delete_volume2(cls):
+        polling.wait_for_volume_status(cls.volumes_client,
+                                       cls.volume2['id'], 'available')
+        cls.volumes_client.delete_volume(cls.volume2['id'])
+        polling.wait_for_resource_deletion(cls.volumes_client, 'volume',
+                                           cls.volume2['id'])
 
-        try:
-            if hasattr(cls, 'keypairname'):
-                cls.keypairs_client.delete_keypair(cls.keypairname)
-        except:
-            exc_info = traceback.format_exc().splitlines()
-            LOG.warning("Cannot cleanup keypairname\n%s\n%s" %
-                      (exc_info[-1], exc_info[-2]))
+    @classmethod
+    def _delete_server_snapshot(cls):
+        cls.image_client.delete_image(cls.snap['id'])
 
-        try:
-            if hasattr(cls, 'security_group'):
-                cls.security_client.delete_security_group(
-                                                     cls.security_group['id'])
-        except:
-            exc_info = traceback.format_exc().splitlines()
-            LOG.warning("Cannot cleanup security_group\n%s\n%s" %
-                      (exc_info[-1], exc_info[-2]))
+    @classmethod
+    def _delete_keypair(cls):
+        cls.keypairs_client.delete_keypair(cls.keypairname)
+
+    @classmethod
+    def _delete_security_group(cls):
+        cls.security_client.delete_security_group(cls.security_group['id'])
 
+    @classmethod
+    def _delete_server(cls):
         try:
-            if hasattr(cls, 'server'):
-                cls.client.delete_server(cls.server['id'])
+            cls.client.delete_server(cls.server['id'])
         except lib_exc.NotFound:
             pass
-        except:
-            exc_info = traceback.format_exc().splitlines()
-            LOG.warning("Cannot cleanup server\n%s\n%s" %
-                      (exc_info[-1], exc_info[-2]))
-
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except:
-            exc_info = traceback.format_exc().splitlines()
-            LOG.warning("Cannot cleanup file\n%s\n%s" %
-                      (exc_info[-1], exc_info[-2]))
 
+    @classmethod
+    def _delete_snapshot_server(cls):
         try:
-            os.remove(file_path)
-        except:
+            cls.client.delete_server(cls.snapshot_server['id'])
+        except lib_exc.NotFound:
             pass
+
+    @classmethod
+    def resource_cleanup(cls):
+        # Release UserIsolationRun first, it may still wait for the fixture
+        if hasattr(cls, 'publisher'):
+            reason = None if cls.published else "fixture setup failed"
+            try:
+                cls.publisher.close(reason=reason)
+            except Exception as exc:
+                LOG.warning("Cannot cleanup handoff (%s)" % exc)
+
+        if getattr(cls, 'persistent', False):
+            # Kept for the next run, but the server booted from the snapshot
+            parts = cls._parts() & set(['snapshot_server'])
+            if hasattr(cls, 'server'):
+                cls.servers = [s for s in cls.servers
+                               if s['id'] != cls.server['id']]
+        else:
+            parts = cls._parts()
+        cls._delete(parts, 'UserIsolationSetup cleanup')
+
         super(UserIsolationSetup, cls).resource_cleanup()
 
+    @classmethod
+    def _delete(cls, parts, name):
+        """Delete parts (tasks of resource_setup), the failures are logged"""
+        # Reverse dependency graph of what resource_setup has created :
+        # Cinder deletions wait for the detach / the snapshot deletion only,
+        # everything else is deleted at once. All share the same deadline.
+        graph = executor.TaskGraph(name)
+        detached = []
+        if 'attachment' in parts:
+            graph.add('attachment', cls._detach_volume2)
+            detached = ['attachment']
+        if 'vol_snapshot' in parts:
+            graph.add('vol_snapshot', cls._delete_vol_snapshot)
+        if 'volume1' in parts:
+            graph.add('volume1', cls._delete_volume1,
+                      requires=[t for t in ['vol_snapshot']
+                                if t in graph.tasks])
+        if 'volume2' in parts:
+            graph.add('volume2', cls._delete_volume2, requires=detached)
+        if 'server_snapshot' in parts:
+            graph.add('server_snapshot', cls._delete_server_snapshot)
+        if 'keypair' in parts:
+            graph.add('keypair', cls._delete_keypair)
+        if 'security_group' in parts:
+            graph.add('security_group', cls._delete_security_group)
+        if 'server' in parts:
+            graph.add('server', cls._delete_server, requires=detached)
+        if 'snapshot_server' in parts:
+            graph.add('snapshot_server', cls._delete_snapshot_server)
+
+        deadline = time.time() + options.CONF.fgcloud.cleanup_timeout
+        graph.run(deadline=deadline, raise_errors=False)
+        failures = graph.report()
+        if failures:
+            LOG.warning("Incomplete cleanup of %s : %s" %
+                        (name, json.dumps(failures)))
+
     @test.idempotent_id('30d8f7d5-84cc-47e1-9ccd-e694ab86b685')
     def test_wait_for_tests_to_terminate(self):
-        while os.path.exists(file_path):
-            time.sleep(3)
+        self.publisher.wait_done(self.deadline)
 
 # EOF
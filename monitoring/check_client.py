@@ -0,0 +1,130 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Run a check through the check server (monitoring/check_server.py)
+
+Only the standard library is imported, so that the client starts at once.
+It prints the same Nagios output and exits with the same status as the
+subunit.run / ostestr pipelines of check_openstack.sh. A check without a
+reply within --wait seconds is UNKNOWN, its worker stops itself (see
+check_sites.py). With --probe, it only tells whether the server answers :
+check_openstack.sh runs its checks itself when the socket is left over by
+a dead server.
+
+Usage :
+
+    python -m monitoring.check_client -c tempest.conf -t 180 \\
+        --test tempest.api.fgcloud.test_basic_scenario
+"""
+
+import argparse
+import json
+import socket
+import sys
+
+from monitoring import history
+from monitoring import subunit_filter
+
+DEFAULT_SOCKET = '/tmp/tempest_check_server.sock'
+# Default --wait beyond -t, and time left to a stopped worker for its cleanup
+WAIT_MARGIN = 600
+KILL_GRACE = 300
+PROBE_TIMEOUT = 2
+
+
+def request(message, path=DEFAULT_SOCKET, timeout=None):
+    """Send a request to the check server, return its reply"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+        line = sock.makefile('rb').readline()
+    finally:
+        sock.close()
+    if not line:
+        raise IOError("the check server closed the connection")
+    return json.loads(line.decode('utf-8'))
+
+
+def probe(path=DEFAULT_SOCKET, timeout=PROBE_TIMEOUT):
+    """Whether a check server answers on path"""
+    try:
+        return request({'type': 'ping'}, path, timeout).get('type') == 'pong'
+    except (IOError, OSError, ValueError, AttributeError):
+        return False
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Run a check through the check server')
+    parser.add_argument('-c', '--config', default='tempest.conf',
+                        help='Name of the tempest.conf file in config/')
+    parser.add_argument('-t', '--timeout', dest='max_time', type=int,
+                        default=180,
+                        help='Raise a WARNING if the test(s) run longer')
+    parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET,
+                        help='Socket of the check server')
+    parser.add_argument('--wait', type=int,
+                        help='UNKNOWN without a reply within this time '
+                             '(default : -t plus %ds)' % WAIT_MARGIN)
+    parser.add_argument('--probe', action='store_true',
+                        help='Only exit 0 if the check server answers, 1 '
+                             'otherwise')
+    parser.add_argument('--history',
+                        help='Append the values of the run to this history '
+                             'file (see monitoring/history.py)')
+    parser.add_argument('--check', default='default',
+                        help='Name of the check in the history')
+    parser.add_argument('--adaptive', choices=history.ADAPTIVE_MODES,
+                        help='Thresholds of the series without any, from '
+                             'the history of the check')
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument('--test', help='Test id to run')
+    selection.add_argument('--regex', help='Run the tests matching it')
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.probe:
+        return 0 if probe(args.socket) else 1
+    if not (args.test or args.regex):
+        parser.error('one of the arguments --test --regex is required')
+    wait = args.wait or args.max_time + WAIT_MARGIN
+    message = {'type': 'check', 'config': args.config,
+               'max_time': args.max_time, 'history': args.history,
+               'check': args.check, 'adaptive': args.adaptive,
+               'kill_after': wait, 'kill_grace': KILL_GRACE}
+    if args.test:
+        message['test'] = args.test
+    else:
+        message['regex'] = args.regex
+    try:
+        reply = request(message, args.socket, timeout=wait)
+    except (IOError, OSError, ValueError) as exc:
+        print(subunit_filter.format_exit(
+            subunit_filter.STATUS_UNKNOWN,
+            "Check server error : %s" % exc,
+            "exec_time=0s;;;; nb_tests=0;;;; nb_tests_ok=0;;;; "
+            "nb_tests_ko=0;;;; nb_skipped=0;;;;"))
+        return subunit_filter.STATUS_UNKNOWN
+    print(reply['output'])
+    return reply['status']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
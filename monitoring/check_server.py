@@ -0,0 +1,370 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Long running check server, to skip the start up cost of each check
+
+Each check of check_openstack.sh used to start a new interpreter, import
+tempest and its clients, parse tempest.conf and, for a regex, discover all
+the tests. The check server does all this once per tempest.conf :
+
+ * the server itself only imports the standard library. It accepts the
+   requests of monitoring/check_client.py on a Unix socket and hands each
+   one to the zygote of its tempest.conf, started on first use (and started
+   again when the file changes).
+ * a zygote is a process which has parsed its tempest.conf, imported
+   tempest and discovered the tests. It forks a worker per check, so checks
+   run concurrently and none of them sees the state left by another one.
+ * a worker runs the tests with the subunit runner, its stdout and stderr
+   going through monitoring/subunit_filter.py exactly as in the shell
+   pipeline, and sends back the Nagios output and status.
+
+Usage (from the tempest directory, inside the virtual environment, see
+check_server.sh) :
+
+    PYTHONPATH=.. python -m monitoring.check_server
+"""
+
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+from monitoring import check_client
+from monitoring import subunit_filter
+
+# Imported by the zygotes once their tempest.conf is parsed
+PRELOAD = ('tempest.clients', 'tempest.test', 'tempest.api.compute.base',
+           'tempest.scenario.manager', 'subunit.run')
+STARTUP_TIMEOUT = 600
+
+
+def _error(message):
+    """Reply of a check which could not run"""
+    return {'status': subunit_filter.STATUS_UNKNOWN,
+            'output': subunit_filter.format_exit(
+                subunit_filter.STATUS_UNKNOWN, message,
+                "exec_time=0s;;;; nb_tests=0;;;; nb_tests_ok=0;;;; "
+                "nb_tests_ko=0;;;; nb_skipped=0;;;;")}
+
+
+def _send(sock, message):
+    sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+def _receive(sock):
+    line = sock.makefile('rb').readline()
+    if not line:
+        raise IOError("connection closed")
+    return json.loads(line.decode('utf-8'))
+
+
+def _listen(path):
+    if os.path.exists(path):
+        os.remove(path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen(16)
+    return server
+
+
+# Server side
+
+class Zygote(object):
+    """Handle on the zygote process of a tempest.conf"""
+
+    def __init__(self, config_dir, config_name, server_path):
+        self.config = os.path.join(config_dir, config_name)
+        self.path = '%s.%s' % (server_path, config_name)
+        self.mtime = os.path.getmtime(self.config)
+        env = dict(os.environ,
+                   TEMPEST_CONFIG_DIR=os.path.dirname(self.config),
+                   TEMPEST_CONFIG=os.path.basename(self.config))
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'monitoring.check_server',
+             '--zygote', self.path], env=env)
+
+    @property
+    def stale(self):
+        return (self.process.poll() is not None or
+                os.path.getmtime(self.config) != self.mtime)
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+    def _connect(self):
+        # The zygote listens once tempest is loaded
+        deadline = time.time() + STARTUP_TIMEOUT
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                return sock
+            except (IOError, OSError):
+                sock.close()
+                if self.process.poll() is not None:
+                    raise IOError("zygote of %s exited with %d" %
+                                  (self.config, self.process.returncode))
+                if time.time() > deadline:
+                    raise IOError("zygote of %s not ready" % self.config)
+                time.sleep(0.1)
+
+    def check(self, message):
+        sock = self._connect()
+        try:
+            _send(sock, message)
+            return _receive(sock)
+        finally:
+            sock.close()
+
+
+class CheckServer(object):
+
+    def __init__(self, config_dir, path=check_client.DEFAULT_SOCKET):
+        self.config_dir = config_dir
+        self.path = path
+        self.zygotes = {}
+        self.lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def zygote(self, config_name):
+        if os.path.basename(config_name) != config_name:
+            raise ValueError("%s is not a file of %s" %
+                             (config_name, self.config_dir))
+        with self.lock:
+            zygote = self.zygotes.get(config_name)
+            if zygote is None or zygote.stale:
+                if zygote is not None:
+                    zygote.stop()
+                zygote = Zygote(self.config_dir, config_name, self.path)
+                self.zygotes[config_name] = zygote
+            return zygote
+
+    def _handle(self, sock):
+        try:
+            message = _receive(sock)
+            if message.get('type') == 'ping':
+                # check_client.probe()
+                _send(sock, {'type': 'pong'})
+                return
+            try:
+                reply = self.zygote(message['config']).check(message)
+            except (IOError, OSError, ValueError, KeyError) as exc:
+                reply = _error("Check server error : %s" % exc)
+            _send(sock, reply)
+        except (IOError, OSError, ValueError) as exc:
+            sys.stderr.write("Bad check request (%s)\n" % exc)
+        finally:
+            sock.close()
+
+    def serve(self):
+        server = _listen(self.path)
+        server.settimeout(1)
+        try:
+            while not self._stopped.is_set():
+                try:
+                    sock = server.accept()[0]
+                except socket.timeout:
+                    continue
+                sock.settimeout(None)
+                thread = threading.Thread(target=self._handle, args=(sock,))
+                thread.daemon = True
+                thread.start()
+        finally:
+            server.close()
+            os.remove(self.path)
+            for zygote in self.zygotes.values():
+                zygote.stop()
+
+    def stop(self, *args):
+        self._stopped.set()
+
+
+# Zygote side
+
+def discover():
+    """All the tests, as listed by testr for ostestr"""
+    loader = unittest.TestLoader()
+    suite = loader.discover(
+        os.environ.get('OS_TEST_PATH', './tempest/test_discover'),
+        top_level_dir=os.environ.get('OS_TOP_LEVEL', './'))
+    tests = []
+    pending = [suite]
+    while pending:
+        item = pending.pop(0)
+        if isinstance(item, unittest.TestSuite):
+            pending[:0] = list(item)
+        else:
+            tests.append(item)
+    return tests
+
+
+def select(tests, message):
+    if 'test' in message:
+        return unittest.TestLoader().loadTestsFromName(message['test'])
+    # testr filters the listed ids with re.search
+    regex = re.compile(message['regex'])
+    return unittest.TestSuite(t for t in tests if regex.search(t.id()))
+
+
+def run_check(suite, message):
+    """Run suite with stdout and stderr going through the stream filter"""
+    from subunit import run
+
+    read_fd, write_fd = os.pipe()
+    result = subunit_filter.NagiosStreamResult()
+    reader = threading.Thread(
+        target=subunit_filter.read_stream,
+        args=(os.fdopen(read_fd, 'rb'), result))
+    reader.start()
+    result.startTestRun()
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(write_fd, 1)
+    os.dup2(write_fd, 2)
+    os.close(write_fd)
+    stream = os.fdopen(os.dup(1), 'wb')
+    try:
+        run.SubunitTestRunner(stream=stream).run(suite)
+    finally:
+        stream.close()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        reader.join()
+        result.stopTestRun()
+    status, output, perfdata = subunit_filter.report(
+        result, message['max_time'], message.get('history'),
+        message.get('check'), message.get('adaptive'))
+    return {'status': status,
+            'output': subunit_filter.format_exit(status, output, perfdata)}
+
+
+class Terminated(Exception):
+    pass
+
+
+def _terminate(signum, frame):
+    # The test fails and runs its cleanups (see fgcloud/terminate.py)
+    raise Terminated("Check stopped by signal %d" % signum)
+
+
+def _stop_after(delay, grace):
+    """SIGTERM the worker after delay seconds, SIGKILL it grace later"""
+    for signum, when in ((signal.SIGTERM, delay),
+                         (signal.SIGKILL, delay + grace)):
+        timer = threading.Timer(when, os.kill, (os.getpid(), signum))
+        timer.daemon = True
+        timer.start()
+
+
+def _worker(sock, tests):
+    # Tests run subprocesses (ping), they must be able to wait for them
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        message = _receive(sock)
+        # The client of check_sites.py stops waiting after kill_after
+        if message.get('kill_after'):
+            _stop_after(message['kill_after'], message.get('kill_grace', 0))
+        try:
+            reply = run_check(select(tests, message), message)
+        except Exception as exc:
+            reply = _error("Check error : %s" % exc)
+        _send(sock, reply)
+    finally:
+        sock.close()
+
+
+def zygote(path):
+    """Load tempest for the tempest.conf of the environment, fork checks"""
+    from tempest import config
+
+    # Parsed once, the workers inherit it
+    config.CONF.compute
+    for name in PRELOAD:
+        __import__(name)
+    tests = discover()
+
+    server = _listen(path)
+    server.settimeout(1)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    try:
+        while True:
+            try:
+                sock = server.accept()[0]
+            except socket.timeout:
+                sock = None
+            if sock is not None:
+                sock.settimeout(None)
+                if os.fork() == 0:
+                    server.close()
+                    try:
+                        _worker(sock, tests)
+                    finally:
+                        os._exit(0)
+                sock.close()
+            # Reap the workers which are over
+            try:
+                while os.waitpid(-1, os.WNOHANG)[0]:
+                    pass
+            except OSError:
+                pass
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Serve the checks of check_openstack.sh')
+    parser.add_argument('--config-dir',
+                        default=os.path.join(os.path.dirname(os.path.dirname(
+                            os.path.abspath(__file__))), 'config'),
+                        help='Directory of the tempest.conf files')
+    parser.add_argument('-s', '--socket', default=check_client.DEFAULT_SOCKET,
+                        help='Socket of the check server')
+    parser.add_argument('--zygote', metavar='SOCKET',
+                        help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.zygote:
+        zygote(args.zygote)
+        return 0
+    server = CheckServer(args.config_dir, args.socket)
+    signal.signal(signal.SIGTERM, server.stop)
+    signal.signal(signal.SIGINT, server.stop)
+    server.serve()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
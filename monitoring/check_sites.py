@@ -0,0 +1,317 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Run the same check on several sites (tempest.conf files) at once
+
+Each site is a tempest.conf file of config/, named after it (tempest-lyon.conf
+is the site lyon). The checks of all the sites run concurrently, at most
+--workers at a time, each one in its own process : a worker forked by the
+check server when it is running (see check_server.py), check_openstack.sh
+otherwise. A site which does not answer within --site-timeout seconds is
+UNKNOWN : its check is stopped with SIGTERM, so that the fgcloud tests delete
+what they have created (see fgcloud/terminate.py), and killed if it still
+runs --kill-grace seconds later. A worker of the check server stops itself
+the same way.
+
+The result is either aggregated (the worst status, a line per site and the
+perfdata series of all the sites, prefixed by the site name) or given per
+site, each one with its own status line, and optionally submitted as a
+passive check result to the Nagios/Icinga command file.
+
+Only the standard library is imported. Usage (from the top directory) :
+
+    python -m monitoring.check_sites -c 'tempest-*.conf' -t 180 \\
+        --test tempest.api.fgcloud.test_basic_scenario
+"""
+
+import argparse
+import fnmatch
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from monitoring import check_client
+from monitoring import subunit_filter
+
+DIRNAME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(DIRNAME, 'config')
+CHECK_CMD = os.path.join(DIRNAME, 'check_openstack.sh')
+EXIT_LINE = re.compile(r'^Status : exit (\d) \((\w+)\) \| ?(.*)$')
+# Order of the statuses in an aggregated result
+SEVERITY = (subunit_filter.STATUS_OK, subunit_filter.STATUS_DEPENDENT,
+            subunit_filter.STATUS_UNKNOWN, subunit_filter.STATUS_WARNING,
+            subunit_filter.STATUS_CRITICAL)
+
+
+def site_name(config):
+    """tempest-lyon.conf is the site lyon"""
+    name = config[:-len('.conf')] if config.endswith('.conf') else config
+    if name.startswith('tempest-'):
+        name = name[len('tempest-'):]
+    return name
+
+
+def find_configs(patterns, config_dir=CONFIG_DIR):
+    """tempest.conf files of config_dir matching the patterns, in order"""
+    names = sorted(os.listdir(config_dir))
+    configs = []
+    for pattern in patterns:
+        for name in fnmatch.filter(names, pattern):
+            if name not in configs:
+                configs.append(name)
+    return configs
+
+
+class Site(object):
+    """Result of the check of a site"""
+
+    def __init__(self, config):
+        self.config = config
+        self.name = site_name(config)
+        self.status = subunit_filter.STATUS_UNKNOWN
+        self.output = ''
+        self.perfdata = ''
+        self.elapsed = 0
+
+    @property
+    def header(self):
+        return self.output.split('\n', 1)[0]
+
+    @property
+    def body(self):
+        """Output without its header and Status line"""
+        lines = self.output.split('\n')[1:]
+        return '\n'.join(line for line in lines if not EXIT_LINE.match(line))
+
+    def parse(self, status, text):
+        """Status and perfdata of the output of a check"""
+        self.status = status
+        self.output = text.rstrip('\n')
+        for line in reversed(self.output.split('\n')):
+            match = EXIT_LINE.match(line)
+            if match:
+                self.status = int(match.group(1))
+                self.perfdata = match.group(3)
+                break
+
+    def fail(self, message):
+        self.status = subunit_filter.STATUS_UNKNOWN
+        self.output = '%s : %s' % (
+            subunit_filter.STATUS_ALL[self.status], message)
+        self.perfdata = ''
+
+    def report(self):
+        """Nagios output of the site alone"""
+        output = '\n'.join(part for part in (self.header, self.body) if part)
+        return subunit_filter.format_exit(self.status, output,
+                                          self.perfdata)
+
+    def labelled_perfdata(self):
+        """The perfdata series of the site, labels prefixed by its name"""
+        return ' '.join('%s_%s' % (self.name, serie)
+                        for serie in self.perfdata.split())
+
+
+def _run_server(site, args, selection):
+    message = {'type': 'check', 'config': site.config,
+               'max_time': args.max_time, 'kill_after': args.site_timeout,
+               'kill_grace': args.kill_grace}
+    message.update(selection)
+    reply = check_client.request(message, args.socket,
+                                 timeout=args.site_timeout)
+    site.parse(reply['status'], reply['output'])
+
+
+def _kill(pid, grace, over):
+    """SIGTERM the session pid, SIGKILL it unless over is set within grace"""
+    try:
+        os.killpg(pid, signal.SIGTERM)
+        # Time for the tests to run their cleanups
+        if not over.wait(grace):
+            os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        # Over meanwhile
+        pass
+
+
+def _run_script(site, args, selection):
+    command = [CHECK_CMD, '-c', site.config, '-t', str(args.max_time)]
+    if 'regex' in selection:
+        command += ['-e', selection['regex']]
+    else:
+        command += ['--', selection['test']]
+    # A session of its own, to kill the whole pipeline on timeout
+    process = subprocess.Popen(command, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT,
+                               preexec_fn=os.setsid)
+    over = threading.Event()
+    timer = threading.Timer(args.site_timeout, _kill,
+                            (process.pid, args.kill_grace, over))
+    timer.daemon = True
+    timer.start()
+    try:
+        output = process.communicate()[0]
+    finally:
+        over.set()
+        timer.cancel()
+    if process.returncode < 0:
+        raise IOError('no result within %ds' % args.site_timeout)
+    site.parse(process.returncode, output.decode('utf-8', 'replace'))
+
+
+def run_site(site, args, selection):
+    start = time.time()
+    try:
+        if check_client.probe(args.socket):
+            _run_server(site, args, selection)
+        else:
+            _run_script(site, args, selection)
+    except Exception as exc:
+        site.fail('%s check error : %s' % (site.name, exc))
+    site.elapsed = time.time() - start
+
+
+def run_sites(sites, args, selection):
+    """Run the checks of the sites, at most args.workers at a time"""
+    slots = threading.Semaphore(args.workers)
+
+    def worker(site):
+        try:
+            run_site(site, args, selection)
+        finally:
+            slots.release()
+
+    threads = []
+    for site in sites:
+        slots.acquire()
+        thread = threading.Thread(target=worker, args=(site,))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+
+def worst(statuses):
+    """CRITICAL, then WARNING, then UNKNOWN..."""
+    return max(statuses, key=SEVERITY.index)
+
+
+def aggregate(sites):
+    """(status, output, perfdata) of all the sites"""
+    status = worst(site.status for site in sites)
+    counts = dict((name, 0) for name in subunit_filter.STATUS_ALL)
+    for site in sites:
+        counts[subunit_filter.STATUS_ALL[site.status]] += 1
+    out = ['%s : nb_sites=%d nb_sites_ok=%d nb_sites_warning=%d '
+           'nb_sites_critical=%d nb_sites_unknown=%d' % (
+               subunit_filter.STATUS_ALL[status], len(sites), counts['OK'],
+               counts['WARNING'], counts['CRITICAL'], counts['UNKNOWN'])]
+    for site in sites:
+        out.append('[%s] %s (%.0fs)' % (site.name, site.header, site.elapsed))
+    for site in sites:
+        if site.status != subunit_filter.STATUS_OK and site.body:
+            out.append('-------------- %s --------------' % site.name)
+            out.append(site.body)
+    perfdata = ['nb_sites=%d;;;;' % len(sites),
+                'nb_sites_ko=%d;;;;' % (len(sites) - counts['OK'])]
+    perfdata.extend(site.labelled_perfdata() for site in sites
+                    if site.perfdata)
+    return status, '\n'.join(out), ' '.join(perfdata)
+
+
+def submit(command_file, sites, service):
+    """Passive check results of the sites (host = site name)"""
+    now = int(time.time())
+    with open(command_file, 'a') as commands:
+        for site in sites:
+            output = site.header
+            if site.perfdata:
+                output += '|' + site.perfdata
+            commands.write('[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n'
+                           % (now, site.name, service, site.status,
+                              output.replace('\n', ' ')))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Run a check on several sites at once')
+    parser.add_argument('-c', '--config', action='append', required=True,
+                        help='tempest.conf file(s) of config/, shell '
+                             'patterns allowed (repeat for more)')
+    parser.add_argument('-t', '--timeout', dest='max_time', type=int,
+                        default=180,
+                        help='Raise a WARNING if the test(s) of a site run '
+                             'longer')
+    parser.add_argument('--site-timeout', type=int, default=900,
+                        help='A site is UNKNOWN without a result within '
+                             'this time')
+    parser.add_argument('--kill-grace', type=int, default=300,
+                        help='Seconds left to a stopped check to delete its '
+                             'resources before it is killed (default : 300, '
+                             '[fgcloud]cleanup_timeout)')
+    parser.add_argument('-w', '--workers', type=int, default=16,
+                        help='Number of sites checked at the same time')
+    parser.add_argument('--per-site', action='store_true',
+                        help='One result per site instead of an aggregated '
+                             'one')
+    parser.add_argument('--command-file',
+                        help='Submit the result of each site as a passive '
+                             'check result to this Nagios/Icinga command '
+                             'file')
+    parser.add_argument('--service', default='tempest',
+                        help='Service of the passive check results')
+    parser.add_argument('-s', '--socket', default=check_client.DEFAULT_SOCKET,
+                        help='Socket of the check server')
+    selection = parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument('--test', help='Test id to run')
+    selection.add_argument('--regex', help='Run the tests matching it')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    selection = ({'test': args.test} if args.test else
+                 {'regex': args.regex})
+    sites = [Site(config) for config in find_configs(args.config)]
+    if not sites:
+        print(subunit_filter.format_exit(
+            subunit_filter.STATUS_UNKNOWN,
+            "No tempest.conf file matches %s" % ' '.join(args.config),
+            'nb_sites=0;;;;'))
+        return subunit_filter.STATUS_UNKNOWN
+
+    run_sites(sites, args, selection)
+    if args.command_file:
+        submit(args.command_file, sites, args.service)
+
+    if args.per_site:
+        for site in sites:
+            print('[%s]' % site.name)
+            print(site.report())
+            print('')
+        return worst(site.status for site in sites)
+
+    status, output, perfdata = aggregate(sites)
+    print(subunit_filter.format_exit(status, output, perfdata))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""History of the perfdata of the checks, and thresholds derived from it
+
+Each run of a check appends its values to a SQLite file : exec_time, the
+test counters, the perfdata series of the fgcloud tests (but the ones
+measured before the run, with an age) and the duration of each test
+(labelled test:<test id>). The samples of the last RAW_DAYS days
+are kept as they are, indexed by (check, label, time); older ones are
+downsampled to hourly rows (count, sum, min, max), kept HOURLY_DAYS days,
+so that months of 1-minute checks stay small and quick to query.
+
+With an adaptive mode, the WARNING / CRITICAL thresholds of the series
+which have none in tempest.conf (and of exec_time) come from the samples of
+the last WINDOW_DAYS days, as soon as there are MIN_SAMPLES of them :
+
+ * percentile : WARNING above the p95, CRITICAL above the p99
+ * mad : WARNING above the median + 3 MAD (median absolute deviation),
+   CRITICAL above the median + 5 MAD
+
+In both modes, the thresholds are at least 3 and 5 times the MIN_SPREAD
+of the median above it, so that a steady series does not get thresholds
+equal to its value.
+
+The current run is recorded after its thresholds are computed, so that an
+outlier is not part of its own baseline.
+
+Only the standard library is imported (see subunit_filter.py).
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+RAW_DAYS = 8
+HOURLY_DAYS = 400
+WINDOW_DAYS = 7
+MIN_SAMPLES = 30
+PERCENTILES = (95, 99)
+MAD_FACTORS = (3, 5)
+# The MAD of a steady series is 0 : a spread of at least 5% of the median,
+# and of 1 (a second for most series, exec_time is rounded to it) for a
+# median of 0, keeps a tiny jitter from raising a WARNING
+MIN_SPREAD = 0.05
+MIN_ABS_SPREAD = 1
+ADAPTIVE_MODES = ('percentile', 'mad')
+DAY = 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    check_name TEXT NOT NULL,
+    label TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    value REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS samples_by_label
+    ON samples (check_name, label, ts);
+CREATE INDEX IF NOT EXISTS samples_by_ts ON samples (ts);
+CREATE TABLE IF NOT EXISTS hourly (
+    check_name TEXT NOT NULL,
+    label TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    minimum REAL NOT NULL,
+    maximum REAL NOT NULL,
+    PRIMARY KEY (check_name, label, hour));
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL);
+"""
+
+
+def percentile(values, rank):
+    """Linear interpolation of the rank-th percentile of sorted values"""
+    if not values:
+        return None
+    position = (len(values) - 1) * rank / 100.0
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def median(values):
+    return percentile(sorted(values), 50)
+
+
+def run_values(result):
+    """[(label, value)] of a NagiosStreamResult (see subunit_filter.py)"""
+    counts = result.counts
+    values = [('exec_time', int(result.elapsed)),
+              ('nb_tests', result.nb_tests),
+              ('nb_tests_ok', counts['success'] + counts['xfail']),
+              ('nb_tests_ko', counts['uxsuccess'] + counts['fail']),
+              ('nb_skipped', counts['skip'])]
+    for serie in result.perfdata.values():
+        # A value measured before the run may be reported by several runs
+        if (isinstance(serie.get('value'), (int, float)) and
+                serie.get('age') is None):
+            values.append((serie['label'], serie['value']))
+    for test_id, duration in sorted(result.durations.items()):
+        values.append(('test:%s' % test_id, duration))
+    return values
+
+
+class History(object):
+
+    def __init__(self, path, raw_days=RAW_DAYS, hourly_days=HOURLY_DAYS):
+        self.path = path
+        self.raw_days = raw_days
+        self.hourly_days = hourly_days
+        # Concurrent checks wait for each other's writes
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def record(self, check, values, now=None):
+        """Append the (label, value) of a run, downsample once an hour"""
+        now = int(now if now is not None else time.time())
+        with self.db:
+            self.db.executemany(
+                'INSERT INTO samples VALUES (?, ?, ?, ?)',
+                [(check, label, now, float(value))
+                 for label, value in values])
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key = 'downsampled'").fetchone()
+        if row is None or int(row[0]) < now - 3600:
+            self.downsample(now)
+
+    def downsample(self, now=None):
+        """Roll the samples older than raw_days into hourly rows"""
+        now = int(now if now is not None else time.time())
+        # Whole hours only : samples are never recorded in the past, so an
+        # hour is rolled once, with all its samples
+        limit = (now - self.raw_days * DAY) // 3600 * 3600
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO hourly '
+                'SELECT check_name, label, ts / 3600 * 3600, COUNT(*), '
+                '       TOTAL(value), MIN(value), MAX(value) '
+                'FROM samples WHERE ts < ? '
+                'GROUP BY check_name, label, ts / 3600', (limit,))
+            self.db.execute('DELETE FROM samples WHERE ts < ?', (limit,))
+            self.db.execute('DELETE FROM hourly WHERE hour < ?',
+                            (now - self.hourly_days * DAY,))
+            self.db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('downsampled', ?)",
+                (str(now),))
+
+    def values(self, check, label, since):
+        """Sorted values of label since the given time"""
+        return [row[0] for row in self.db.execute(
+            'SELECT value FROM samples WHERE check_name = ? AND label = ? '
+            'AND ts >= ? ORDER BY value', (check, label, since))]
+
+    def hourly(self, check, label, since):
+        """[(hour, count, mean, min, max)] of the downsampled samples"""
+        return [(hour, count, total / count, minimum, maximum)
+                for hour, count, total, minimum, maximum in self.db.execute(
+                    'SELECT hour, count, total, minimum, maximum '
+                    'FROM hourly WHERE check_name = ? AND label = ? '
+                    'AND hour >= ? ORDER BY hour', (check, label, since))]
+
+    def thresholds(self, check, labels, mode, now=None,
+                   window_days=WINDOW_DAYS, min_samples=MIN_SAMPLES):
+        """{label: (warning, critical)} from the recent samples of labels"""
+        now = int(now if now is not None else time.time())
+        since = now - window_days * DAY
+        thresholds = {}
+        for label in labels:
+            values = self.values(check, label, since)
+            if len(values) < min_samples:
+                continue
+            middle = percentile(values, 50)
+            spread = max(abs(middle) * MIN_SPREAD, MIN_ABS_SPREAD)
+            if mode == 'percentile':
+                limits = [percentile(values, rank) for rank in PERCENTILES]
+            else:
+                mad = median([abs(value - middle) for value in values])
+                limits = [middle + factor * mad for factor in MAD_FACTORS]
+            thresholds[label] = tuple(
+                max(limit, middle + factor * spread)
+                for limit, factor in zip(limits, MAD_FACTORS))
+        return thresholds
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Query the perfdata history of the checks')
+    parser.add_argument('path', help='History file (SQLite)')
+    parser.add_argument('check', help='Name of the check')
+    parser.add_argument('labels', nargs='+', help='Labels of the series')
+    parser.add_argument('--mode', choices=ADAPTIVE_MODES, default='mad',
+                        help='Adaptive threshold mode')
+    parser.add_argument('--days', type=int, default=WINDOW_DAYS,
+                        help='Length of the window (in days)')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if not os.path.exists(args.path):
+        sys.stderr.write('%s does not exist\n' % args.path)
+        return 1
+    history = History(args.path)
+    since = int(time.time()) - args.days * DAY
+    thresholds = history.thresholds(args.check, args.labels, args.mode,
+                                    window_days=args.days)
+    report = {}
+    for label in args.labels:
+        values = history.values(args.check, label, since)
+        report[label] = {'samples': len(values),
+                         'median': percentile(values, 50),
+                         'p95': percentile(values, 95),
+                         'p99': percentile(values, 99),
+                         'thresholds': thresholds.get(label)}
+    history.close()
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,381 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Run the checks in the background, serve their last result at once
+
+A check (check_openstack.sh, check_isolation.sh, check_sites.sh... with its
+arguments) may run longer than the check interval of Icinga. Runs then
+overlap and compete for the accounts of accounts.yaml, and two isolation
+checks of the same site meet on the same handoff socket. Here, a check is
+identified by its command line, but for the value of its -t / --timeout
+option (a WARNING threshold, the same check whatever its value), and :
+
+ * run : runs it, unless a run of the same command is already in flight
+   (an exclusive flock on <state dir>/<check>.lock, released even when the
+   run is killed), and stores its Nagios output, exit status and time in
+   <state dir>/<check>.json. A run still in flight after --run-timeout
+   seconds gets SIGTERM, so that its tests delete their resources, SIGKILL
+   --kill-grace seconds later, and is stored as UNKNOWN.
+ * daemon : runs the checks of a schedule file, each one every <interval>
+   seconds, in the background. A line of the file is an interval and a
+   command, run from the top directory :
+
+       # interval (s)  command
+       60    ./check_openstack.sh -- tempest.api.fgcloud.test_api_health
+       900   ./check_openstack.sh -- tempest.api.fgcloud.test_basic_scenario
+       1800  ./check_isolation.sh -a tempest-1.conf -b tempest-2.conf
+
+ * result : prints the last stored result and exits with its status, in a
+   few milliseconds whatever the check costs. A result older than
+   --max-age seconds, or no result at all, is UNKNOWN. With --every, it
+   starts a run in the background when the result is older than that and
+   none is in flight, so that no daemon is needed.
+
+Only the standard library is imported. Usage (from the top directory) :
+
+    python -m monitoring.scheduler daemon -f config/schedule.txt
+    python -m monitoring.scheduler result --max-age 1800 -- \\
+        ./check_openstack.sh -t 180 -- tempest.api.fgcloud.test_basic_scenario
+"""
+
+import argparse
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from monitoring import check_sites
+from monitoring import subunit_filter
+
+DIRNAME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATE_DIR = '/tmp/tempest_checks'
+RUN_TIMEOUT = 900
+KILL_GRACE = 300
+NO_PERFDATA = ("exec_time=0s;;;; nb_tests=0;;;; nb_tests_ok=0;;;; "
+               "nb_tests_ko=0;;;; nb_skipped=0;;;;")
+
+
+def _selection(command):
+    """command without its -t / --timeout option, up to a --"""
+    selection = []
+    arguments = iter(command)
+    for argument in arguments:
+        if argument == '--':
+            selection.append(argument)
+            selection.extend(arguments)
+        elif argument in ('-t', '--timeout'):
+            next(arguments, None)
+        elif not (argument.startswith('--timeout=') or
+                  argument.startswith('-t') and argument[:2] != '--'):
+            selection.append(argument)
+    return selection
+
+
+def check_name(command):
+    """Name of the state files of a command line"""
+    digest = hashlib.sha1(
+        '\0'.join(_selection(command)).encode('utf-8')).hexdigest()
+    return '%s-%s' % (os.path.basename(command[0]), digest[:16])
+
+
+def _timestamp(value):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(value))
+
+
+class Check(object):
+    """State of a check command in the state directory"""
+
+    def __init__(self, command, state_dir=STATE_DIR, name=None):
+        self.command = list(command)
+        self.name = name or check_name(self.command)
+        self.result_path = os.path.join(state_dir, self.name + '.json')
+        self.lock_path = os.path.join(state_dir, self.name + '.lock')
+        if not os.path.isdir(state_dir):
+            try:
+                os.makedirs(state_dir, 0o700)
+            except OSError as exc:
+                # Created meanwhile by another check
+                if exc.errno != errno.EEXIST:
+                    raise
+
+    def _lock(self, mode):
+        """Open file of the lock, None when a run holds it"""
+        lock = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock, mode | fcntl.LOCK_NB)
+        except (IOError, OSError) as exc:
+            lock.close()
+            if exc.errno in (errno.EAGAIN, errno.EACCES):
+                return None
+            raise
+        return lock
+
+    def in_flight(self):
+        """Start time of the run in flight, None without any"""
+        lock = self._lock(fcntl.LOCK_SH)
+        if lock is not None:
+            lock.close()
+            return None
+        try:
+            with open(self.lock_path) as lock:
+                return json.load(lock)['started']
+        except (IOError, OSError, ValueError, KeyError):
+            # Held, but not written yet
+            return time.time()
+
+    def load(self):
+        """Last stored result, None without any"""
+        try:
+            with open(self.result_path) as result:
+                return json.load(result)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _store(self, result):
+        # Renamed, so that a client never reads half a result
+        tmp_path = '%s.%d.tmp' % (self.result_path, os.getpid())
+        with open(tmp_path, 'w') as tmp:
+            json.dump(result, tmp)
+        os.rename(tmp_path, self.result_path)
+
+    def _execute(self, timeout, grace):
+        # A session of its own, to stop the whole pipeline on timeout
+        process = subprocess.Popen(self.command, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, cwd=DIRNAME,
+                                   preexec_fn=os.setsid)
+        over = threading.Event()
+        timer = threading.Timer(timeout, check_sites._kill,
+                                (process.pid, grace, over))
+        timer.daemon = True
+        timer.start()
+        try:
+            output = process.communicate()[0]
+        finally:
+            over.set()
+            timer.cancel()
+        if process.returncode < 0:
+            return subunit_filter.STATUS_UNKNOWN, subunit_filter.format_exit(
+                subunit_filter.STATUS_UNKNOWN,
+                "UNKNOWN : no result within %ds" % timeout, NO_PERFDATA)
+        return process.returncode, output.decode('utf-8', 'replace')
+
+    def run(self, timeout=RUN_TIMEOUT, grace=KILL_GRACE):
+        """Run the check and store its result, None if one is in flight"""
+        lock = self._lock(fcntl.LOCK_EX)
+        if lock is None:
+            return None
+        try:
+            started = time.time()
+            lock.seek(0)
+            lock.truncate()
+            json.dump({'started': started, 'pid': os.getpid()}, lock)
+            lock.flush()
+            try:
+                status, output = self._execute(timeout, grace)
+            except (IOError, OSError) as exc:
+                status = subunit_filter.STATUS_UNKNOWN
+                output = subunit_filter.format_exit(
+                    status, "UNKNOWN : cannot run %s (%s)" % (
+                        self.command[0], exc), NO_PERFDATA)
+            result = {'command': self.command, 'status': status,
+                      'output': output.rstrip('\n'), 'started': started,
+                      'finished': time.time()}
+            self._store(result)
+            return result
+        finally:
+            lock.close()
+
+    def spawn(self, state_dir, timeout=RUN_TIMEOUT, grace=KILL_GRACE):
+        """Run the check in a detached process"""
+        with open(os.devnull, 'r+') as devnull:
+            subprocess.Popen(
+                [sys.executable, '-m', 'monitoring.scheduler', 'run',
+                 '--state-dir', state_dir, '--name', self.name,
+                 '--run-timeout', str(timeout), '--kill-grace', str(grace),
+                 '--'] + self.command,
+                stdin=devnull, stdout=devnull, stderr=devnull, cwd=DIRNAME,
+                env=dict(os.environ, PYTHONPATH=DIRNAME),
+                preexec_fn=os.setsid, close_fds=True)
+
+
+def cached(check, max_age, now=None):
+    """(status, Nagios output) of the last result of a check"""
+    now = now or time.time()
+    result = check.load()
+    started = check.in_flight()
+    in_flight = ('a run is in flight since %s' % _timestamp(started)
+                 if started else 'no run in flight')
+    if result is None:
+        return subunit_filter.STATUS_UNKNOWN, subunit_filter.format_exit(
+            subunit_filter.STATUS_UNKNOWN,
+            "UNKNOWN : no result yet (%s)" % in_flight, NO_PERFDATA)
+    age = now - result['finished']
+    if age > max_age:
+        # Its perfdata would be recorded twice
+        return subunit_filter.STATUS_UNKNOWN, subunit_filter.format_exit(
+            subunit_filter.STATUS_UNKNOWN,
+            "UNKNOWN : the last result (%s, %s) is %ds old, more than %ds "
+            "(%s)" % (subunit_filter.STATUS_ALL[result['status']],
+                      _timestamp(result['finished']), age, max_age,
+                      in_flight), NO_PERFDATA)
+    site = check_sites.Site(check.name)
+    site.parse(result['status'], result['output'])
+    output = '\n'.join(part for part in (
+        site.header, site.body, 'Result of %s (%ds ago)' % (
+            _timestamp(result['finished']), age)) if part)
+    perfdata = ('%s check_age=%ds;;;;' % (site.perfdata, age)).strip()
+    return site.status, subunit_filter.format_exit(site.status, output,
+                                                   perfdata)
+
+
+def read_schedule(path):
+    """[(interval, command)] of a schedule file"""
+    schedule = []
+    with open(path) as lines:
+        for number, line in enumerate(lines, 1):
+            fields = shlex.split(line, comments=True)
+            if not fields:
+                continue
+            try:
+                interval = int(fields[0])
+            except ValueError:
+                interval = 0
+            if interval <= 0 or len(fields) < 2:
+                raise ValueError('%s:%d: expected "<interval> <command>"' % (
+                    path, number))
+            schedule.append((interval, fields[1:]))
+    return schedule
+
+
+class Scheduler(object):
+    """Run each check of a schedule every <interval> seconds"""
+
+    def __init__(self, schedule, state_dir=STATE_DIR, timeout=RUN_TIMEOUT,
+                 grace=KILL_GRACE):
+        self.timeout = timeout
+        self.grace = grace
+        # Spread the first runs over a few seconds
+        start = time.time()
+        self.checks = [[start + index, interval, Check(command, state_dir)]
+                       for index, (interval, command) in enumerate(schedule)]
+        self._stopped = threading.Event()
+
+    def _run(self, check):
+        result = check.run(self.timeout, self.grace)
+        if result is None:
+            sys.stderr.write('%s : skipped, a run is in flight\n' % (
+                ' '.join(check.command)))
+        else:
+            sys.stderr.write('%s : %s in %.0fs\n' % (
+                ' '.join(check.command),
+                subunit_filter.STATUS_ALL[result['status']],
+                result['finished'] - result['started']))
+        sys.stderr.flush()
+
+    def serve(self):
+        threads = {}
+        while not self._stopped.wait(1):
+            now = time.time()
+            for entry in self.checks:
+                due, interval, check = entry
+                thread = threads.get(check.name)
+                if now < due or (thread is not None and thread.is_alive()):
+                    continue
+                # The cadence does not drift with the length of the runs
+                entry[0] = max(due + interval, now)
+                thread = threading.Thread(target=self._run, args=(check,))
+                thread.daemon = True
+                thread.start()
+                threads[check.name] = thread
+        # The checks in flight are stored before the daemon exits
+        for thread in threads.values():
+            thread.join()
+
+    def stop(self, *args):
+        self._stopped.set()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Run the checks in the background, serve their last '
+                    'result at once',
+        usage='%(prog)s [OPTION] ... {run,daemon,result} [-- COMMAND ...]')
+    parser.add_argument('mode', choices=('run', 'daemon', 'result'))
+    parser.add_argument('-f', '--schedule',
+                        default=os.path.join(DIRNAME, 'config',
+                                             'schedule.txt'),
+                        help='Schedule file of the daemon')
+    parser.add_argument('-d', '--state-dir', default=STATE_DIR,
+                        help='Directory of the results and of the locks')
+    parser.add_argument('--name', help=argparse.SUPPRESS)
+    parser.add_argument('--run-timeout', type=int, default=RUN_TIMEOUT,
+                        help='A run is stopped and UNKNOWN after this time')
+    parser.add_argument('--kill-grace', type=int, default=KILL_GRACE,
+                        help='Seconds left to a stopped run to delete its '
+                             'resources before it is killed')
+    parser.add_argument('--max-age', type=int, default=3600,
+                        help='An older result is UNKNOWN')
+    parser.add_argument('--every', type=int,
+                        help='Start a run in the background when the result '
+                             'is older than this (result mode)')
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # The check command has options of its own, and may have a -- too
+    command = []
+    if '--' in argv:
+        command = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = get_parser().parse_args(argv)
+    if args.mode == 'daemon':
+        scheduler = Scheduler(read_schedule(args.schedule), args.state_dir,
+                              args.run_timeout, args.kill_grace)
+        signal.signal(signal.SIGTERM, scheduler.stop)
+        signal.signal(signal.SIGINT, scheduler.stop)
+        scheduler.serve()
+        return 0
+    if not command:
+        get_parser().error('a check command (after --) is needed in %s mode'
+                           % args.mode)
+
+    check = Check(command, args.state_dir, args.name)
+    if args.mode == 'run':
+        result = check.run(args.run_timeout, args.kill_grace)
+        if result is None:
+            sys.stderr.write('A run is already in flight\n')
+            return subunit_filter.STATUS_UNKNOWN
+        print(result['output'])
+        return result['status']
+
+    if args.every is not None and check.in_flight() is None:
+        result = check.load()
+        if result is None or time.time() - result['finished'] >= args.every:
+            check.spawn(args.state_dir, args.run_timeout, args.kill_grace)
+    status, output = cached(check, args.max_age)
+    print(output)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,643 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Filter a raw subunit v2 stream into a Nagios/Icinga result.
+
+This replaces the subunit-trace | awk pipeline of check_openstack.sh
+(getPerfData). The stream is read once, counters, skipped tests and failure
+traces are built while it flows, and only bounded buffers are kept in memory.
+
+The packets are decoded here rather than with subunit.ByteStreamToStreamResult
+which reads non subunit content (our stderr logs) one byte at a time.
+
+Usage (from the tempest directory, inside the virtual environment) :
+
+    python -m subunit.run <test.id> 2>&1 | \\
+        python -m monitoring.subunit_filter -t 180
+
+With --history, the values of the run are appended to the history of the
+check, which --adaptive turns into thresholds (see history.py).
+"""
+
+import argparse
+import collections
+import json
+import numbers
+import os
+import re
+import signal
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+
+from monitoring import history
+
+STATUS_OK = 0
+STATUS_WARNING = 1
+STATUS_CRITICAL = 2
+STATUS_UNKNOWN = 3
+STATUS_DEPENDENT = 4
+STATUS_ALL = ('OK', 'WARNING', 'CRITICAL', 'UNKNOWN', 'DEPENDENT')
+
+NO_TEST = "The test run didn't actually run any tests"
+FINAL_STATES = ('success', 'xfail', 'uxsuccess', 'fail', 'skip')
+
+# Subunit v2 packet format, see python-subunit/subunit/v2.py
+SIGNATURE = b'\xb3'
+FLAG_TEST_ID = 0x0800
+FLAG_ROUTE_CODE = 0x0400
+FLAG_TIMESTAMP = 0x0200
+FLAG_TAGS = 0x0080
+FLAG_FILE_CONTENT = 0x0040
+FLAG_MIME_TYPE = 0x0020
+FLAG_EOF = 0x0010
+STATUS_LOOKUP = (None, 'exists', 'inprogress', 'success', 'uxsuccess',
+                 'skip', 'fail', 'xfail')
+READ_SIZE = 65536
+
+# Same patterns as the former awk filters
+LOG_LINE = re.compile(r'^2[0-9][0-9][0-9]-')
+LOG_ANYWHERE = re.compile(r'2[0-9][0-9][0-9]-')
+
+# JSON detail holding extra perfdata series, see fgcloud/perfdata.py. It
+# is not bounded by max_trace_bytes, but by this (a few KB in practice)
+PERFDATA_DETAIL = 'fgcloud-perfdata'
+MAX_PERFDATA_BYTES = 1048576
+# str and unicode with Python 2, without six
+STRING_TYPES = (type(u''), type(''))
+
+# ostestr prints its discovery command before the stream, see
+# https://bugs.launchpad.net/os-testr/+bug/1506215
+DISCOVERY_LINE = re.compile(r'^running=')
+DISCOVERY_LINES = 5
+
+
+class Bounded(object):
+    """Append-only text buffer that keeps at most max_bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.chunks = []
+        self.size = 0
+        self.dropped = 0
+
+    def write(self, data):
+        room = self.max_bytes - self.size
+        if room > 0:
+            self.chunks.append(data[:room])
+            self.size += len(self.chunks[-1])
+        self.dropped += max(0, len(data) - max(room, 0))
+
+    def text(self):
+        data = b''.join(self.chunks).decode('utf-8', 'replace')
+        if self.dropped:
+            data += '\n[... %d bytes truncated ...]' % self.dropped
+        return data
+
+
+class TestRecord(object):
+    """What we keep about a single test while the stream flows."""
+
+    def __init__(self, test_id):
+        self.test_id = test_id
+        self.status = None
+        self.tags = set()
+        self.start = None
+        self.stop = None
+        self.details = collections.OrderedDict()
+
+    @property
+    def worker(self):
+        for tag in self.tags:
+            if tag.startswith('worker-'):
+                return int(tag[7:])
+        return 0
+
+    @property
+    def duration(self):
+        if self.start is None or self.stop is None:
+            return None
+        return self.stop - self.start
+
+    def duration_str(self):
+        # Same format as subunit-trace
+        if self.start is None or self.stop is None:
+            return ''
+        return '%.6fs' % self.duration
+
+
+def _varint(data, pos):
+    """Return (value, size) of the subunit v2 varint at data[pos]."""
+    first = data[pos]
+    kind = first & 0xc0
+    value = first & 0x3f
+    if kind == 0x00:
+        return value, 1
+    elif kind == 0x40:
+        return (value << 8) | data[pos + 1], 2
+    elif kind == 0x80:
+        return (value << 16) | (data[pos + 1] << 8) | data[pos + 2], 3
+    return ((value << 24) | (data[pos + 1] << 16) | (data[pos + 2] << 8) |
+            data[pos + 3], 4)
+
+
+def _utf8(data, pos):
+    length, size = _varint(data, pos)
+    pos += size
+    return bytes(data[pos:pos + length]).decode('utf-8'), pos + length
+
+
+def decode_packet(packet):
+    """Turn a complete (CRC checked) packet into StreamResult.status kwargs.
+    """
+    flags = (packet[1] << 8) | packet[2]
+    pos = 3 + _varint(packet, 3)[1]
+    kwargs = {'test_status': STATUS_LOOKUP[flags & 0x0007],
+              'eof': bool(flags & FLAG_EOF)}
+    if flags & FLAG_TIMESTAMP:
+        seconds = struct.unpack('>I', bytes(packet[pos:pos + 4]))[0]
+        nanoseconds, size = _varint(packet, pos + 4)
+        pos += 4 + size
+        kwargs['timestamp'] = seconds + nanoseconds / 1e9
+    if flags & FLAG_TEST_ID:
+        kwargs['test_id'], pos = _utf8(packet, pos)
+    if flags & FLAG_TAGS:
+        count, size = _varint(packet, pos)
+        pos += size
+        tags = set()
+        for i in range(count):
+            tag, pos = _utf8(packet, pos)
+            tags.add(tag)
+        kwargs['test_tags'] = tags
+    if flags & FLAG_MIME_TYPE:
+        kwargs['mime_type'], pos = _utf8(packet, pos)
+    if flags & FLAG_FILE_CONTENT:
+        kwargs['file_name'], pos = _utf8(packet, pos)
+        length, size = _varint(packet, pos)
+        pos += size
+        kwargs['file_bytes'] = bytes(packet[pos:pos + length])
+        pos += length
+    if flags & FLAG_ROUTE_CODE:
+        kwargs['route_code'], pos = _utf8(packet, pos)
+    return kwargs
+
+
+def read_stream(stream, result):
+    """Feed result with the packets and the non subunit output of stream.
+
+    Output which is not subunit (stderr merged with 2>&1) is given to
+    result.status() with test_id=None and file_name='stdout', as subunit does
+    with non_subunit_name='stdout'. A 0xb3 byte is only taken as the start of
+    a packet when the version and checksum of that packet are valid.
+    """
+    try:
+        fileno = stream.fileno()
+    except (AttributeError, IOError, OSError, ValueError):
+        fileno = None
+    buf = bytearray()
+    eof = False
+    while True:
+        if not eof:
+            if fileno is not None:
+                data = os.read(fileno, READ_SIZE)
+            else:
+                data = stream.read(READ_SIZE)
+            eof = not data
+            buf += data
+        pos = 0
+        while pos < len(buf):
+            start = buf.find(SIGNATURE, pos)
+            if start < 0:
+                start = len(buf)
+            if start > pos:
+                result.status(file_name='stdout',
+                              file_bytes=bytes(buf[pos:start]))
+                pos = start
+                continue
+            # Need the flags and the whole length varint
+            if len(buf) - pos < 6 and not eof:
+                break
+            length = 0
+            if len(buf) - pos >= 6 and buf[pos + 1] >> 4 == 0x2:
+                length, size = _varint(buf, pos + 3)
+                if size > 3 or length < 6:
+                    length = 0
+            if length and len(buf) - pos < length:
+                if not eof:
+                    break
+                length = 0
+            if length:
+                packet = buf[pos:pos + length]
+                crc = zlib.crc32(bytes(packet[:-4])) & 0xffffffff
+                if crc == struct.unpack('>I', bytes(packet[-4:]))[0]:
+                    result.status(**decode_packet(packet))
+                    pos += length
+                    continue
+            # Not a packet, that byte belongs to the text output
+            result.status(file_name='stdout',
+                          file_bytes=bytes(buf[pos:pos + 1]))
+            pos += 1
+        del buf[:pos]
+        if eof and not buf:
+            return
+
+
+class NagiosStreamResult(object):
+    """StreamResult building the Nagios report incrementally.
+
+    Attachments are only buffered (up to max_trace_bytes each, but the
+    perfdata detail) while a test is in progress, and discarded as soon as
+    the test ends successfully.
+    """
+
+    def __init__(self, max_log_lines=200, max_trace_bytes=16384,
+                 max_failures=20):
+        self.max_trace_bytes = max_trace_bytes
+        self.max_failures = max_failures
+        self.counts = collections.Counter()
+        self.inprogress = {}
+        self.skipped = []
+        self.failures = []
+        self.failures_dropped = 0
+        self.log_lines = collections.deque(maxlen=max_log_lines)
+        self.log_lines_seen = 0
+        self.unparsed = collections.deque(maxlen=max_log_lines)
+        self.durations = {}
+        self.perfdata = collections.OrderedDict()
+        self._partial = b''
+        self._discovery_skip = 0
+        self.started = None
+        self.elapsed = 0
+
+    def startTestRun(self):
+        self.started = time.time()
+
+    def stopTestRun(self):
+        if self._partial:
+            self._handle_line(self._partial)
+            self._partial = b''
+        self.elapsed = time.time() - self.started
+
+    @property
+    def nb_tests(self):
+        return sum(self.counts[s] for s in FINAL_STATES)
+
+    def status(self, test_id=None, test_status=None, test_tags=None,
+               runnable=True, file_name=None, file_bytes=None, eof=False,
+               mime_type=None, route_code=None, timestamp=None):
+        if test_id is None:
+            if file_bytes:
+                self._handle_output(file_bytes)
+            return
+        if test_id == 'process-returncode':
+            return
+
+        record = self.inprogress.get(test_id)
+        if record is None:
+            record = self.inprogress[test_id] = TestRecord(test_id)
+        if test_tags:
+            record.tags.update(test_tags)
+        if timestamp is not None:
+            if record.start is None:
+                record.start = timestamp
+            record.stop = timestamp
+        if file_name is not None and file_bytes:
+            detail = record.details.get(file_name)
+            if detail is None:
+                detail = Bounded(MAX_PERFDATA_BYTES
+                                 if file_name == PERFDATA_DETAIL
+                                 else self.max_trace_bytes)
+                record.details[file_name] = detail
+            detail.write(file_bytes)
+        if test_status in FINAL_STATES:
+            del self.inprogress[test_id]
+            self._finish(record, test_status)
+
+    def _finish(self, record, test_status):
+        record.status = test_status
+        self.counts[test_status] += 1
+        if record.duration is not None:
+            self.durations[record.test_id] = record.duration
+        if PERFDATA_DETAIL in record.details:
+            self._add_perfdata(record.details.pop(PERFDATA_DETAIL))
+        if test_status == 'skip':
+            reason = record.details.get('reason')
+            reason = ': ' + reason.text() if reason else ''
+            self.skipped.append('{%s} %s ... SKIPPED%s' %
+                                (record.worker, record.test_id, reason))
+        elif test_status in ('fail', 'uxsuccess'):
+            if len(self.failures) < self.max_failures:
+                self.failures.append(record)
+            else:
+                self.failures_dropped += 1
+
+    def _add_perfdata(self, detail):
+        if detail.dropped:
+            self.unparsed.append('%s detail truncated (%d bytes dropped)' %
+                                 (PERFDATA_DETAIL, detail.dropped))
+            return
+        try:
+            series = json.loads(detail.text())
+        except ValueError:
+            series = None
+        if not isinstance(series, list):
+            self.unparsed.append('Invalid %s detail' % PERFDATA_DETAIL)
+            return
+        for serie in series:
+            if valid_serie(serie):
+                self.perfdata[serie['label']] = serie
+            else:
+                self.unparsed.append('Invalid %s serie : %s' % (
+                    PERFDATA_DETAIL, json.dumps(serie)))
+
+    def _handle_output(self, data):
+        lines = (self._partial + data).split(b'\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self._handle_line(line)
+
+    def _handle_line(self, line):
+        line = line.rstrip(b'\r').decode('utf-8', 'replace')
+        if self._discovery_skip > 0:
+            self._discovery_skip -= 1
+            return
+        if DISCOVERY_LINE.match(line):
+            self._discovery_skip = DISCOVERY_LINES - 1
+            return
+        if LOG_LINE.match(line):
+            self.log_lines.append(line)
+            self.log_lines_seen += 1
+        elif line.strip():
+            self.unparsed.append(line)
+
+
+def format_failure(record):
+    """Render a failed test the way the former awk filter did."""
+    out = ['', '{%s} %s [%s] ... FAILED' % (record.worker, record.test_id,
+                                            record.duration_str())]
+    for name, detail in record.details.items():
+        name = name.split(':')[0]
+        if name in ('pythonlogging', 'reason'):
+            continue
+        if name != 'traceback':
+            out.append('Captured %s' % name)
+        for line in detail.text().split('\n'):
+            if line.strip() and not LOG_ANYWHERE.search(line):
+                out.append('    %s' % line)
+    return out
+
+
+def _is_number(value):
+    return (isinstance(value, numbers.Real) and
+            not isinstance(value, bool))
+
+
+def valid_serie(serie):
+    """Whether serie is a {'label', 'value'[, 'unit', 'warn', 'crit'...]}"""
+    return (isinstance(serie, dict) and
+            isinstance(serie.get('label'), STRING_TYPES) and
+            _is_number(serie.get('value')) and
+            all(serie.get(key) is None or _is_number(serie[key])
+                for key in ('warn', 'crit', 'age')) and
+            isinstance(serie.get('unit', ''), STRING_TYPES))
+
+
+def _number(value):
+    return '' if value is None else '%g' % value
+
+
+def _value(serie):
+    value = serie['value']
+    if isinstance(value, float):
+        value = '%.3f' % value
+    return '%s%s' % (value, serie.get('unit', ''))
+
+
+def _range(serie, key):
+    # The range of a floor serie is "min:", raised below min
+    limit = _number(serie.get(key))
+    return limit + ':' if limit and serie.get('floor') else limit
+
+
+def format_serie(serie):
+    """label=value[unit];warn;crit;; as Nagios expects it"""
+    return '%s=%s;%s;%s;;' % (serie['label'], _value(serie),
+                              _range(serie, 'warn'), _range(serie, 'crit'))
+
+
+def check_thresholds(series):
+    """Return (status, messages) of the series over their thresholds"""
+    status = STATUS_OK
+    messages = []
+    for serie in series:
+        for level, key in ((STATUS_CRITICAL, 'crit'),
+                           (STATUS_WARNING, 'warn')):
+            limit = serie.get(key)
+            if limit is None:
+                continue
+            if (serie['value'] < limit if serie.get('floor') else
+                    serie['value'] > limit):
+                status = max(status, level)
+                messages.append('%s %s=%s (%s %s)' % (
+                    STATUS_ALL[level], serie['label'], _value(serie), key,
+                    _range(serie, key)))
+                break
+    return status, messages
+
+
+def apply_thresholds(series, thresholds):
+    """Set the (warning, critical) of thresholds on the series without any
+
+    The adaptive thresholds are maximums, the floor series get none, nor do
+    the series measured before the run (with an age, see perfdata.py).
+    """
+    for serie in series:
+        if serie.get('floor') or serie.get('age') is not None:
+            continue
+        if serie.get('warn') is None and serie.get('crit') is None:
+            serie['warn'], serie['crit'] = thresholds.get(serie['label'],
+                                                          (None, None))
+
+
+def build_report(result, max_time, thresholds=None):
+    """Return (status, output, perfdata) as runExit expects them.
+
+    thresholds are the adaptive {label: (warning, critical)} of the series
+    and of exec_time (see history.py).
+    """
+    counts = result.counts
+    if result.nb_tests == 0:
+        output = '\n'.join([NO_TEST] + list(result.log_lines) +
+                           list(result.unparsed))
+        return (STATUS_UNKNOWN, output,
+                "exec_time=0s;;;; nb_tests=0;;;; nb_tests_ok=0;;;; "
+                "nb_tests_ko=0;;;; nb_skipped=0;;;;")
+
+    exec_time = int(result.elapsed)
+    passed = counts['success']
+    skipped = counts['skip']
+    exfail = counts['xfail']
+    unexok = counts['uxsuccess']
+    failed = counts['fail']
+    nb_ok = passed + exfail
+    nb_ko = unexok + failed
+
+    exec_serie = {'label': 'exec_time', 'value': exec_time, 'unit': 's'}
+    thresholds = thresholds or {}
+    apply_thresholds([exec_serie], thresholds)
+    counters = (result.nb_tests, nb_ok, nb_ko, skipped)
+    perfdata = format_serie(exec_serie) + (
+        " nb_tests=%d;;;; nb_tests_ok=%d;;;; nb_tests_ko=%d;;;; "
+        "nb_skipped=%d;;;;" % counters)
+    infodata = ("exec_time=%ds nb_tests=%d nb_tests_ok=%d nb_tests_ko=%d "
+                "nb_skipped=%d" % ((exec_time,) + counters))
+
+    # Same precedence as before : OK, then WARNING, then CRITICAL
+    status = STATUS_CRITICAL if nb_ko else STATUS_OK
+    if passed > 0 or exfail > 0:
+        status = STATUS_OK
+    if exec_time > max_time or skipped > 0 or unexok > 0:
+        status = STATUS_WARNING
+
+    out = []
+    if result.log_lines:
+        out.append('-------------- Captured logging --------------')
+        dropped = result.log_lines_seen - len(result.log_lines)
+        if dropped:
+            out.append('[... %d earlier log lines dropped ...]' % dropped)
+        out.extend(result.log_lines)
+
+    if skipped > 0:
+        out.append('-------------- Skipped Tests --------------')
+        out.extend(result.skipped)
+
+    series = list(result.perfdata.values())
+    apply_thresholds(series, thresholds)
+    if series:
+        perfdata = ' '.join([perfdata] + [format_serie(s) for s in series])
+    if series or 'exec_time' in thresholds:
+        serie_status, messages = check_thresholds(
+            series + ([exec_serie] if 'exec_time' in thresholds else []))
+        if messages:
+            out.append('-------------- Thresholds --------------')
+            out.extend(messages)
+            if status != STATUS_CRITICAL:
+                status = max(status, serie_status)
+
+    if failed > 0:
+        status = STATUS_CRITICAL
+        out.append('-------------- Details / Trace --------------')
+        out.extend(result.unparsed)
+        for record in result.failures:
+            out.extend(format_failure(record))
+        if result.failures_dropped:
+            out.append('')
+            out.append('[... %d more failed tests ...]' %
+                       result.failures_dropped)
+        out.append('')
+        out.append('')
+
+    out.append('-------------- Summary --------------')
+    out.append('Ran: %d tests in %.4f sec.' % (result.nb_tests,
+                                                result.elapsed))
+    out.append(' - Passed: %d' % passed)
+    out.append(' - Skipped: %d' % skipped)
+    out.append(' - Expected Fail: %d' % exfail)
+    out.append(' - Unexpected Success: %d' % unexok)
+    out.append(' - Failed: %d' % failed)
+
+    header = '%s : %s' % (STATUS_ALL[status], infodata)
+    return status, '\n'.join([header] + out), perfdata
+
+
+def report(result, max_time, history_path=None, check=None, adaptive=None):
+    """build_report, with the history of check (see history.py)"""
+    if not history_path:
+        return build_report(result, max_time)
+    thresholds = None
+    try:
+        store = history.History(history_path)
+        try:
+            if adaptive and result.nb_tests:
+                thresholds = store.thresholds(
+                    check, ['exec_time'] + list(result.perfdata), adaptive)
+            if result.nb_tests:
+                store.record(check, history.run_values(result))
+        finally:
+            store.close()
+    except (sqlite3.Error, OSError) as exc:
+        # The check itself has run : report it anyway
+        sys.stderr.write('Cannot use the history %s (%s)\n' %
+                         (history_path, exc))
+    return build_report(result, max_time, thresholds)
+
+
+def format_exit(status, output, perfdata):
+    return '%s\nStatus : exit %d (%s) | %s' % (output, status,
+                                                STATUS_ALL[status], perfdata)
+
+
+def parse_stream(stream, **kwargs):
+    result = NagiosStreamResult(**kwargs)
+    result.startTestRun()
+    try:
+        read_stream(stream, result)
+    finally:
+        result.stopTestRun()
+    return result
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Filter a subunit v2 stream for Nagios/Icinga')
+    parser.add_argument('-t', '--timeout', dest='max_time', type=int,
+                        default=180,
+                        help='Raise a WARNING if the test(s) run longer')
+    parser.add_argument('--max-log-lines', type=int, default=200,
+                        help='Keep only the last N captured log lines')
+    parser.add_argument('--max-trace-bytes', type=int, default=16384,
+                        help='Truncate each failure attachment to N bytes')
+    parser.add_argument('--max-failures', type=int, default=20,
+                        help='Detail at most N failed tests')
+    parser.add_argument('--history',
+                        help='Append the values of the run to this history '
+                             'file (SQLite, see history.py)')
+    parser.add_argument('--check', default='default',
+                        help='Name of the check in the history')
+    parser.add_argument('--adaptive', choices=history.ADAPTIVE_MODES,
+                        help='Thresholds of the series without any, from '
+                             'the history of the check')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    # A check stopped by SIGTERM still reports the cleanup of its tests
+    # (see fgcloud/terminate.py), SIGKILL ends it
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    stream = getattr(sys.stdin, 'buffer', sys.stdin)
+    result = parse_stream(stream, max_log_lines=args.max_log_lines,
+                          max_trace_bytes=args.max_trace_bytes,
+                          max_failures=args.max_failures)
+    status, output, perfdata = report(result, args.max_time, args.history,
+                                      args.check, args.adaptive)
+    print(format_exit(status, output, perfdata))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+import unittest
+
+try:
+    # fgcloud/ is tempest/api/fgcloud/ of a tempest tree
+    from tempest.api.fgcloud import executor
+except ImportError:
+    executor = None
+
+
+class Recorder(object):
+    """Tasks which record their order and how many of them run at once"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = []
+        self.running = 0
+        self.max_running = 0
+
+    def task(self, name, result=None, delay=0, error=None):
+        def func():
+            with self.lock:
+                self.calls.append(name)
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            try:
+                time.sleep(delay)
+                if error is not None:
+                    raise error
+                return result
+            finally:
+                with self.lock:
+                    self.running -= 1
+        return func
+
+
+@unittest.skipIf(executor is None, 'tempest is not installed')
+class TestTaskGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.recorder = Recorder()
+        self.graph = executor.TaskGraph('test', max_workers=4)
+
+    def add(self, name, requires=(), **kwargs):
+        self.graph.add(name, self.recorder.task(name, **kwargs), requires)
+
+    def states(self):
+        return dict((t.name, t.state) for t in self.graph.tasks.values())
+
+    def test_requires(self):
+        self.add('network', result='net', delay=0.05)
+        self.add('keypair', result='key')
+        self.add('server', ['network', 'keypair'], result='vm')
+        self.add('volume', result='vol', delay=0.1)
+        self.add('attach', ['server', 'volume'], result='ok')
+        self.assertEqual({'network': 'net', 'keypair': 'key', 'server': 'vm',
+                          'volume': 'vol', 'attach': 'ok'}, self.graph.run())
+        calls = self.recorder.calls
+        self.assertLess(calls.index('network'), calls.index('server'))
+        self.assertLess(calls.index('keypair'), calls.index('server'))
+        self.assertEqual('attach', calls[-1])
+        self.assertEqual([], self.graph.report())
+        self.assertEqual(list(self.graph.tasks), list(self.graph.timings))
+
+    def test_concurrent(self):
+        # The wall time is the critical path, not the sum of the tasks
+        for i in range(4):
+            self.add(str(i), delay=0.2)
+        self.graph.run()
+        self.assertEqual(4, self.recorder.max_running)
+        self.assertLess(self.graph.elapsed, 0.6)
+
+    def test_max_workers(self):
+        self.graph.max_workers = 2
+        for i in range(6):
+            self.add(str(i), delay=0.02)
+        self.graph.run()
+        self.assertEqual(6, len(self.recorder.calls))
+        self.assertEqual(2, self.recorder.max_running)
+
+    def test_unknown_requirement(self):
+        self.add('network')
+        self.assertRaises(ValueError, self.add, 'server', ['networks'])
+        self.assertEqual(['network'], list(self.graph.tasks))
+
+    def test_failed(self):
+        self.add('network', error=RuntimeError('No more IP'))
+        self.add('keypair', delay=0.05)
+        self.add('server', ['network', 'keypair'])
+        self.add('attach', ['server'])
+        self.assertRaises(RuntimeError, self.graph.run)
+        self.assertEqual({'network': 'failed', 'keypair': 'done',
+                          'server': 'skipped', 'attach': 'skipped'},
+                         self.states())
+        self.assertEqual(set(['network', 'keypair']),
+                         set(self.recorder.calls))
+
+    def test_report(self):
+        self.add('network', error=RuntimeError('No more IP'))
+        self.add('keypair', result='key')
+        self.add('server', ['network'])
+        results = self.graph.run(raise_errors=False)
+        self.assertEqual('key', results['keypair'])
+        self.assertIsNone(results['server'])
+        report = self.graph.report()
+        self.assertEqual([('network', 'failed', 'RuntimeError: No more IP'),
+                          ('server', 'skipped', None)],
+                         [(r['task'], r['state'], r['error'])
+                          for r in report])
+        self.assertIsNotNone(report[0]['elapsed'])
+        self.assertIsNone(report[1]['elapsed'])
+        self.assertEqual(['network', 'keypair'], list(self.graph.timings))
+
+    def test_deadline(self):
+        self.add('fast')
+        self.add('slow', delay=1)
+        self.add('after', ['slow'])
+        start = time.time()
+        self.graph.run(deadline=start + 0.2, raise_errors=False)
+        self.assertLess(time.time() - start, 0.8)
+        self.assertEqual({'fast': 'done', 'slow': 'timeout',
+                          'after': 'skipped'}, self.states())
+        self.assertEqual(['slow', 'after'],
+                         [r['task'] for r in self.graph.report()])
+        self.assertGreater(self.graph.timings['slow'], 0.15)
+
+    def test_expired_deadline(self):
+        self.add('network')
+        self.graph.run(deadline=time.time() - 1)
+        self.assertEqual({'network': 'skipped'}, self.states())
+        self.assertEqual([], self.recorder.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from monitoring import history
+from monitoring import subunit_filter
+
+NOW = 1500000000
+CHECK = 'tempest.conf:tempest.api.fgcloud.test_basic_scenario'
+
+
+class TestPercentile(unittest.TestCase):
+
+    def test_percentile(self):
+        values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
+        self.assertEqual(1, history.percentile(values, 0))
+        self.assertEqual(6, history.percentile(values, 50))
+        self.assertEqual(11, history.percentile(values, 100))
+        self.assertAlmostEqual(10.5, history.percentile(values, 95))
+
+    def test_edges(self):
+        self.assertIsNone(history.percentile([], 50))
+        self.assertEqual(4, history.percentile([4], 99))
+        self.assertEqual(3, history.median([5, 1, 3]))
+        self.assertEqual(2.5, history.median([4, 1, 3, 2]))
+
+
+class TestHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp()
+        self.history = history.History(os.path.join(self.dirname, 'h.db'))
+
+    def tearDown(self):
+        self.history.close()
+        shutil.rmtree(self.dirname)
+
+    def record(self, values, label='boot_time', start=NOW - 3600, step=60):
+        for i, value in enumerate(values):
+            self.history.record(CHECK, [(label, value)], start + i * step)
+
+    def test_record(self):
+        self.record([3, 1, 2])
+        self.history.record('other', [('boot_time', 10)], NOW)
+        self.assertEqual([1, 2, 3],
+                         self.history.values(CHECK, 'boot_time', 0))
+        self.assertEqual([1, 2], self.history.values(
+            CHECK, 'boot_time', NOW - 3600 + 60))
+        self.assertEqual([], self.history.values(CHECK, 'attach_time', 0))
+
+    def test_run_values(self):
+        result = subunit_filter.NagiosStreamResult()
+        result.startTestRun()
+        result.status(test_id='a', test_status='inprogress', timestamp=10.0)
+        result.status(test_id='a', file_name=subunit_filter.PERFDATA_DETAIL,
+                      file_bytes=b'[{"label": "boot_time", "value": 12.5}, '
+                                 b'{"label": "pool_boot_time", "value": 30, '
+                                 b'"age": 600}]')
+        result.status(test_id='a', test_status='success', timestamp=12.0)
+        result.status(test_id='b', test_status='fail')
+        result.status(test_id='c', test_status='skip')
+        result.stopTestRun()
+        result.elapsed = 42.9
+        self.assertEqual([('exec_time', 42), ('nb_tests', 3),
+                          ('nb_tests_ok', 1), ('nb_tests_ko', 1),
+                          ('nb_skipped', 1), ('boot_time', 12.5),
+                          ('test:a', 2.0)], history.run_values(result))
+
+    def test_downsample(self):
+        day = history.DAY
+        # 2 samples an hour, 10 days ago, then one a day ago
+        hour = (NOW - 10 * day) // 3600 * 3600
+        for i in range(4):
+            self.history.record(CHECK, [('boot_time', 10 + i)],
+                                hour + i * 1800)
+        self.history.record(CHECK, [('boot_time', 100)], NOW - day)
+        self.history.downsample(NOW)
+        self.assertEqual([100], self.history.values(CHECK, 'boot_time', 0))
+        self.assertEqual([(hour, 2, 10.5, 10, 11),
+                          (hour + 3600, 2, 12.5, 12, 13)],
+                         self.history.hourly(CHECK, 'boot_time', 0))
+
+        # The hourly rows expire too
+        self.history.downsample(NOW + history.HOURLY_DAYS * day)
+        self.assertEqual([], self.history.hourly(CHECK, 'boot_time', 0))
+
+    def test_not_enough_samples(self):
+        self.record(range(history.MIN_SAMPLES - 1))
+        for mode in history.ADAPTIVE_MODES:
+            self.assertEqual({}, self.history.thresholds(
+                CHECK, ['boot_time', 'attach_time'], mode, NOW))
+
+    def test_window(self):
+        # The samples older than the window are not part of the baseline
+        self.record(range(history.MIN_SAMPLES),
+                    start=NOW - (history.WINDOW_DAYS + 1) * history.DAY)
+        self.assertEqual({}, self.history.thresholds(
+            CHECK, ['boot_time'], 'percentile', NOW))
+
+    def test_percentile_thresholds(self):
+        self.record(range(1, 101))
+        warning, critical = self.history.thresholds(
+            CHECK, ['boot_time'], 'percentile', NOW)['boot_time']
+        self.assertAlmostEqual(95.05, warning)
+        self.assertAlmostEqual(99.01, critical)
+
+    def test_mad_thresholds(self):
+        # median 20, MAD 2
+        self.record([18, 22] * 20 + [20] * 3 + [100])
+        self.assertEqual({'boot_time': (26, 30)}, self.history.thresholds(
+            CHECK, ['boot_time'], 'mad', NOW))
+
+    def test_mad_min_spread(self):
+        # A steady series : 5% of the median instead of a null MAD
+        self.record([100] * 40 + [101])
+        warning, critical = self.history.thresholds(
+            CHECK, ['boot_time'], 'mad', NOW)['boot_time']
+        self.assertAlmostEqual(115, warning)
+        self.assertAlmostEqual(125, critical)
+
+    def test_null_spread(self):
+        # Neither the MAD nor the median of 35 runs of 0s are a spread
+        self.record([0] * 35, label='exec_time')
+        for mode in history.ADAPTIVE_MODES:
+            self.assertEqual({'exec_time': (3, 5)}, self.history.thresholds(
+                CHECK, ['exec_time'], mode, NOW))
+
+    def test_percentile_min_spread(self):
+        self.record([100] * 40 + [101])
+        warning, critical = self.history.thresholds(
+            CHECK, ['boot_time'], 'percentile', NOW)['boot_time']
+        self.assertAlmostEqual(115, warning)
+        self.assertAlmostEqual(125, critical)
+
+    def test_steady_exec_time(self):
+        # A run 1s longer than 35 runs of 0s is still OK
+        self.record([0] * 35, label='exec_time')
+        thresholds = self.history.thresholds(CHECK, ['exec_time'], 'mad',
+                                             NOW)
+        result = subunit_filter.NagiosStreamResult()
+        result.startTestRun()
+        result.status(test_id='a', test_status='success')
+        result.stopTestRun()
+        result.elapsed = 1.5
+        status, output, perfdata = subunit_filter.build_report(
+            result, 180, thresholds)
+        self.assertEqual(subunit_filter.STATUS_OK, status)
+        self.assertTrue(perfdata.startswith('exec_time=1s;3;5;;'))
+
+
+if __name__ == '__main__':
+    unittest.main()
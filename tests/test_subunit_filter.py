@@ -0,0 +1,399 @@
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import io
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+from monitoring import subunit_filter as sf
+
+try:
+    import subunit
+except ImportError:
+    subunit = None
+
+try:
+    from os_testr import subunit_trace
+except ImportError:
+    subunit_trace = None
+
+DIRNAME = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEGACY = os.path.join(DIRNAME, 'benchmarks', 'legacy_getperfdata.sh')
+# subunit-trace, which python-subunit >= 1.4 no longer gives its test_results
+SUBUNIT_TRACE = [sys.executable, '-c',
+                 'import sys, subunit.test_results; '
+                 'from os_testr.subunit_trace import main; sys.exit(main())']
+
+TEST_ID = 'tempest.api.fgcloud.test_unit.TestUnit.test_%s'
+LOG = (b'2016-01-01 00:00:00.000 4242 INFO tempest.lib.common.rest_client '
+       b'[req-1] Request (TestUnit:test_%s): 200 GET http://controller\n')
+TRACE = (b'Traceback (most recent call last):\n'
+         b'  File "test_unit.py", line 42, in test_%s\n'
+         b'    self.assertEqual(4, 5)\n'
+         b'MismatchError: 4 != 5\n')
+
+
+def run_tests(result, tests):
+    """Feed result with (name, status[, perfdata series]) tests
+
+    Each test logs a line, the failed ones have a traceback, the skipped ones
+    a reason.
+    """
+    for i, test in enumerate(tests):
+        name, status = test[:2]
+        test_id = TEST_ID % name
+        result.status(test_id=test_id, test_status='inprogress',
+                      timestamp=1000.0 + i, test_tags=set(['worker-0']))
+        result.status(file_name='stdout', file_bytes=LOG % name.encode())
+        if len(test) > 2:
+            result.status(test_id=test_id, file_name=sf.PERFDATA_DETAIL,
+                          file_bytes=json.dumps(test[2]).encode('utf-8'),
+                          eof=True, mime_type='application/json')
+        if status == 'fail':
+            result.status(test_id=test_id, file_name='traceback',
+                          file_bytes=TRACE % name.encode(), eof=True,
+                          mime_type='text/x-traceback; charset=utf8')
+        elif status == 'skip':
+            result.status(test_id=test_id, file_name='reason',
+                          file_bytes=b'Not today', eof=True,
+                          mime_type='text/plain; charset=utf8')
+        result.status(test_id=test_id, test_status=status,
+                      timestamp=1000.5 + i)
+
+
+def parse(tests, **kwargs):
+    result = sf.NagiosStreamResult(**kwargs)
+    result.startTestRun()
+    run_tests(result, tests)
+    result.stopTestRun()
+    return result
+
+
+def encode(tests):
+    """The subunit v2 stream of tests, with the log lines in between"""
+    output = io.BytesIO()
+
+    class Writer(object):
+        def __init__(self):
+            self.writer = subunit.StreamResultToBytes(output)
+
+        def status(self, file_name=None, file_bytes=None, **kwargs):
+            if kwargs.get('test_id') is None:
+                output.write(file_bytes)
+                return
+            if 'timestamp' in kwargs:
+                kwargs['timestamp'] = datetime.datetime.fromtimestamp(
+                    kwargs['timestamp'], subunit.iso8601.UTC)
+            self.writer.status(file_name=file_name, file_bytes=file_bytes,
+                               **kwargs)
+
+    run_tests(Writer(), tests)
+    return output.getvalue()
+
+
+def last_line(output):
+    """Status line without exec_time, which is wall clock dependant"""
+    line = output.rstrip('\n').split('\n')[-1]
+    return ' '.join(v for v in line.split(' ')
+                    if not v.startswith('exec_time='))
+
+
+class TestReport(unittest.TestCase):
+
+    def report(self, tests, max_time=180, thresholds=None, **kwargs):
+        result = parse(tests, **kwargs)
+        return result, sf.build_report(result, max_time, thresholds)
+
+    def test_all_passed(self):
+        result, (status, output, perfdata) = self.report(
+            [('a', 'success'), ('b', 'success'), ('c', 'xfail')])
+        self.assertEqual(sf.STATUS_OK, status)
+        self.assertEqual('exec_time=0s;;;; nb_tests=3;;;; nb_tests_ok=3;;;; '
+                         'nb_tests_ko=0;;;; nb_skipped=0;;;;', perfdata)
+        self.assertTrue(output.startswith(
+            'OK : exec_time=0s nb_tests=3 nb_tests_ok=3 nb_tests_ko=0 '
+            'nb_skipped=0\n'))
+        self.assertIn('-------------- Captured logging --------------',
+                      output)
+        self.assertEqual(3, result.log_lines_seen)
+        self.assertEqual({TEST_ID % 'a': 0.5, TEST_ID % 'b': 0.5,
+                          TEST_ID % 'c': 0.5}, result.durations)
+
+    def test_failed(self):
+        result, (status, output, perfdata) = self.report(
+            [('a', 'success'), ('b', 'fail')])
+        self.assertEqual(sf.STATUS_CRITICAL, status)
+        self.assertIn('nb_tests_ok=1;;;; nb_tests_ko=1;;;;', perfdata)
+        self.assertIn('{0} %s [0.500000s] ... FAILED' % (TEST_ID % 'b'),
+                      output)
+        self.assertIn('    MismatchError: 4 != 5', output)
+        self.assertNotIn('test_a', output.split('Details / Trace')[1])
+
+    def test_only_failed(self):
+        status = self.report([('a', 'fail'), ('b', 'uxsuccess')])[1][0]
+        self.assertEqual(sf.STATUS_CRITICAL, status)
+
+    def test_unexpected_success(self):
+        status, output, perfdata = self.report(
+            [('a', 'success'), ('b', 'uxsuccess')])[1]
+        self.assertEqual(sf.STATUS_WARNING, status)
+        self.assertIn('nb_tests_ko=1;;;;', perfdata)
+
+    def test_skipped(self):
+        status, output, perfdata = self.report(
+            [('a', 'success'), ('b', 'skip')])[1]
+        self.assertEqual(sf.STATUS_WARNING, status)
+        self.assertIn('nb_skipped=1;;;;', perfdata)
+        self.assertIn('{0} %s ... SKIPPED: Not today' % (TEST_ID % 'b'),
+                      output)
+
+    def test_too_long(self):
+        result = parse([('a', 'success')])
+        result.elapsed = 200.7
+        status, output, perfdata = sf.build_report(result, 180)
+        self.assertEqual(sf.STATUS_WARNING, status)
+        self.assertTrue(perfdata.startswith('exec_time=200s;;;;'))
+
+    def test_no_test(self):
+        result = parse([])
+        result.status(file_name='stdout', file_bytes=b'ImportError: tempest\n')
+        status, output, perfdata = sf.build_report(result, 180)
+        self.assertEqual(sf.STATUS_UNKNOWN, status)
+        self.assertEqual([sf.NO_TEST, 'ImportError: tempest'],
+                         output.split('\n'))
+        self.assertEqual('exec_time=0s;;;; nb_tests=0;;;; nb_tests_ok=0;;;; '
+                         'nb_tests_ko=0;;;; nb_skipped=0;;;;', perfdata)
+
+    def test_failures_bounded(self):
+        status, output, perfdata = self.report(
+            [(str(i), 'fail') for i in range(5)], max_failures=2)[1]
+        self.assertEqual(2, output.count('... FAILED'))
+        self.assertIn('[... 3 more failed tests ...]', output)
+
+    def test_log_lines_bounded(self):
+        result, (status, output, perfdata) = self.report(
+            [(str(i), 'success') for i in range(5)], max_log_lines=2)
+        self.assertEqual(2, len(result.log_lines))
+        self.assertIn('[... 3 earlier log lines dropped ...]', output)
+
+    def test_discovery_lines(self):
+        result = parse([])
+        result.status(file_name='stdout', file_bytes=(
+            b'running=${PYTHON:-python} -m subunit.run discover -t ./ '
+            b'${OS_TEST_PATH:-./tempest/test_discover} --list\n'
+            b'1\n2\n3\n4\nnot discovery\n'))
+        self.assertEqual(['not discovery'], list(result.unparsed))
+
+    def test_partial_lines(self):
+        result = parse([])
+        result.status(file_name='stdout', file_bytes=b'2016-01-01 par')
+        result.status(file_name='stdout', file_bytes=b'tial\n2016-01-02 e')
+        result.stopTestRun()
+        self.assertEqual(['2016-01-01 partial', '2016-01-02 e'],
+                         list(result.log_lines))
+
+
+class TestPerfdata(unittest.TestCase):
+
+    def report(self, series, thresholds=None):
+        result = parse([('a', 'success', series)])
+        return result, sf.build_report(result, 180, thresholds)
+
+    def test_series(self):
+        result, (status, output, perfdata) = self.report([
+            {'label': 'boot_time', 'value': 12.3456, 'unit': 's',
+             'warn': 60, 'crit': 120},
+            {'label': 'nb_servers', 'value': 3}])
+        self.assertEqual(sf.STATUS_OK, status)
+        self.assertTrue(perfdata.endswith(
+            ' boot_time=12.346s;60;120;; nb_servers=3;;;;'))
+        self.assertNotIn('Thresholds', output)
+
+    def test_over_thresholds(self):
+        status, output, perfdata = self.report([
+            {'label': 'boot_time', 'value': 90, 'unit': 's',
+             'warn': 60, 'crit': 120},
+            {'label': 'attach_time', 'value': 150, 'unit': 's',
+             'warn': 60, 'crit': 120}])[1]
+        self.assertEqual(sf.STATUS_CRITICAL, status)
+        self.assertIn('WARNING boot_time=90s (warn 60)', output)
+        self.assertIn('CRITICAL attach_time=150s (crit 120)', output)
+
+    def test_floor(self):
+        status, output, perfdata = self.report([
+            {'label': 'free_ips', 'value': 4, 'warn': 10, 'crit': 2,
+             'floor': True}])[1]
+        self.assertEqual(sf.STATUS_WARNING, status)
+        self.assertIn('free_ips=4;10:;2:;;', perfdata)
+        self.assertIn('WARNING free_ips=4 (warn 10:)', output)
+
+    def test_adaptive_thresholds(self):
+        status, output, perfdata = self.report(
+            [{'label': 'boot_time', 'value': 30, 'unit': 's'},
+             {'label': 'floor', 'value': 1, 'floor': True},
+             {'label': 'fixed', 'value': 5, 'warn': 10}],
+            {'boot_time': (20, 40), 'floor': (2, 3), 'fixed': (1, 2),
+             'exec_time': (10, 20)})[1]
+        self.assertEqual(sf.STATUS_WARNING, status)
+        self.assertTrue(perfdata.startswith('exec_time=0s;10;20;; '))
+        self.assertIn(' boot_time=30s;20;40;; floor=1;;;; fixed=5;10;;;',
+                      perfdata)
+        self.assertIn('WARNING boot_time=30s (warn 20)', output)
+
+    def test_aged_series(self):
+        # Measured before the run : no adaptive thresholds
+        status, output, perfdata = self.report(
+            [{'label': 'pool_boot_time', 'value': 90, 'unit': 's',
+              'age': 3000},
+             {'label': 'pool_slot_age', 'value': 3000, 'unit': 's'}],
+            {'pool_boot_time': (20, 40), 'pool_slot_age': (3600, 7200)})[1]
+        self.assertEqual(sf.STATUS_OK, status)
+        self.assertIn(' pool_boot_time=90s;;;; '
+                      'pool_slot_age=3000s;3600;7200;;', perfdata)
+
+    def test_adaptive_thresholds_failed(self):
+        # A failure is CRITICAL whatever the thresholds
+        result = parse([('a', 'fail',
+                         [{'label': 'boot_time', 'value': 30}])])
+        status = sf.build_report(result, 180, {'boot_time': (20, 40)})[0]
+        self.assertEqual(sf.STATUS_CRITICAL, status)
+
+    def test_invalid_series(self):
+        result, (status, output, perfdata) = self.report([
+            {'label': 'boot_time', 'value': 12},
+            {'label': 'nan', 'value': 'fast'},
+            {'label': 'bool', 'value': True},
+            {'label': 'warn', 'value': 1, 'warn': '60'},
+            {'label': 'age', 'value': 1, 'age': 'old'},
+            {'value': 1},
+            'boot_time=12'])
+        self.assertEqual(sf.STATUS_OK, status)
+        self.assertEqual(['boot_time'], list(result.perfdata))
+        self.assertEqual(6, len(result.unparsed))
+        self.assertTrue(all(line.startswith('Invalid fgcloud-perfdata serie')
+                            for line in result.unparsed))
+
+    def test_invalid_detail(self):
+        for detail in ({'label': 'boot_time', 'value': 1}, 'boot_time'):
+            result = self.report(detail)[0]
+            self.assertEqual({}, result.perfdata)
+            self.assertEqual(['Invalid fgcloud-perfdata detail'],
+                             list(result.unparsed))
+
+    def test_not_json(self):
+        result = parse([])
+        result.status(test_id='a', test_status='inprogress')
+        result.status(test_id='a', file_name=sf.PERFDATA_DETAIL,
+                      file_bytes=b'[{"label": ')
+        result.status(test_id='a', test_status='success')
+        self.assertEqual(['Invalid fgcloud-perfdata detail'],
+                         list(result.unparsed))
+
+    def test_truncated_detail(self):
+        # The perfdata detail is not bounded by max_trace_bytes
+        series = [{'label': 'serie_%d' % i, 'value': i} for i in range(100)]
+        result = parse([('a', 'success', series)], max_trace_bytes=64)
+        self.assertEqual(100, len(result.perfdata))
+
+        result = parse([])
+        result.status(test_id='a', test_status='inprogress')
+        result.status(test_id='a', file_name=sf.PERFDATA_DETAIL,
+                      file_bytes=b' ' * (sf.MAX_PERFDATA_BYTES + 10))
+        result.status(test_id='a', test_status='success')
+        self.assertEqual({}, result.perfdata)
+        self.assertEqual(['fgcloud-perfdata detail truncated '
+                          '(10 bytes dropped)'], list(result.unparsed))
+
+
+@unittest.skipIf(subunit is None, 'python-subunit is not installed')
+class TestStream(unittest.TestCase):
+
+    TESTS = [('ok', 'success',
+              [{'label': 'boot_time', 'value': 1.5, 'unit': 's'}]),
+             ('fail', 'fail'), ('skip', 'skip'), ('xfail', 'xfail')]
+
+    def test_parse_stream(self):
+        decoded = sf.parse_stream(io.BytesIO(encode(self.TESTS)))
+        direct = parse(self.TESTS)
+        self.assertEqual(direct.counts, decoded.counts)
+        self.assertEqual(direct.durations, decoded.durations)
+        self.assertEqual(direct.perfdata, decoded.perfdata)
+        self.assertEqual(list(direct.log_lines), list(decoded.log_lines))
+        self.assertEqual(list(direct.unparsed), list(decoded.unparsed))
+        self.assertEqual(direct.skipped, decoded.skipped)
+        decoded.elapsed = direct.elapsed
+        self.assertEqual(sf.build_report(direct, 180),
+                         sf.build_report(decoded, 180))
+
+    def test_not_a_packet(self):
+        # A 0xb3 byte in the text output is not the start of a packet
+        stream = b'2016-01-01 \xb3 log\n' + encode([('ok', 'success')])
+        result = sf.parse_stream(io.BytesIO(stream))
+        self.assertEqual(1, result.counts['success'])
+        self.assertEqual(u'2016-01-01 \ufffd log', result.log_lines[0])
+
+
+@unittest.skipIf(subunit_trace is None, 'os-testr is not installed')
+class TestLegacyParity(unittest.TestCase):
+    """Same exit status and perfdata as the former subunit-trace | awk"""
+
+    def legacy(self, stream):
+        trace = subprocess.Popen(SUBUNIT_TRACE, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE)
+        trace_out = trace.communicate(stream)[0]
+        env = dict(os.environ, MAXTIME='180',
+                   TRACE_STATUS=str(trace.returncode))
+        with open(os.devnull, 'w') as devnull:
+            legacy = subprocess.Popen(['bash', LEGACY], env=env,
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE, stderr=devnull)
+        output = legacy.communicate(trace_out)[0]
+        return legacy.returncode, last_line(output.decode('utf-8'))
+
+    def filter(self, stream):
+        result = sf.parse_stream(io.BytesIO(stream))
+        status, output, perfdata = sf.build_report(result, 180)
+        return status, last_line(sf.format_exit(status, output, perfdata))
+
+    def assertParity(self, tests):
+        stream = encode(tests)
+        self.assertEqual(self.legacy(stream), self.filter(stream))
+
+    def test_passed(self):
+        self.assertParity([('a', 'success'), ('b', 'success')])
+
+    def test_failed(self):
+        self.assertParity([('a', 'success'), ('b', 'fail')])
+
+    def test_only_failed(self):
+        self.assertParity([('a', 'fail')])
+
+    def test_skipped(self):
+        self.assertParity([('a', 'success'), ('b', 'skip'), ('c', 'skip')])
+
+    def test_mixed(self):
+        self.assertParity([(str(i), ('success', 'fail', 'skip')[i % 3])
+                           for i in range(30)])
+
+    def test_no_test(self):
+        self.assertParity([])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/bin/bash
+
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+##############################################################################
+# Run more and more copies of the basic scenario at once (see fgcloud/boot_storm.py)
+##############################################################################
+
+# Default values
+CONF_FILE="tempest.conf"
+ARGS=()
+
+# Other variables
+DIRNAME="$( cd "$(dirname "$0")/.." ; pwd -P )"
+TEMPEST=$DIRNAME/tempest
+RUN_CMD="$TEMPEST/tools/with_venv.sh"
+
+# Functions
+
+usage () {
+    echo "Usage: $0 [OPTION] ..."
+    echo "Run 1, 2, 4, 8... copies of test_basic_scenario at once, one account of accounts.yaml each"
+    echo "Report the latency of each phase and the failure rate at each level"
+    echo ""
+    echo "  -c <file>     Use a custom tempest.conf file (default : tempest.conf)"
+    echo "                Must be in $DIRNAME/config/"
+    echo "  -l <levels>   Runs at once of each level, quoted (default : '1 2 4 8')"
+    echo "  -t <seconds>  A run is killed after this time (default : 900)"
+    echo "  -p <seconds>  Pause between two levels (default : 30)"
+    echo "  -o <file>     Write the report as JSON to this file"
+    echo "  -s            Do not sweep the leftovers of the failed runs"
+    echo "  -j            Print the report as JSON"
+    echo "  -h            Print this help message"
+    echo ""
+    echo "Exemple : $0 -c tempest.conf -l '1 2 4 8 16' -o storm.json"
+    exit 1
+}
+
+runMain () {
+    # Load custom tempest.conf file
+    if [ -f `readlink -f "$DIRNAME/config/$CONF_FILE"` ]; then
+        CONF_FILE=`readlink -f "$DIRNAME/config/$CONF_FILE"`
+        export TEMPEST_CONFIG_DIR=`dirname "$CONF_FILE"`
+        export TEMPEST_CONFIG=`basename "$CONF_FILE"`
+    fi
+
+    # The storm runs from the $TEMPEST/ directory, like the tests
+    cd $TEMPEST
+    exec $RUN_CMD python -m tempest.api.fgcloud.boot_storm "${ARGS[@]}"
+}
+
+# Validate options
+if ! OPTIONS=$(getopt -o c:l:t:p:o:sjh -- "$@") ; then
+    usage
+fi
+
+eval set -- $OPTIONS
+
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -c)
+            CONF_FILE=$2
+            shift 2
+            ;;
+
+        -l)
+            ARGS+=(--levels $2)
+            shift 2
+            ;;
+
+        -t)
+            ARGS+=(--timeout "$2")
+            shift 2
+            ;;
+
+        -p)
+            ARGS+=(--pause "$2")
+            shift 2
+            ;;
+
+        -o)
+            # The storm runs from $TEMPEST/
+            ARGS+=(--output `readlink -f "$2"`)
+            shift 2
+            ;;
+
+        -s)
+            ARGS+=(--no-sweep)
+            shift
+            ;;
+
+        -j)
+            ARGS+=(--json)
+            shift
+            ;;
+
+        -h)
+            usage
+            ;;
+
+        --)
+            shift
+            break
+            ;;
+
+        *)
+            echo "Incorrect input : $1"
+            usage
+            ;;
+    esac
+done
+
+runMain
+
+# EOF
@@ -1,19 +1,126 @@
 #!/bin/bash
 
-echo "Cleaning resources not deleted by tests..."
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+##############################################################################
+# Delete the resources not deleted by the tests (see fgcloud/sweeper.py)
+##############################################################################
 
-if [ ! $OS_USERNAME ]; then
-   echo "You must source an rc file first !"
-   echo "Exiting."
-   exit 1
+# Default values
+CONF_FILE="tempest.conf"
+ARGS=()
+
+# Other variables
+DIRNAME="$( cd "$(dirname "$0")/.." ; pwd -P )"
+TEMPEST=$DIRNAME/tempest
+RUN_CMD="$TEMPEST/tools/with_venv.sh"
+
+# Functions
+
+usage () {
+    echo "Usage: $0 [OPTION] ..."
+    echo "Delete the resources not deleted by the tests, for the accounts of accounts.yaml"
+    echo ""
+    echo "  -c <file>     Use a custom tempest.conf file (default : tempest.conf)"
+    echo "                Must be in $DIRNAME/config/"
+    echo "  -p <prefix>   Prefix of the resource names (default : [DEFAULT]resources_prefix)"
+    echo "  -u <user>     Only this account of accounts.yaml (repeat for more)"
+    echo "  -w <number>   API calls at the same time (default : [fgcloud]max_workers)"
+    echo "  -f            Release the unassociated floating IPs too"
+    echo "  -n            Dry run : list the resources, do not delete them"
+    echo "  -j            Print the report as JSON"
+    echo "  -h            Print this help message"
+    echo ""
+    echo "Exemple : $0 -c tempest.conf -p fgmonitoring -n"
+    exit 1
+}
+
+runMain () {
+    # Load custom tempest.conf file
+    if [ -f `readlink -f "$DIRNAME/config/$CONF_FILE"` ]; then
+        CONF_FILE=`readlink -f "$DIRNAME/config/$CONF_FILE"`
+        export TEMPEST_CONFIG_DIR=`dirname "$CONF_FILE"`
+        export TEMPEST_CONFIG=`basename "$CONF_FILE"`
+    fi
+
+    # The sweeper runs from the $TEMPEST/ directory, like the tests
+    cd $TEMPEST
+    exec $RUN_CMD python -m tempest.api.fgcloud.sweeper "${ARGS[@]}"
+}
+
+# Validate options
+if ! OPTIONS=$(getopt -o c:p:u:w:fnjh -- "$@") ; then
+    usage
 fi
 
-types=(server image snapshot volume keypair "security group" "floating ip") 
+eval set -- $OPTIONS
+
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -c)
+            CONF_FILE=$2
+            shift 2
+            ;;
+
+        -p)
+            ARGS+=(--prefix "$2")
+            shift 2
+            ;;
+
+        -u)
+            ARGS+=(--username "$2")
+            shift 2
+            ;;
 
-for type in "${types[@]}"; do
-    items=$(openstack $type list | awk '/fgmonitoring/{print $2}')
-    for i in $items; do
-        echo "Deleting $type $i"
-        openstack $type delete $i
-    done
+        -w)
+            ARGS+=(--workers "$2")
+            shift 2
+            ;;
+
+        -f)
+            ARGS+=(--free-ips)
+            shift
+            ;;
+
+        -n)
+            ARGS+=(--dry-run)
+            shift
+            ;;
+
+        -j)
+            ARGS+=(--json)
+            shift
+            ;;
+
+        -h)
+            usage
+            ;;
+
+        --)
+            shift
+            break
+            ;;
+
+        *)
+            echo "Incorrect input : $1"
+            usage
+            ;;
+    esac
 done
+
+runMain
+
+# EOF
@@ -1,69 +1,120 @@
 #!/bin/bash
-source ../config/admin-creds
-
-prefix=tempest
-
-keystone user-list | grep $prefix | awk '{print $2}' > /tmp/tmp-users
-nb_users=$(cat /tmp/tmp-users | wc -l)
-keystone tenant-list | grep $prefix | awk '{print $2}' > /tmp/tmp-tenants
-nb_tenants=$(cat /tmp/tmp-tenants | wc -l)
-neutron router-list | grep $prefix | awk '{print $2}' > /tmp/tmp-routers
-nb_routers=$(cat /tmp/tmp-routers | wc -l)
-neutron subnet-list | grep $prefix | awk '{print $2}' > /tmp/tmp-subnets
-nb_subnets=$(cat /tmp/tmp-subnets | wc -l)
-neutron net-list | grep $prefix | awk '{print $2}' > /tmp/tmp-nets
-nb_nets=$(cat /tmp/tmp-nets | wc -l)
-
-if [[ $nb_users == "0" && $nb_tenants == "0" && $nb_routers == "0" && $nb_subnets == "0" && $nb_nets == "0" ]]; then
-	echo "Nothing to delete ? Cancelling..."
-	exit 1
-else
-	echo "Let's go..."
+
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+##############################################################################
+# Delete the tempest users, projects and networks (see fgcloud/teardown.py)
+##############################################################################
+
+# Default values
+CONF_FILE="tempest.conf"
+ARGS=()
+
+# Other variables
+DIRNAME="$( cd "$(dirname "$0")/.." ; pwd -P )"
+TEMPEST=$DIRNAME/tempest
+RUN_CMD="$TEMPEST/tools/with_venv.sh"
+
+# Functions
+
+usage () {
+    echo "Usage: $0 [OPTION] ..."
+    echo "Delete the users, projects, routers, subnets and networks named after a prefix"
+    echo "As admin : with the credentials of config/admin-creds, or the [auth]admin_* ones of tempest.conf"
+    echo ""
+    echo "  -c <file>     Use a custom tempest.conf file (default : tempest.conf)"
+    echo "                Must be in $DIRNAME/config/"
+    echo "  -p <prefix>   Prefix of the resource names (default : tempest)"
+    echo "  -w <number>   API calls at the same time (default : [fgcloud]max_workers)"
+    echo "  -n            Dry run : list the resources, do not delete them"
+    echo "  -j            Print the report as JSON"
+    echo "  -h            Print this help message"
+    echo ""
+    echo "Exemple : $0 -p tempest_ -n"
+    exit 1
+}
+
+runMain () {
+    # Load custom tempest.conf file
+    if [ -f `readlink -f "$DIRNAME/config/$CONF_FILE"` ]; then
+        CONF_FILE=`readlink -f "$DIRNAME/config/$CONF_FILE"`
+        export TEMPEST_CONFIG_DIR=`dirname "$CONF_FILE"`
+        export TEMPEST_CONFIG=`basename "$CONF_FILE"`
+    fi
+
+    # Admin credentials
+    if [ -f "$DIRNAME/config/admin-creds" ]; then
+        source "$DIRNAME/config/admin-creds"
+    fi
+
+    # The teardown runs from the $TEMPEST/ directory, like the tests
+    cd $TEMPEST
+    exec $RUN_CMD python -m tempest.api.fgcloud.teardown "${ARGS[@]}"
+}
+
+# Validate options
+if ! OPTIONS=$(getopt -o c:p:w:njh -- "$@") ; then
+    usage
 fi
 
-echo "Users to delete : $nb_users"
-now=$nb_users
-for id in $(cat /tmp/tmp-users) ; do 
-   keystone user-delete $id
-   now=$((now - 1))
-   echo "Done for $id, still $now / $nb_users users to do !"
-done
+eval set -- $OPTIONS
 
-echo "Tenants to delete : $nb_tenants"
-now=$nb_tenants
-for id in $(cat /tmp/tmp-tenants) ; do 
-   keystone tenant-delete $id
-   now=$((now - 1))
-   echo "Done for $id, still $now / $nb_tenants tenants to do !"
-done
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -c)
+            CONF_FILE=$2
+            shift 2
+            ;;
 
-echo "Routers to delete : $nb_routers"
-now=$nb_routers
-for id in $(cat /tmp/tmp-routers) ; do 
-   neutron router-gateway-clear $id
-   subnet_ids=$(neutron router-port-list $id | grep subnet_id | awk -F '"' '{ print $4; }')
-   for sub_id in $subnet_ids ; do
-      neutron router-interface-delete $id $sub_id
-   done
-   neutron router-delete $id
-   now=$((now - 1))
-   echo "Done for $id, still $now / $nb_routers routers to do !"
-done
+        -p)
+            ARGS+=(--prefix "$2")
+            shift 2
+            ;;
 
-echo "Subnets to delete : $nb_subnets"
-now=$nb_subnets
-for id in $(cat /tmp/tmp-subnets) ; do 
-   neutron subnet-delete $id
-   now=$((now - 1))
-   echo "Done for $id, still $now / $nb_subnets subnets to do !"
-done
+        -w)
+            ARGS+=(--workers "$2")
+            shift 2
+            ;;
+
+        -n)
+            ARGS+=(--dry-run)
+            shift
+            ;;
 
-echo "Networks to delete : $nb_nets"
-now=$nb_nets
-for id in $(cat /tmp/tmp-nets) ; do 
-   neutron net-delete $id
-   now=$((now - 1))
-   echo "Done for $id, still $now / $nb_nets networks to do !"
+        -j)
+            ARGS+=(--json)
+            shift
+            ;;
+
+        -h)
+            usage
+            ;;
+
+        --)
+            shift
+            break
+            ;;
+
+        *)
+            echo "Incorrect input : $1"
+            usage
+            ;;
+    esac
 done
 
-echo "Done !"
+runMain
+
+# EOF
@@ -1,48 +1,151 @@
 #!/bin/bash
 
-EXT_NET_NAME=ext-net
-# Max 9 users
-NB_USERS_TO_CREATE=6
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+##############################################################################
+# Create the tempest accounts of accounts.yaml (see fgcloud/provision.py)
+##############################################################################
 
-load_admin_creds() {
-    source ../config/admin-creds
+# Default values
+CONF_FILE="tempest.conf"
+ARGS=()
+
+# Other variables
+DIRNAME="$( cd "$(dirname "$0")/.." ; pwd -P )"
+TEMPEST=$DIRNAME/tempest
+RUN_CMD="$TEMPEST/tools/with_venv.sh"
+
+# Functions
+
+usage () {
+    echo "Usage: $0 [OPTION] ..."
+    echo "Create the users, projects, networks, subnets and routers of the tempest accounts, and write accounts.yaml"
+    echo "As admin : with the credentials of config/admin-creds, or the [auth]admin_* ones of tempest.conf"
+    echo "Only the missing resources are created, run it again after a failure"
+    echo ""
+    echo "  -c <file>     Use a custom tempest.conf file (default : tempest.conf)"
+    echo "                Must be in $DIRNAME/config/"
+    echo "  -a <number>   Number of accounts (default : 6)"
+    echo "  -p <prefix>   Prefix of the resource names (default : tempest)"
+    echo "  -s <cidr>     Range of the subnets of the accounts (default : 192.168.0.0/16)"
+    echo "  -l <length>   Prefix length of the subnets (default : 24)"
+    echo "  -e <network>  External network of the routers (default : [network]public_network_id)"
+    echo "  -o <file>     accounts.yaml to write (default : [auth]test_accounts_file)"
+    echo "  -w <number>   API calls at the same time (default : [fgcloud]max_workers)"
+    echo "  -n            Dry run : list what is missing, do not create it"
+    echo "  -j            Print the report as JSON"
+    echo "  -h            Print this help message"
+    echo ""
+    echo "Exemple : $0 -a 60 -s 10.64.0.0/16 -e ext-net"
+    exit 1
+}
+
+runMain () {
+    # Load custom tempest.conf file
+    if [ -f `readlink -f "$DIRNAME/config/$CONF_FILE"` ]; then
+        CONF_FILE=`readlink -f "$DIRNAME/config/$CONF_FILE"`
+        export TEMPEST_CONFIG_DIR=`dirname "$CONF_FILE"`
+        export TEMPEST_CONFIG=`basename "$CONF_FILE"`
+    fi
+
+    # Admin credentials
+    if [ -f "$DIRNAME/config/admin-creds" ]; then
+        source "$DIRNAME/config/admin-creds"
+    fi
+
+    # The provisioner runs from the $TEMPEST/ directory, like the tests
+    cd $TEMPEST
+    exec $RUN_CMD python -m tempest.api.fgcloud.provision "${ARGS[@]}"
 }
 
-RAND=$(tr -dc A-Za-z0-9_ < /dev/urandom | head -c 7 | xargs)
-TMP_FILE=/tmp/tempest_tmp_$RAND
-LOG_FILE=/tmp/tempest_log_$RAND
+# Validate options
+if ! OPTIONS=$(getopt -o c:a:p:s:l:e:o:w:njh -- "$@") ; then
+    usage
+fi
+
+eval set -- $OPTIONS
 
-echo "# Generated users for use with tempest API" > $TMP_FILE
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -c)
+            CONF_FILE=$2
+            shift 2
+            ;;
 
-for i in $(seq 1 $NB_USERS_TO_CREATE); do
-	echo "========================= User $i =========================" 2>&1 | tee -a $LOG_FILE
-	load_admin_creds
-	genpass=$(tr -dc A-Za-z0-9_ < /dev/urandom | head -c 16 | xargs)
-	keystone tenant-create --name tempest_tenant_$i --description "Tempest tenant $i" 2>&1 | tee -a $LOG_FILE
-	keystone user-create --name tempest_user_$i --pass $genpass --tenant tempest_tenant_$i 2>&1 | tee -a $LOG_FILE
+        -a)
+            ARGS+=(--accounts "$2")
+            shift 2
+            ;;
 
-	export OS_TENANT_NAME=tempest_tenant_$i
-	export OS_USERNAME=tempest_user_$i
-	export OS_PASSWORD=$genpass
+        -p)
+            ARGS+=(--prefix "$2")
+            shift 2
+            ;;
 
-	neutron net-create tempest_net_$i 2>&1 | tee -a $LOG_FILE
-	neutron subnet-create tempest_net_$i --name tempest_subnet_$i --gateway "192.168.24"$i".1" "192.168.24"$i".0/24" 2>&1 | tee -a $LOG_FILE
-	neutron router-create tempest_router_$i 2>&1 | tee -a $LOG_FILE
-	neutron router-interface-add tempest_router_$i tempest_subnet_$i 2>&1 | tee -a $LOG_FILE
-	neutron router-gateway-set tempest_router_$i $EXT_NET_NAME 2>&1 | tee -a $LOG_FILE
+        -s)
+            ARGS+=(--supernet "$2")
+            shift 2
+            ;;
 
-	echo -e "\n# Test user $i" >> $TMP_FILE
-	echo "- username: 'tempest_user_$i'" >> $TMP_FILE
-	echo "  tenant_name: 'tempest_tenant_$i'" >> $TMP_FILE
-	echo "  password: '$genpass'" >> $TMP_FILE
-	echo "  resources:" >> $TMP_FILE
-	echo "    network: 'tempest_net_$i'" >> $TMP_FILE
+        -l)
+            ARGS+=(--prefixlen "$2")
+            shift 2
+            ;;
 
+        -e)
+            ARGS+=(--external-network "$2")
+            shift 2
+            ;;
+
+        -o)
+            ARGS+=(--output "$(readlink -f "$2")")
+            shift 2
+            ;;
+
+        -w)
+            ARGS+=(--workers "$2")
+            shift 2
+            ;;
+
+        -n)
+            ARGS+=(--dry-run)
+            shift
+            ;;
+
+        -j)
+            ARGS+=(--json)
+            shift
+            ;;
+
+        -h)
+            usage
+            ;;
+
+        --)
+            shift
+            break
+            ;;
+
+        *)
+            echo "Incorrect input : $1"
+            usage
+            ;;
+    esac
 done
-echo -e "\n\nLOG_FILE for job $RAND is here : $LOG_FILE" 
-echo -e "\nCopy the file $TMP_FILE to accounts.yaml and use it for tempest"
-echo -e "File dump :\n---start---"
-cat $TMP_FILE
-echo -e "\n---end---"
 
-cp -f $TMP_FILE ../config/accounts.yaml
+runMain
+
+# EOF
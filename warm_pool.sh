@@ -0,0 +1,96 @@
+#!/bin/bash
+
+# Copyright 2015 France-Grilles - IDGC - CNRS
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+##############################################################################
+# Keep warm servers, volumes and floating IPs ready for test_basic_scenario
+##############################################################################
+
+# Default values
+CONF_FILE="tempest.conf"
+
+# Other variables
+DIRNAME="$( cd "$(dirname "$0")" ; pwd -P )"
+TEMPEST=$DIRNAME/tempest
+RUN_CMD="$TEMPEST/tools/with_venv.sh"
+
+# Functions
+
+usage () {
+    echo "Usage: $0 [OPTION] ..."
+    echo "Run the warm pool daemon of a site (see fgcloud/pool.py)"
+    echo "Stop it with SIGTERM, it then deletes all its resources"
+    echo ""
+    echo "  -c <file>     Use a custom tempest.conf file (default : tempest.conf)"
+    echo "                Must be in $(pwd)/config/"
+    echo "  -s            Print the slots of the running daemon"
+    echo "  -h            Print this help message"
+    echo ""
+    echo "Exemple : $0 -c tempest.conf &"
+    exit 1
+}
+
+runMain () {
+    # Load custom tempest.conf file
+    if [ -f `readlink -f "$DIRNAME/config/$CONF_FILE"` ]; then
+        CONF_FILE=`readlink -f "$DIRNAME/config/$CONF_FILE"`
+        export TEMPEST_CONFIG_DIR=`dirname "$CONF_FILE"`
+        export TEMPEST_CONFIG=`basename "$CONF_FILE"`
+    fi
+
+    # The daemon runs from the $TEMPEST/ directory, like the tests
+    cd $TEMPEST
+    exec $RUN_CMD python -m tempest.api.fgcloud.pool $STATUS
+}
+
+# Validate options
+if ! OPTIONS=$(getopt -o c:sh -- "$@") ; then
+    usage
+fi
+
+eval set -- $OPTIONS
+
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -c)
+            CONF_FILE=$2
+            shift 2
+            ;;
+
+        -s)
+            STATUS="--status"
+            shift
+            ;;
+
+        -h)
+            usage
+            ;;
+
+        --)
+            shift
+            break
+            ;;
+
+        *)
+            echo "Incorrect input : $1"
+            usage
+            ;;
+    esac
+done
+
+runMain
+
+# EOF